@@ -2,38 +2,54 @@ import cv2
 import numpy as np
 import json
 import os
+import argparse
+from utils.pipeline import bounded, add_sink_arguments, run_sink
+from utils.video_reader import VideoReader
+from utils.parallel import parallel_frames
+from utils.hsv_lut import segment, load_compiled_limits
+from utils.blobs import Blobs
+from utils.frame_processing import CachedEqualizer, add_equalize_arguments, equalize_from_args
+from utils.motion import BACKENDS, FALLBACKS, make_estimator
+from utils.morphology import elliptical, add_morph_arguments, set_iou_check, print_iou_report
+from utils.metrics import metrics, add_metrics_arguments, configure_from_args
+from utils.records import add_records_arguments, writer_from_args
 os.environ['OPENCV_FFMPEG_READ_ATTEMPTS'] = '8192' 
 
-def morphology(frame):
+def morphology(frame, morph_mode='exact'):
 
     # 1º juntar as areas muito proximas
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
-    frame = cv2.morphologyEx(frame, cv2.MORPH_CLOSE, kernel)
+    frame = elliptical(frame, cv2.MORPH_CLOSE, (7, 7), morph_mode)
 
     # 2ª remover as area pequenas, provavelmente são noise
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (10, 10))
-    frame = cv2.morphologyEx(frame, cv2.MORPH_OPEN, kernel)
+    frame = elliptical(frame, cv2.MORPH_OPEN, (10, 10), morph_mode)
 
     # 3ª juntar as areas que estão relativamente perto melhor visualização
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (30, 30))
-    frame = cv2.morphologyEx(frame, cv2.MORPH_CLOSE, kernel)
+    frame = elliptical(frame, cv2.MORPH_CLOSE, (30, 30), morph_mode)
 
     return frame 
 
 def algea_contours(frame, filtered):  
-    # Encontrar contornos na máscara 
-    contours, _ = cv2.findContours(filtered, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
     # Tamanho mínimo do contorno
     min_area = 500  
 
-    # Filtrar contornos
-    for contour in contours:
-        if cv2.contourArea(contour) >= min_area:
-            cv2.drawContours(frame, [contour], 0, (0, 255, 0), 2)
+    # Filtrar as regiões pela área numa só passagem e traçar só os contornos das que ficam
+    blobs = Blobs(filtered, min_area)
+    cv2.drawContours(frame, blobs.contours(), -1, (0, 255, 0), 2)
     
     return frame
 
+def algae_regions(filtered, min_area=500):
+    # Resumo de cada região de algas (o mesmo filtro que algea_contours, sem desenhar):
+    # (área, perímetro, centroide, caixa (x, y, w, h), polígono simplificado Nx2)
+    blobs = Blobs(filtered, min_area)
+    regions = []
+    for i in range(len(blobs)):
+        contour = blobs.contour(i)
+        perimeter = cv2.arcLength(contour, True)
+        polygon = cv2.approxPolyDP(contour, 0.005 * perimeter, True).reshape(-1, 2)
+        regions.append((float(blobs.areas[i]), perimeter, tuple(blobs.centroids[i]), tuple(blobs.boxes[i]), polygon))
+    return regions
+
 def load_limits_from_json(json_file):
     #Carregar limites de H, S, V a partir de um arquivo JSON
     if os.path.exists(json_file):
@@ -48,7 +64,253 @@ def load_limits_from_json(json_file):
                 return min_lim, max_lim
     return None, None
 
+# Limites padrão, usados quando não há limits.json
+DEFAULT_MIN_LIM = [
+    np.array([30, 50, 65]),
+    np.array([40, 50, 65]),
+    np.array([50, 50, 65]),
+    np.array([65, 50, 65]),
+]
+
+DEFAULT_MAX_LIM = [
+    np.array([40, 255, 255]),
+    np.array([50, 255, 255]),
+    np.array([65, 255, 255]),
+    np.array([75, 255, 255]),
+]
+
+# Margem à volta das faixas segmentadas de novo no modo incremental (alcance dos kernels do morphology)
+STRIP_PAD = 48
+
+def exposed_borders(transform, width, height):
+    # Profundidade (esquerda, direita, cima, baixo) das faixas da imagem que a transformação afim
+    # deixa sem correspondência: como os lados são retas, os extremos estão nos cantos
+    corners = np.array([[0, 0, 1], [width, 0, 1], [0, height, 1], [width, height, 1]], dtype=np.float64)
+    (x00, y00), (x10, y10), (x01, y01), (x11, y11) = corners @ transform.T
+    depths = (max(x00, x01), width - min(x10, x11), max(y00, y10), height - min(y01, y11))
+    return [int(np.clip(np.ceil(d), 0, limit)) for d, limit in zip(depths, (width, width, height, height))]
+
+class IncrementalAlgae:
+    # Modo incremental: as algas são estáticas, por isso a segmentação e o morphology só correm no frame
+    # inteiro nos keyframes (a cada `keyframe_every` frames ou quando a cena muda). Nos outros frames a máscara
+    # do keyframe é levada para o frame atual com a transformação afim acumulada desde o keyframe (sem acumular
+    # arredondamentos) e só as faixas da borda que entraram no campo de visão são segmentadas de novo.
+    # O movimento é estimado em frames a preto e branco reduzidos `scale` vezes. Quando a estimação falha
+    # usa-se a transformação do fallback ('last' ou 'identity'), validada pelo mesmo teste de mudança de cena.
+
+    def __init__(self, lut, morph_mode='exact', keyframe_every=15, motion='features', scene_threshold=20,
+                 max_exposed=0.3, scale=2, fallback='last'):
+        self.lut = lut
+        self.morph_mode = morph_mode
+        self.keyframe_every = max(1, keyframe_every)
+        self.estimator = make_estimator(motion, fallback)
+        self.scene_threshold = scene_threshold
+        self.max_exposed = max_exposed
+        self.scale = scale
+
+        self.prev_small = None
+        self.ones = None
+        self.key_mask = None
+        self.transform = None  # Keyframe -> frame atual, 3x3
+        self.age = 0
+        self.keyframes = 0
+        self.frames = 0
+
+    def segment(self, frame_eq):
+        frame_hsv = cv2.cvtColor(frame_eq, cv2.COLOR_BGR2HSV)
+        return morphology(segment(frame_hsv, self.lut), self.morph_mode)
+
+    def keyframe(self, frame_eq):
+        with metrics.stage('algae_keyframe'):
+            self.key_mask = self.segment(frame_eq)
+        self.transform = np.eye(3)
+        self.estimator.reset()
+        self.age = 0
+        self.keyframes += 1
+        return self.key_mask
+
+    def update(self, frame_eq):
+        # Máscara final do frame (equalizado)
+        self.frames += 1
+        h, w = frame_eq.shape[:2]
+        gray = cv2.cvtColor(frame_eq, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, (w // self.scale, h // self.scale), interpolation=cv2.INTER_AREA)
+        prev, self.prev_small = self.prev_small, small
+        if prev is None or self.age + 1 >= self.keyframe_every:
+            return self.keyframe(frame_eq)
+
+        with metrics.stage('algae_motion'):
+            step, _ = self.estimator.estimate_pair(prev, small)
+
+            # Mudança de cena (ou fallback errado): o frame anterior alinhado já não se parece com o atual
+            if self.ones is None or self.ones.shape != small.shape:
+                self.ones = np.full(small.shape, 255, dtype=np.uint8)
+            sh, sw = small.shape
+            aligned = cv2.warpAffine(prev, step, (sw, sh))
+            valid = cv2.warpAffine(self.ones, step, (sw, sh), flags=cv2.INTER_NEAREST)
+            if cv2.mean(cv2.absdiff(aligned, small), mask=valid)[0] > self.scene_threshold:
+                return self.keyframe(frame_eq)
+
+        step = np.vstack((step, [0, 0, 1]))
+        step[:2, 2] *= self.scale
+        transform = step @ self.transform
+        left, right, top, bottom = exposed_borders(transform[:2], w, h)
+        if (left + right) / w + (top + bottom) / h > self.max_exposed:
+            return self.keyframe(frame_eq)
+        self.transform = transform
+        self.age += 1
+
+        with metrics.stage('algae_propagate'):
+            mask = cv2.warpAffine(self.key_mask, transform[:2], (w, h), flags=cv2.INTER_NEAREST)
+            # Faixas novas (x0, y0, x1, y1), segmentadas com uma margem para o morphology ver a vizinhança
+            strips = [(0, 0, left, h), (w - right, 0, w, h), (0, 0, w, top), (0, h - bottom, w, h)]
+            for x0, y0, x1, y1 in strips:
+                if x1 <= x0 or y1 <= y0:
+                    continue
+                px0, py0 = max(0, x0 - STRIP_PAD), max(0, y0 - STRIP_PAD)
+                px1, py1 = min(w, x1 + STRIP_PAD), min(h, y1 + STRIP_PAD)
+                strip = self.segment(frame_eq[py0:py1, px0:px1])
+                mask[y0:y1, x0:x1] = strip[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+        return mask
+
+    def print_stats(self):
+        print(f"Algas incrementais: {self.keyframes} keyframes em {self.frames} frames "
+              f"(movimento estimado com '{self.estimator.name}')")
+
+def algae_frame(frame, lut, width=1280, height=720, morph_mode='exact', render=True, with_mask=False, equalizer=None,
+                incremental=None):
+    # Processar um único frame; não depende de frames anteriores (exceto através do equalizer).
+    # Devolve o frame anotado; com render=False só a máscara final e com with_mask o frame anotado
+    # com a máscara como 4º canal (para passar os dois pela memória partilhada do parallel_frames).
+    # equalizer (um CachedEqualizer) reaproveita as LUTs de equalização dos frames anteriores e
+    # incremental (um IncrementalAlgae) propaga a máscara dos frames anteriores em vez de a recalcular.
+    if frame.shape[:2] != (height, width):
+        frame = cv2.resize(frame, (width, height))
+
+    with metrics.stage('equalize'):
+        if equalizer is not None:
+            frame_eq = equalizer.apply(frame)
+        else:
+            # Separar os canais para equalizar
+            b,g,r = cv2.split(frame)
+
+            # Equalizar todos os canais para aumentar o contraste
+            b_eq = cv2.equalizeHist(b)
+            g_eq = cv2.equalizeHist(g)
+            r_eq = cv2.equalizeHist(r)
+
+            # Combinar os canais novamente
+            frame_eq = cv2.merge((b_eq, g_eq, r_eq))
+
+    if incremental is not None:
+        final_mask = incremental.update(frame_eq)
+    else:
+        with metrics.stage('segment'):
+            # Converter a frame para HSV para melhor detetar as cores pertendidas
+            frame_hsv = cv2.cvtColor(frame_eq, cv2.COLOR_BGR2HSV)
+
+            # Mascara com os pixeis que constam em algum dos limites, numa só passagem pela LUT compilada
+            combined_mask = segment(frame_hsv, lut)
+
+        # Filtragem morfológica 
+        with metrics.stage('morphology'):
+            final_mask = morphology(combined_mask, morph_mode)
+
+    if not render:
+        return final_mask
+
+    # Aplicar contornos
+    with metrics.stage('algea_contours'):
+        frame_eq = algea_contours(frame_eq, final_mask)
+    if with_mask:
+        return np.dstack((frame_eq, final_mask))
+    return frame_eq
+
+class AlgaeStage:
+    # Estágio das algas para o motor com uma só descodificação (utils/engine.py): usa o frame
+    # equalizado e o HSV partilhados com os outros detetores
+    name = 'algae'
+
+    def __init__(self, lut, morph_mode='exact', records=None, incremental=None):
+        self.lut = lut
+        self.morph_mode = morph_mode
+        self.records = records
+        self.incremental = incremental
+
+    def process(self, shared, prev, canvas):
+        if self.incremental is not None:
+            final_mask = self.incremental.update(shared.eq)
+        else:
+            with metrics.stage('segment'):
+                combined_mask = segment(shared.hsv, self.lut)
+            with metrics.stage('morphology'):
+                final_mask = morphology(combined_mask, self.morph_mode)
+
+        if canvas is not None:
+            with metrics.stage('algea_contours'):
+                algea_contours(canvas, final_mask)
+        if self.records is not None:
+            with metrics.stage('algae_regions'):
+                self.records.add_algae(algae_regions(final_mask))
+
+def process_algae(frames, lut, width=1280, height=720, workers=1, chunk_size=4, morph_mode='exact', records=None, render=True,
+                  equalize=None, incremental=None):
+    # Processar os frames um a um e devolver cada frame anotado.
+    # Com records (um RecordWriter) as regiões de algas de cada frame são guardadas;
+    # com render=False nada é desenhado e é devolvido o índice do frame em vez da imagem.
+    # equalize são os parâmetros de um CachedEqualizer e incremental um IncrementalAlgae
+    # (só no modo sequencial: passam estado de frame para frame).
+    with_mask = render and records is not None
+    if workers > 1 and (equalize is not None or incremental is not None):
+        raise ValueError("a equalização com LUTs em cache e o modo incremental não podem ser usados com vários processos")
+    args = (lut, width, height, morph_mode, render, with_mask)
+    if equalize is not None or incremental is not None:
+        args += (CachedEqualizer(**equalize) if equalize is not None else None, incremental)
+    if workers > 1:
+        # Os frames são independentes, por isso podem ser distribuídos por vários processos
+        # (as latências por etapa só são medidas no modo sequencial)
+        out_shape = (height, width, 4 if with_mask else 3) if render else (height, width)
+        outputs = parallel_frames(frames, algae_frame, out_shape, workers, chunk_size, args=args)
+    else:
+        outputs = (algae_frame(frame, *args) for frame in frames)
+
+    for i, output in enumerate(outputs):
+        if records is not None:
+            mask = output[..., 3] if with_mask else output
+            with metrics.stage('algae_regions'):
+                records.add_algae(algae_regions(np.ascontiguousarray(mask)))
+            records.end_frame()
+            if with_mask:
+                output = np.ascontiguousarray(output[..., :3])
+        metrics.frame()
+        yield output if render else i
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Deteção de algas")
+    add_sink_arguments(parser, 1 / 30)
+    parser.add_argument('--workers', type=int, default=1, help="número de processos (1 = sem paralelismo, 0 = todos os cores)")
+    parser.add_argument('--chunk', type=int, default=4, help="frames enviados a cada processo de uma vez")
+    add_morph_arguments(parser)
+    add_metrics_arguments(parser)
+    add_records_arguments(parser)
+    add_equalize_arguments(parser)
+    parser.add_argument('--incremental', type=int, default=0,
+                        help="segmentar o frame inteiro só a cada N frames e propagar a máscara nos outros (0 = desligado)")
+    parser.add_argument('--motion', choices=sorted(BACKENDS), default='features', help="estimador do movimento da câmara (com --incremental)")
+    parser.add_argument('--motion-fallback', choices=FALLBACKS, default='last',
+                        help="transformação usada quando a estimação do movimento falha (com --incremental)")
+    parser.add_argument('--scene-threshold', type=float, default=20,
+                        help="diferença média entre frames alinhados a partir da qual se força um keyframe (com --incremental)")
+    args = parser.parse_args()
+    if args.eq_refresh > 1 and args.workers != 1:
+        parser.error("--eq-refresh só pode ser usado com --workers 1")
+    if args.incremental and args.workers != 1:
+        parser.error("--incremental só pode ser usado com --workers 1")
+    if args.morph_check and args.workers != 1:
+        # O IoU seria medido nos processos filhos e o relatório do processo principal ficaria vazio
+        parser.error("--morph-check só pode ser usado com --workers 1")
+    configure_from_args(args, 'algae')
+
     # Carregar o vídeo
     cap = cv2.VideoCapture('peixe.mp4')
 
@@ -64,19 +326,7 @@ if __name__ == '__main__':
 
     # Definir limites padrão caso o JSON não exista
     if not min_lim or not max_lim:
-        min_lim = [
-            np.array([30, 50, 65]),
-            np.array([40, 50, 65]),       
-            np.array([50, 50, 65]),
-            np.array([65, 50, 65]),
-        ]
-
-        max_lim = [
-            np.array([40, 255, 255]),
-            np.array([50, 255, 255]),
-            np.array([65, 255, 255]),
-            np.array([75, 255, 255]),
-        ]
+        min_lim, max_lim = DEFAULT_MIN_LIM, DEFAULT_MAX_LIM
 
     # Exibir os limites carregados ou padrão
     print("╭──────────────────────────╮")
@@ -91,62 +341,30 @@ if __name__ == '__main__':
         else:
             print(f"└───┴──────────┴───────────┘")
             
-    # Inicialização de variáveis
-    width = 1280
-    height = 720
-    processed_frames = []
-
-    print("Processando vídeo")
-
-    #Processar todos os frames e armazenar
-    while True:
-        ret, frame = cap.read()
-        if not ret:             
-            break
-        frame = cv2.resize(frame, (width, height))
-
-        # Separar os canais para equalizar
-        b,g,r = cv2.split(frame)
-
-        # Equalizar todos os canais para aumentar o contraste
-        b_eq = cv2.equalizeHist(b)
-        g_eq = cv2.equalizeHist(g)
-        r_eq = cv2.equalizeHist(r)
-
-        # Combinar os canais novamente
-        frame_eq = cv2.merge((b_eq, g_eq, r_eq))
-
-        # Converter a frame para HSV para melhor detetar as cores pertendidas
-        frame_hsv = cv2.cvtColor(frame_eq, cv2.COLOR_BGR2HSV)
-
-        # Percorrer por todos os limites defenido e a criar a mascara com apenas os pixeis que constam nesses valor e juntar todas as mascaras
-        combined_mask = np.zeros(frame_hsv.shape[:2], dtype=np.uint8)
-        for l_min, l_max in zip(min_lim, max_lim):
-            mask = cv2.inRange(frame_hsv, l_min, l_max)
-            combined_mask = cv2.bitwise_or(combined_mask, mask)
+    # Compilar os limites uma única vez (ou reutilizar a versão guardada ao lado do JSON)
+    lut = load_compiled_limits(json_file, min_lim, max_lim)
 
-        # Filtragem morfológica 
-        final_mask = morphology(combined_mask)
-
-        # Aplicar contornos
-        frame_eq = algea_contours(frame_eq, final_mask)
-
-        # Guardar os frames para apresentar depois
-        processed_frames.append(frame_eq)     
-  
-    cap.release()
-    input(f"\nProcessamento concluído: {len(processed_frames)} frames processados.\nPrecione enter para reproduzir o vídeo\n")
-    
-    #Reproduzir os frames processados a 30 FPS
-    frame_interval = 1 / 30  
-
-    for i, frame in enumerate(processed_frames):
-        cv2.imshow('Processed', frame)
-        if i==1:
-            cv2.waitKey(0)
-        # Aguardar o tempo necessário para manter 30 FPS
-        if cv2.waitKey(int(frame_interval * 1000)) & 0xFF == ord('q'):
-            break
+    # A comparação com a morfologia exata só é feita no processo principal
+    set_iou_check(args.morph_check)
 
+    print("Processando vídeo")
 
-    cv2.destroyAllWindows()
+    # Os frames passam pelo pipeline um a um, com buffers limitados entre estágios
+    # A descodificação corre numa thread à parte e já entrega os frames no tamanho de processamento
+    frames = VideoReader(cap, (1280, 720), args.buffer)
+    records = writer_from_args(args, {'pipeline': 'algae', 'video': 'peixe.mp4', 'width': 1280, 'height': 720})
+    incremental = None
+    if args.incremental:
+        incremental = IncrementalAlgae(lut, args.morph, args.incremental, args.motion, args.scene_threshold,
+                                       fallback=args.motion_fallback)
+    processed = bounded(process_algae(frames, lut, workers=args.workers or os.cpu_count(), chunk_size=args.chunk, morph_mode=args.morph,
+                                      records=records, render=not args.no_render, equalize=equalize_from_args(args),
+                                      incremental=incremental), args.buffer)
+    run_sink(processed, args, cap.get(cv2.CAP_PROP_FPS) or 30, pause_first=True)
+    if records is not None:
+        records.close()
+    frames.print_stats()
+    if incremental is not None:
+        incremental.print_stats()
+    print_iou_report()
+    metrics.export()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import cv2
+import argparse
+from utils.engine import run_stages
+from utils.frame_processing import Preprocessor, add_equalize_arguments, equalize_from_args
+from utils.hsv_lut import load_compiled_limits
+from utils.metrics import metrics, add_metrics_arguments, configure_from_args
+from utils.morphology import add_morph_arguments, set_iou_check, print_iou_report
+from utils.motion import add_motion_arguments, make_estimator
+from utils.pipeline import bounded, add_sink_arguments, run_sink
+from utils.records import add_records_arguments, writer_from_args
+from utils.video_reader import VideoReader
+import algea_final
+import with_tracking
+import without_tracking
+
+# Deteção de algas e de peixes numa só passagem pelo vídeo: cada frame é descodificado e
+# pré-processado uma vez e os detetores desenham no mesmo frame (utils/engine.py)
+
+FISH_SCRIPTS = {'with_tracking': with_tracking, 'without_tracking': without_tracking}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Deteção de algas e peixes numa só passagem")
+    add_sink_arguments(parser, 1 / 10)
+    add_morph_arguments(parser)
+    add_metrics_arguments(parser)
+    add_records_arguments(parser)
+    add_motion_arguments(parser)
+    add_equalize_arguments(parser)
+    parser.add_argument('--video', default='peixe.MP4', help="vídeo a processar")
+    parser.add_argument('--detect', nargs='+', choices=('algae', 'fish'), default=['algae', 'fish'], help="detetores a correr")
+    parser.add_argument('--fish', choices=sorted(FISH_SCRIPTS), default='with_tracking', help="pipeline dos peixes")
+    parser.add_argument('--limits', default='limits.json', help="ficheiro JSON com os limites HSV das algas")
+    parser.add_argument('--incremental', type=int, default=0,
+                        help="algas: segmentar o frame inteiro só a cada N frames e propagar a máscara nos outros (0 = desligado)")
+    args = parser.parse_args()
+    configure_from_args(args, 'analyze')
+
+    cap = cv2.VideoCapture(args.video)
+    if (cap.isOpened()== False):
+        print("Erro ao abrir o vídeo.")
+        exit()
+
+    set_iou_check(args.morph_check)
+
+    # Os resultados dos dois detetores ficam na mesma pasta (o render.py desenha ambos)
+    max_dist = 50 if args.fish == 'with_tracking' else 100
+    frames_confirm = 3
+    records = writer_from_args(args, {'pipeline': args.fish, 'detectors': args.detect, 'video': args.video,
+                                      'width': 1280, 'height': 720, 'frames_confirm': frames_confirm})
+
+    stages = []
+    incremental = None
+    if 'algae' in args.detect:
+        min_lim, max_lim = algea_final.load_limits_from_json(args.limits)
+        if not min_lim or not max_lim:
+            min_lim, max_lim = algea_final.DEFAULT_MIN_LIM, algea_final.DEFAULT_MAX_LIM
+        lut = load_compiled_limits(args.limits, min_lim, max_lim)
+        if args.incremental:
+            incremental = algea_final.IncrementalAlgae(lut, args.morph, args.incremental, args.motion,
+                                                       fallback=args.motion_fallback)
+        stages.append(algea_final.AlgaeStage(lut, args.morph, records, incremental))
+    estimator = make_estimator(args.motion, args.motion_fallback)
+    if 'fish' in args.detect:
+        stages.append(FISH_SCRIPTS[args.fish].FishStage(max_dist, frames_confirm, estimator, args.morph, records=records))
+
+    print("Processando vídeo")
+
+    # A descodificação corre numa thread à parte e o pré-processamento é partilhado pelos detetores
+    frames = VideoReader(cap, (1280, 720), args.buffer)
+    processed = bounded(run_stages(frames, stages, Preprocessor(equalize=equalize_from_args(args)),
+                                   render=not args.no_render), args.buffer)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    run_sink(processed, args, fps)
+    if records is not None:
+        records.close()
+    frames.print_stats()
+    if estimator.compensated:
+        estimator.print_stats()
+    if incremental is not None:
+        incremental.print_stats()
+    print_iou_report()
+    metrics.export()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+import cv2
+import numpy as np
+import argparse
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils.association import TrackTable
+from utils.frame_processing import Preprocessor, add_equalize_arguments, equalize_from_args
+from utils.hsv_lut import load_compiled_limits
+from utils.metrics import write_atomic
+from utils.morphology import MODES
+from utils.motion import BACKENDS, FALLBACKS, make_estimator
+from utils.engine import run_stages
+from utils.records import RecordWriter
+from utils.video_reader import VideoReader
+import algea_final
+import with_tracking
+import without_tracking
+
+# Processamento em lote (sem janelas nem input()) de uma pasta ou lista de vídeos.
+# Cada vídeo é processado por um processo do pool; o progresso e o estado do tracker
+# são guardados em checkpoints para que um trabalho interrompido continue onde parou.
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.m4v')
+DETECTORS = ('algae', 'fish')
+# Os dois detetores numa só passagem pelo vídeo (utils/engine.py)
+COMBINED = 'combined'
+FISH_SCRIPTS = {'with_tracking': with_tracking, 'without_tracking': without_tracking}
+
+def list_videos(source):
+    # Pasta (procura recursiva por extensão), manifesto JSON (lista de caminhos) ou ficheiro de texto (um caminho por linha)
+    if os.path.isdir(source):
+        videos = []
+        for root, _, files in os.walk(source):
+            videos.extend(os.path.join(root, f) for f in files if f.lower().endswith(VIDEO_EXTENSIONS))
+        return sorted(videos)
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        if source.lower().endswith('.json'):
+            paths = json.load(f)
+        else:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    # Caminhos relativos são relativos ao manifesto
+    return [p if os.path.isabs(p) else os.path.join(base, p) for p in paths]
+
+def job_name(path, videos_root=None):
+    # Nome único do vídeo dentro da pasta de saída
+    rel = os.path.relpath(path, videos_root) if videos_root else os.path.basename(path)
+    return os.path.splitext(rel)[0].replace(os.sep, '__')
+
+def encode_state(state):
+    # Estado do tracker (TrackTable, next_id, tracking) em tipos que o JSON aceita
+    centers = state.get('centers') or TrackTable()
+    encoded = {
+        'ids': centers.ids.tolist(),
+        'centers': centers.centers.tolist(),
+        'frames_visible': centers.frames_visible.tolist(),
+        'next_id': int(state.get('next_id', 0)),
+    }
+    if 'tracking' in state:
+        encoded['tracking'] = [[int(i), float(p[0]), float(p[1]), bool(active)]
+                               for i, (p, active) in state['tracking'].items()]
+    return encoded
+
+def decode_state(encoded):
+    centers = TrackTable()
+    centers.ids = np.array(encoded['ids'], dtype=np.int64)
+    centers.centers = np.array(encoded['centers'], dtype=np.int32).reshape(-1, 2)
+    centers.frames_visible = np.array(encoded['frames_visible'], dtype=np.int32)
+    centers.areas = np.zeros(len(centers.ids), dtype=np.float32)
+    centers.boxes = np.zeros((len(centers.ids), 4), dtype=np.int32)
+    state = {'centers': centers, 'next_id': encoded['next_id']}
+    if 'tracking' in encoded:
+        state['tracking'] = {i: ((x, y), active) for i, x, y, active in encoded['tracking']}
+    return state
+
+def load_checkpoint(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+def save_checkpoint(path, checkpoint):
+    write_atomic(path, json.dumps(checkpoint, indent=4))
+
+def open_writer(path, fps, size):
+    # Cada retoma escreve um segmento novo (não é possível continuar um ficheiro de vídeo)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    if not writer.isOpened():
+        raise IOError(f"Não foi possível criar {path}")
+    return writer
+
+def run_detector(detector, path, out_dir, name, checkpoint, checkpoint_path, config):
+    # Processar um vídeo com um detetor (ou com os dois, detector=COMBINED) a partir do último checkpoint
+    progress = checkpoint.setdefault(detector, {'frame': 0, 'frames': 0, 'seconds': 0.0, 'segments': 0, 'done': False})
+    if progress['done']:
+        return progress
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"Erro ao abrir o vídeo {path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    progress['total'] = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    start_frame = progress['frame']
+    names = DETECTORS if detector == COMBINED else (detector,)
+    if 'fish' in names and start_frame > 0:
+        # O pipeline dos peixes precisa do frame anterior: recomeçar no último frame já processado
+        start_frame -= 1
+    if start_frame > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+    writers = {}
+    if config['records']:
+        # Os resultados escritos depois do último checkpoint são descartados antes de continuar
+        for d in names:
+            meta = {'pipeline': 'algae' if d == 'algae' else config['fish'], 'video': path,
+                    'width': config['width'], 'height': config['height'], 'frames_confirm': config['frames_confirm']}
+            writers[d] = RecordWriter(os.path.join(out_dir, f"{name}_{d}.records"), meta, start_frame,
+                                      append=progress['frame'] > 0)
+            writers[d].truncate(progress['frame'])
+    records = writers.get(detector)
+
+    frames = VideoReader(cap, (config['width'], config['height']), config['buffer'])
+    render = config['write_video']
+    preprocessor = Preprocessor(config['width'], config['height'], 2, config['equalize'])
+    # Primeiro frame devolvido: nos peixes o primeiro frame lido só serve de anterior
+    first = start_frame + (1 if 'fish' in names and (detector == 'fish' or start_frame < progress['frame']) else 0)
+    if detector == COMBINED:
+        state = decode_state(progress['state']) if 'state' in progress else {}
+        script = FISH_SCRIPTS[config['fish']]
+        stages = [
+            algea_final.AlgaeStage(config['lut'], config['morph'], writers.get('algae')),
+            script.FishStage(config['max_dist'], config['frames_confirm'],
+                             make_estimator(config['motion'], config['motion_fallback']), config['morph'], state,
+                             writers.get('fish')),
+        ]
+        processed = run_stages(frames, stages, preprocessor, render, warmup=first - start_frame)
+    elif detector == 'algae':
+        processed = algea_final.process_algae(frames, config['lut'], config['width'], config['height'],
+                                              morph_mode=config['morph'], records=records, render=render,
+                                              equalize=config['equalize'])
+        state = None
+    else:
+        state = decode_state(progress['state']) if 'state' in progress else {}
+        script = FISH_SCRIPTS[config['fish']]
+        processed = script.process_fish(frames, config['max_dist'], config['frames_confirm'],
+                                        estimator=make_estimator(config['motion'], config['motion_fallback']),
+                                        morph_mode=config['morph'], roi=config['roi'], state=state,
+                                        records=records, render=render,
+                                        preprocessor=preprocessor)
+
+    writer = None
+    if config['write_video']:
+        segment = f"_part{progress['segments']}" if progress['segments'] else ''
+        progress['segments'] += 1
+        writer = open_writer(os.path.join(out_dir, f"{name}_{detector}{segment}.mp4"), fps,
+                             (config['width'], config['height']))
+
+    def save(done=False):
+        for writer in writers.values():
+            writer.flush()
+        progress['frame'] = position
+        progress['frames'] += n
+        progress['seconds'] += time.perf_counter() - start
+        progress['done'] = done
+        if state is not None:
+            progress['state'] = encode_state(state)
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    # position é o índice do próximo frame por processar
+    position = first
+    n = 0
+    start = time.perf_counter()
+    try:
+        for frame in processed:
+            if writer is not None:
+                writer.write(frame)
+            position += 1
+            n += 1
+            if n >= config['checkpoint_every']:
+                save()
+                n = 0
+                start = time.perf_counter()
+        save(done=True)
+    finally:
+        frames.close()
+        if writer is not None:
+            writer.release()
+    return progress
+
+def process_video(path, out_dir, name, detectors, config):
+    # Corre num processo do pool; devolve o resumo do vídeo (os erros também são devolvidos)
+    checkpoint_path = os.path.join(out_dir, f"{name}.checkpoint.json")
+    checkpoint = load_checkpoint(checkpoint_path)
+    checkpoint['video'] = path
+    result = {'video': path, 'name': name, 'detectors': {}}
+    try:
+        for detector in detectors:
+            resumed_from = checkpoint.get(detector, {}).get('frame', 0)
+            progress = run_detector(detector, path, out_dir, name, checkpoint, checkpoint_path, config)
+            result['detectors'][detector] = {
+                'frames': progress['frames'],
+                'seconds': progress['seconds'],
+                'fps': progress['frames'] / progress['seconds'] if progress['seconds'] else 0.0,
+                'resumed_from': resumed_from,
+            }
+        result['status'] = 'ok'
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f"{type(e).__name__}: {e}"
+        result['traceback'] = traceback.format_exc()
+    return result
+
+def print_summary(results):
+    print("╭──────────────────────────────────────┬──────────┬─────────┬─────────┬────────╮")
+    print("│ Vídeo                                │ Detetor  │ Frames  │ FPS     │ Retoma │")
+    print("├──────────────────────────────────────┼──────────┼─────────┼─────────┼────────┤")
+    for r in results:
+        if r['status'] != 'ok':
+            print(f"│ {r['name'][:36]:36} │ {'erro':8} │ {r['error'][:26]:26} │")
+            continue
+        for detector, d in r['detectors'].items():
+            print(f"│ {r['name'][:36]:36} │ {detector:8} │ {d['frames']:7} │ {d['fps']:7.1f} │ {d['resumed_from']:6} │")
+    print("╰──────────────────────────────────────┴──────────┴─────────┴─────────┴────────╯")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Processamento em lote de vídeos (algas e/ou peixes)")
+    parser.add_argument('source', help="pasta com vídeos ou manifesto (.json com uma lista ou .txt com um caminho por linha)")
+    parser.add_argument('--output', default='batch_output', help="pasta para checkpoints, vídeos e resumo")
+    parser.add_argument('--detect', nargs='+', choices=DETECTORS, default=list(DETECTORS), help="detetores a correr")
+    parser.add_argument('--fish', choices=sorted(FISH_SCRIPTS), default='with_tracking', help="pipeline dos peixes")
+    parser.add_argument('--workers', type=int, default=0, help="número de processos (0 = todos os cores)")
+    parser.add_argument('--checkpoint-every', type=int, default=300, help="frames entre checkpoints")
+    parser.add_argument('--write-video', action='store_true', help="guardar os vídeos anotados")
+    parser.add_argument('--records', action='store_true', help="guardar os resultados estruturados (<vídeo>_<detetor>.records, ver render.py)")
+    parser.add_argument('--limits', default='limits.json', help="ficheiro JSON com os limites HSV das algas")
+    parser.add_argument('--morph', choices=MODES, default='exact', help="implementação da morfologia com kernels grandes")
+    parser.add_argument('--roi', action='store_true', help="filtragem dos peixes só à volta das zonas com movimento")
+    parser.add_argument('--motion', choices=sorted(BACKENDS), default='features', help="estimador do movimento da câmara")
+    parser.add_argument('--motion-fallback', choices=FALLBACKS, default='last', help="transformação a usar quando a estimação falha")
+    parser.add_argument('--buffer', type=int, default=8, help="tamanho do buffer de descodificação (frames)")
+    parser.add_argument('--restart', action='store_true', help="ignorar os checkpoints existentes")
+    parser.add_argument('--single-pass', action='store_true',
+                        help="com os dois detetores, descodificar e pré-processar cada vídeo uma só vez para ambos")
+    add_equalize_arguments(parser)
+    args = parser.parse_args()
+
+    videos = list_videos(args.source)
+    if not videos:
+        print("Nenhum vídeo encontrado.")
+        exit()
+    os.makedirs(args.output, exist_ok=True)
+    videos_root = args.source if os.path.isdir(args.source) else None
+
+    min_lim, max_lim = algea_final.load_limits_from_json(args.limits)
+    if not min_lim or not max_lim:
+        min_lim, max_lim = algea_final.DEFAULT_MIN_LIM, algea_final.DEFAULT_MAX_LIM
+
+    config = {
+        'width': 1280,
+        'height': 720,
+        'lut': load_compiled_limits(args.limits, min_lim, max_lim) if 'algae' in args.detect else None,
+        'morph': args.morph,
+        'fish': args.fish,
+        'max_dist': 50 if args.fish == 'with_tracking' else 100,
+        'frames_confirm': 3,
+        'roi': args.roi,
+        'motion': args.motion,
+        'motion_fallback': args.motion_fallback,
+        'equalize': equalize_from_args(args),
+        'buffer': args.buffer,
+        'checkpoint_every': max(1, args.checkpoint_every),
+        'write_video': args.write_video,
+        'records': args.records,
+    }
+
+    detectors = args.detect
+    if args.single_pass and set(detectors) == set(DETECTORS):
+        if args.roi:
+            parser.error("--single-pass não pode ser usado com --roi")
+        detectors = [COMBINED]
+
+    jobs = [(path, job_name(path, videos_root)) for path in videos]
+    if args.restart:
+        for _, name in jobs:
+            checkpoint_path = os.path.join(args.output, f"{name}.checkpoint.json")
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+
+    print(f"Processando {len(jobs)} vídeos")
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.workers or os.cpu_count()) as pool:
+        futures = [pool.submit(process_video, path, args.output, name, detectors, config) for path, name in jobs]
+        for future in as_completed(futures):
+            r = future.result()
+            results.append(r)
+            print(f"[{len(results)}/{len(jobs)}] {r['name']}: {r['status']}")
+            if r['status'] != 'ok':
+                print(r['traceback'])
+
+    results.sort(key=lambda r: r['name'])
+    elapsed = time.perf_counter() - start
+    summary = {
+        'videos': len(results),
+        'failed': sum(r['status'] != 'ok' for r in results),
+        'elapsed_s': elapsed,
+        'frames': sum(d['frames'] for r in results for d in r['detectors'].values()),
+        'results': results,
+    }
+    summary['fps'] = summary['frames'] / elapsed if elapsed else 0.0
+    write_atomic(os.path.join(args.output, 'summary.json'), json.dumps(summary, indent=4))
+    print_summary(results)
+    print(f"Total: {summary['frames']} frames em {elapsed:.1f} s ({summary['fps']:.1f} fps)")
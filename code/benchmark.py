@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+import cv2
+import numpy as np
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from utils.frame_processing import *
+from utils.motion import BACKENDS, MotionEstimator
+from utils.association import TrackTable
+from utils.blobs import Blobs
+from utils.engine import run_stages
+from utils.hsv_lut import compile_limits, segment
+from utils.synthetic import SyntheticVideo
+import algea_final
+import with_tracking
+import without_tracking
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Limites padrão do algea_final.py
+MIN_LIM = algea_final.DEFAULT_MIN_LIM
+MAX_LIM = algea_final.DEFAULT_MAX_LIM
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Em Linux vem em KB, em macOS em bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def summary(times):
+    t = np.array(times) * 1000
+    if len(t) == 0:
+        return {'frames': 0}
+    return {
+        'frames': len(t),
+        'mean_ms': float(t.mean()),
+        'p50_ms': float(np.percentile(t, 50)),
+        'p90_ms': float(np.percentile(t, 90)),
+        'p99_ms': float(np.percentile(t, 99)),
+        'max_ms': float(t.max()),
+        'fps': float(1000 / t.mean()) if t.mean() > 0 else None,
+    }
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def time_stage(fn, inputs):
+    # Tempo de fn(*args) para cada conjunto de argumentos
+    times = []
+    for args in inputs:
+        _, t = timed(fn, *args)
+        times.append(t)
+    return summary(times)
+
+def time_generator(gen):
+    # Tempo entre frames produzidos por um gerador (latência por frame de ponta a ponta)
+    times = []
+    start = time.perf_counter()
+    for _ in gen:
+        now = time.perf_counter()
+        times.append(now - start)
+        start = now
+    return summary(times)
+
+def inrange_union(frame_hsv, min_lim, max_lim):
+    # Segmentação original do algea_final.py (um inRange + bitwise_or por intervalo), para comparação
+    combined_mask = np.zeros(frame_hsv.shape[:2], dtype=np.uint8)
+    for l_min, l_max in zip(min_lim, max_lim):
+        mask = cv2.inRange(frame_hsv, l_min, l_max)
+        combined_mask = cv2.bitwise_or(combined_mask, mask)
+    return combined_mask
+
+def external_contours(mask, min_area):
+    # Extração dos contornos que o Blobs substituiu (findContours + contourArea por contorno), para comparação
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return [cv2.moments(c) for c in contours if cv2.contourArea(c) >= min_area]
+
+def noisy_mask(mask, seed, density=0.004):
+    # A máscara com ruído salpicado por cima (milhares de blobs de 2x2 píxeis, todos abaixo da área mínima)
+    rng = np.random.default_rng(seed)
+    speckle = ((rng.random(mask.shape) < density) * 255).astype(np.uint8)
+    return cv2.bitwise_or(mask, cv2.dilate(speckle, np.ones((2, 2), np.uint8)))
+
+def load_frames(args):
+    if args.video:
+        cap = cv2.VideoCapture(args.video)
+        if not cap.isOpened():
+            print("Erro ao abrir o vídeo.")
+            exit(1)
+    else:
+        cap = SyntheticVideo(args.frames, seed=args.seed)
+    frames = []
+    for _ in range(args.frames):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+def run_benchmarks(frames, morph_modes=('exact', 'downscale', 'rect')):
+    stages = {}
+    pairs = range(1, len(frames))
+
+    # Pré-processamento
+    stages['prep_frame'] = time_stage(prep_frame, [(f, 1) for f in frames])
+    preprocessor = Preprocessor(ring=2)
+    stages['Preprocessor.prep'] = time_stage(preprocessor.prep, [(f, 1) for f in frames])
+    preprocessor = Preprocessor(ring=2, equalize={'refresh': 30, 'drift': 0.05, 'step': 4})
+    stages['Preprocessor.prep[eq-refresh=30]'] = time_stage(preprocessor.prep, [(f, 1) for f in frames])
+
+    prepped = [prep_frame(f, 1) for f in frames]
+    bw = [p[0] for p in prepped]
+    eq = [p[1] for p in prepped]
+
+    # Compensação de movimento
+    stages['motion_compensation'] = time_stage(motion_compensation, [(bw[i - 1], bw[i]) for i in pairs])
+    stages['motion_compensation_v2'] = time_stage(motion_compensation_v2, [(bw[i - 1], bw[i], eq[i - 1], eq[i]) for i in pairs])
+
+    estimator = MotionEstimator()
+    stages['MotionEstimator.compensate'] = time_stage(estimator.compensate,
+                                                      [(bw[i - 1], bw[i], eq[i - 1], eq[i]) for i in pairs])
+    for name, backend in BACKENDS.items():
+        if name != 'features':
+            stages[f'motion[{name}]'] = time_stage(backend().compensate, [(bw[i - 1], bw[i]) for i in pairs])
+
+    transformed = [motion_compensation_v2(bw[i - 1], bw[i], eq[i - 1], eq[i])[0] for i in pairs]
+
+    # Filtragem (máscara de diferenças)
+    for mode in morph_modes:
+        stages[f'filtering[{mode}]'] = time_stage(filtering, [(transformed[i - 1], bw[i], mode) for i in pairs])
+    filtered = [filtering(transformed[i - 1], bw[i]) for i in pairs]
+
+    # Associação e tracking (com estado, por isso corre em sequência)
+    centers, next_id, tracking = TrackTable(), 0, {}
+    contour_times, track_times = [], []
+    # Carga efetiva das etapas: sem contornos nem objetos seguidos os tempos não medem nada
+    workload = {'detections': 0, 'tracked': 0}
+    for k, i in enumerate(pairs):
+        annotated = eq[i].copy()
+        (annotated, centers, next_id, tracking), t = timed(with_tracking.find_contours, annotated, filtered[k],
+                                                            centers, 50, next_id, 3, tracking)
+        contour_times.append(t)
+        workload['detections'] += len(centers)
+        (annotated, tracking), t = timed(with_tracking.track, eq[i - 1], eq[i], annotated, tracking)
+        track_times.append(t)
+        workload['tracked'] += len(tracking)
+    stages['find_contours'] = summary(contour_times)
+    stages['track'] = summary(track_times)
+
+    centers, next_id = TrackTable(), 0
+    times = []
+    for k, i in enumerate(pairs):
+        annotated = eq[i].copy()
+        (annotated, centers, next_id), t = timed(without_tracking.find_contours, annotated, filtered[k],
+                                                  centers, 100, next_id, 3)
+        times.append(t)
+    stages['find_contours[without_tracking]'] = summary(times)
+
+    # Extração dos blobs nas máscaras da filtragem (poucos blobs) e nas mesmas com ruído
+    noisy = [noisy_mask(m, k) for k, m in enumerate(filtered)]
+    for name, masks in (('', filtered), ('[noisy]', noisy)):
+        stages[f'Blobs{name}'] = time_stage(Blobs, [(m, 250) for m in masks])
+        stages[f'findContours+contourArea{name}'] = time_stage(external_contours, [(m, 250) for m in masks])
+
+    # Algas
+    hsv = [cv2.cvtColor(f, cv2.COLOR_BGR2HSV) for f in eq]
+    lut = compile_limits(MIN_LIM, MAX_LIM)
+    stages['algae.inRange'] = time_stage(inrange_union, [(h, MIN_LIM, MAX_LIM) for h in hsv])
+    stages['algae.segment_lut'] = time_stage(segment, [(h, lut) for h in hsv])
+    masks = [segment(h, lut) for h in hsv]
+    for mode in morph_modes:
+        stages[f'algae.morphology[{mode}]'] = time_stage(algea_final.morphology, [(m, mode) for m in masks])
+    final_masks = [algea_final.morphology(m) for m in masks]
+    stages['algae.algea_contours'] = time_stage(algea_final.algea_contours, [(f.copy(), m) for f, m in zip(eq, final_masks)])
+
+    # Ponta a ponta
+    end_to_end = {
+        'with_tracking': time_generator(with_tracking.process_fish(iter(frames))),
+        'without_tracking': time_generator(without_tracking.process_fish(iter(frames))),
+        'algae': time_generator(algea_final.process_algae(iter(frames), lut)),
+        # Algas e peixes numa só passagem (utils/engine.py), a comparar com a soma de 'algae' e 'with_tracking'
+        'algae+with_tracking[single pass]': time_generator(run_stages(iter(frames), [algea_final.AlgaeStage(lut), with_tracking.FishStage()])),
+        'algae[incremental]': time_generator(algea_final.process_algae(iter(frames), lut, incremental=algea_final.IncrementalAlgae(lut))),
+        # Máscaras por pares: num processo e em todos os cores (o resultado é o mesmo)
+        'with_tracking[pairs]': time_generator(with_tracking.process_fish(iter(frames), workers=1)),
+        'with_tracking[pairs x{}]'.format(os.cpu_count()): time_generator(with_tracking.process_fish(iter(frames), workers=os.cpu_count())),
+    }
+    return stages, end_to_end, workload
+
+def compare(results, baseline, tolerance):
+    # Etapas cuja latência média piorou mais do que a tolerância face à referência
+    regressions = []
+    for section in ('stages', 'end_to_end'):
+        for name, current in results.get(section, {}).items():
+            previous = baseline.get(section, {}).get(name)
+            if not previous or 'mean_ms' not in previous or 'mean_ms' not in current:
+                continue
+            ratio = current['mean_ms'] / previous['mean_ms']
+            if ratio > 1 + tolerance:
+                regressions.append((f"{section}/{name}", previous['mean_ms'], current['mean_ms'], ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark das etapas de deteção com vídeo sintético")
+    parser.add_argument('--frames', type=int, default=90, help="número de frames a usar")
+    parser.add_argument('--seed', type=int, default=0, help="semente do vídeo sintético")
+    parser.add_argument('--video', help="usar um vídeo real em vez do sintético")
+    parser.add_argument('--output', default='benchmark.json', help="ficheiro JSON com os resultados")
+    parser.add_argument('--compare', help="JSON de uma execução anterior para detetar regressões")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="aumento relativo tolerado no --compare")
+    args = parser.parse_args()
+
+    frames = load_frames(args)
+    if len(frames) < 2:
+        print("São precisos pelo menos 2 frames.")
+        exit(1)
+
+    print(f"A medir {len(frames)} frames")
+    stages, end_to_end, workload = run_benchmarks(frames)
+    results = {
+        'meta': {
+            'source': args.video or 'synthetic',
+            'frames': len(frames),
+            'seed': args.seed,
+            'resolution': [frames[0].shape[1], frames[0].shape[0]],
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'stages': stages,
+        'end_to_end': end_to_end,
+        'workload': workload,
+        # O getrusage só dá o pico do processo inteiro, por isso é reportado uma vez por execução
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+
+    for section in ('stages', 'end_to_end'):
+        for name, r in results[section].items():
+            if r.get('frames'):
+                print(f"{name:34} {r['mean_ms']:8.2f} ms  p90 {r['p90_ms']:8.2f} ms  {r['fps']:8.1f} fps")
+    print(f"Resultados gravados em {args.output}")
+    print(f"Contornos: {workload['detections']}, objetos seguidos: {workload['tracked']} (soma por frame)")
+    if not workload['detections'] or not workload['tracked']:
+        print("Sem contornos ou sem objetos seguidos: os tempos dos peixes medem uma carga vazia.")
+        exit(1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after, ratio in regressions:
+            print(f"REGRESSÃO {name}: {before:.2f} ms -> {after:.2f} ms (x{ratio:.2f})")
+        if regressions:
+            exit(1)
+
+if __name__ == '__main__':
+    main()
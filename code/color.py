@@ -3,6 +3,8 @@ import cv2
 import json
 from copy import deepcopy
 import os
+from utils.frame_processing import CachedEqualizer
+from utils.hsv_histogram import HSVHistogram
 os.environ['OPENCV_FFMPEG_READ_ATTEMPTS'] = '8192' 
 
 # Função para capturar os clicks
@@ -23,6 +25,10 @@ def info():
     print(f"├─────┼──────────────────────────────────────────────────────────────────┤")
     print(f"│ w W │ Gravar no ficheiro limits.json todos os intervalos HSV guardados │")
     print(f"├─────┼──────────────────────────────────────────────────────────────────┤")
+    print(f"│ s S │ Sugerir um intervalo a partir dos pontos clicados na máscara     │")
+    print(f"├─────┼──────────────────────────────────────────────────────────────────┤")
+    print(f"│ c C │ Esquecer os pontos clicados                                      │")
+    print(f"├─────┼──────────────────────────────────────────────────────────────────┤")
     print(f"│ q Q │ Fechar as janelas e fechar o programa                            │")
     print(f"└─────┴──────────────────────────────────────────────────────────────────┘")
     return
@@ -39,7 +45,8 @@ def main():
     cv2.namedWindow(frame_window, cv2.WINDOW_NORMAL)
     cv2.resizeWindow(frame_window, 800, 550)  
 
-    cap = cv2.VideoCapture('peixe.mp4')
+    video_path = 'peixe.mp4'
+    cap = cv2.VideoCapture(video_path)
 
     if (cap.isOpened()== False): 
         print("Erro ao abrir o vídeo.")
@@ -48,6 +55,14 @@ def main():
     limits = {"H": {"max": 179, "min": 0}, "S": {"max": 255, "min": 0}, "V": {"max": 255, "min": 0}}
     width, height = 640, 480
     click_data = {'click_position': None}  # Variável compartilhada para salvar a posição do clique
+    seeds = []  # Valores HSV à volta dos pontos clicados
+
+    # Histograma HSV de frames amostrados em todo o vídeo (calculado uma vez e guardado ao lado do vídeo):
+    # dá a cobertura dos intervalos no vídeo inteiro e não só no frame mostrado
+    print("A preparar o histograma HSV do vídeo")
+    histogram = HSVHistogram.load_or_build(video_path, size=(width, height))
+    # A iluminação muda devagar: as LUTs de equalização só são recalculadas a cada 30 frames ou quando o histograma muda
+    equalizer = CachedEqualizer(refresh=30, drift=0.05, step=4)
 
     # Criar sliders na janela da máscara
     cv2.createTrackbar("H-min", mask_window, limits["H"]["min"], 179, lambda threshold: onTrackbar(threshold, mm="min", C="H", limits=limits))
@@ -69,31 +84,38 @@ def main():
             break
         
         # Equalização e redimensionamento
-        b, g, r = cv2.split(frame)
-        b_eq = cv2.equalizeHist(b)
-        g_eq = cv2.equalizeHist(g)
-        r_eq = cv2.equalizeHist(r)
-        frame = cv2.merge((b_eq, g_eq, r_eq))
         frame = cv2.resize(frame, (width, height))
+        frame = equalizer.apply(frame)
+        hsv_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        shown = None  # Limites da máscara mostrada
 
         while True:  # Atualização do mesmo frame
-            hsv_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-            mask = cv2.inRange(hsv_frame,
-                               (limits["H"]["min"], limits["S"]["min"], limits["V"]["min"]),
-                               (limits["H"]["max"], limits["S"]["max"], limits["V"]["max"]))
-
             # Adicionar marcador na imagem original, caso clique seja detectado
-            frame_with_marker = frame.copy()
             if click_data['click_position']:
                 click_x, click_y = click_data['click_position']
-                cv2.circle(frame_with_marker, (click_x, click_y), 5, (0, 0, 255), -1)
-                click_data['click_position'] = None 
-
-            # Exibir as janelas separadas
-            cv2.imshow(mask_window, mask)
-            cv2.imshow(frame_window, frame_with_marker)
-
-            k = cv2.waitKey(1) 
+                seeds.extend(hsv_frame[max(0, click_y - 2):click_y + 3, max(0, click_x - 2):click_x + 3].reshape(-1, 3))
+                cv2.circle(frame, (click_x, click_y), 5, (0, 0, 255), -1)
+                click_data['click_position'] = None
+                shown = None
+
+            # A máscara só é recalculada quando os limites mudam
+            current = tuple(limits[c][m] for c in 'HSV' for m in ('min', 'max'))
+            if current != shown:
+                shown = current
+                mask = cv2.inRange(hsv_frame,
+                                   (limits["H"]["min"], limits["S"]["min"], limits["V"]["min"]),
+                                   (limits["H"]["max"], limits["S"]["max"], limits["V"]["max"]))
+                frame_coverage = cv2.countNonZero(mask) / mask.size
+                video_coverage = histogram.coverage([limits])
+                saved_coverage = histogram.coverage(limits_save + [limits])
+                cv2.setWindowTitle(mask_window, f"Mask - frame {frame_coverage:.1%} | vídeo {video_coverage:.1%} | "
+                                                f"com os guardados {saved_coverage:.1%}")
+
+                # Exibir as janelas separadas
+                cv2.imshow(mask_window, mask)
+                cv2.imshow(frame_window, frame)
+
+            k = cv2.waitKey(15)
             if k == ord("q") or k == ord("Q"):  # Sair
                 cap.release()
                 cv2.destroyAllWindows()
@@ -101,6 +123,7 @@ def main():
             
             elif k == ord("l") or k == ord("L"):  # Guardar os numa lista
                 limits_save.append(deepcopy(limits))
+                shown = None  # Atualizar a cobertura dos intervalos guardados
 
             elif k == ord("w") or k == ord("W"):  # Guardar os limites na lista
                 file_name = "limits.json"
@@ -118,6 +141,23 @@ def main():
                             print(f"└───┴──────────┴──────────┘")
                     json.dump({"limits": limits_save}, json_file, indent=4)
 
+            elif k == ord("s") or k == ord("S"):  # Sugerir um intervalo a partir dos pontos clicados
+                if not seeds:
+                    print("Clique primeiro em píxeis de algas na janela da máscara.")
+                    continue
+                suggested = histogram.suggest(seeds)
+                for c, top in (("H", 179), ("S", 255), ("V", 255)):
+                    # Os trackbars atualizam os limites através do onTrackbar
+                    cv2.setTrackbarPos(f"{c}-min", mask_window, suggested[c]["min"])
+                    cv2.setTrackbarPos(f"{c}-max", mask_window, min(top, suggested[c]["max"]))
+                limits.update(deepcopy(suggested))
+                print(f"Intervalo sugerido: H {suggested['H']['min']}-{suggested['H']['max']}, "
+                      f"S {suggested['S']['min']}-{suggested['S']['max']}, V {suggested['V']['min']}-{suggested['V']['max']} "
+                      f"({histogram.coverage([suggested]):.1%} do vídeo)")
+
+            elif k == ord("c") or k == ord("C"):  # Esquecer os pontos clicados
+                seeds.clear()
+
             elif k == ord("n") or k == ord("N"):  # Passar para o próximo frame
                 break
             
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+import cv2
+import numpy as np
+import argparse
+import json
+import os
+import time
+from utils.accuracy import (MOTAccumulator, MaskAccumulator, load_mot, write_mot, load_algae_polygons,
+                            write_algae_polygons, polygons_mask)
+from utils.frame_processing import CachedEqualizer, Preprocessor, add_equalize_arguments, equalize_from_args
+from utils.hsv_lut import load_compiled_limits
+from utils.morphology import add_morph_arguments
+from utils.motion import add_motion_arguments, make_estimator
+from utils.synthetic import SyntheticVideo
+import algea_final
+import with_tracking
+import without_tracking
+
+# Avaliação da exatidão de uma configuração dos pipelines contra anotações de referência:
+# precisão/recall, trocas de ID, MOTA e IDF1 dos peixes e IoU das máscaras das algas, com o fps
+# de cada pipeline. Sem --video usa um vídeo sintético com a verdade conhecida, por isso corre offline.
+# Com --compare cada modo rápido pode ser comparado com a configuração exata.
+
+FISH_SCRIPTS = {'with_tracking': with_tracking, 'without_tracking': without_tracking}
+WIDTH, HEIGHT = 1280, 720
+
+# Métricas comparadas com --compare (quanto maior melhor)
+COMPARED = {'fish': ('precision', 'recall', 'mota', 'idf1'), 'algae': ('mean_iou',)}
+
+def load_source(args):
+    # Devolve (frames, caixas de referência, função que dá a máscara de referência do frame i), à resolução
+    # de processamento; as anotações de um vídeo real são escaladas do tamanho original
+    if args.video is None:
+        video = SyntheticVideo(args.frames, WIDTH, HEIGHT, seed=args.seed)
+        frames = list(video)
+        boxes = {i: [tuple(b) for b in frame_boxes] for i, frame_boxes in enumerate(video.fish_boxes)}
+        if args.export_gt:
+            os.makedirs(args.export_gt, exist_ok=True)
+            write_mot(os.path.join(args.export_gt, 'fish.csv'), boxes)
+            write_algae_polygons(os.path.join(args.export_gt, 'algae.json'),
+                                 {i: video.algae_mask(i) for i in range(len(frames))}, (HEIGHT, WIDTH))
+        return frames, boxes, video.algae_mask
+
+    cap = cv2.VideoCapture(args.video)
+    if not cap.isOpened():
+        print("Erro ao abrir o vídeo.")
+        exit(1)
+    # Os frames ficam em memória já à resolução de processamento
+    sy = HEIGHT / cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+    sx = WIDTH / cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+    frames = []
+    while len(frames) < args.frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.resize(frame, (WIDTH, HEIGHT)))
+    cap.release()
+
+    boxes = None
+    if args.gt_fish:
+        boxes = {i: [(t, x * sx, y * sy, w * sx, h * sy) for t, x, y, w, h in b] for i, b in load_mot(args.gt_fish).items()}
+    algae_mask = None
+    if args.gt_algae:
+        polygons, _ = load_algae_polygons(args.gt_algae)
+        scale = np.array([sx, sy])
+
+        def polygons_at(i):
+            return polygons_mask([np.round(p * scale).astype(np.int32) for p in polygons.get(i, [])], (HEIGHT, WIDTH))
+        algae_mask = polygons_at
+    return frames, boxes, algae_mask
+
+def evaluate_fish(frames, gt_boxes, args):
+    # Corre o pipeline dos peixes sem desenhar e compara os contornos confirmados de cada frame
+    script = FISH_SCRIPTS[args.fish]
+    max_dist = 50 if args.fish == 'with_tracking' else 100
+    state = {}
+    processed = script.process_fish(iter(frames), max_dist, args.frames_confirm, morph_mode=args.morph, roi=args.roi,
+                                    state=state, render=False,
+                                    workers=None if args.workers is None else args.workers or os.cpu_count(),
+                                    estimator=make_estimator(args.motion, args.motion_fallback),
+                                    preprocessor=Preprocessor(WIDTH, HEIGHT, 2, equalize_from_args(args)))
+    accumulator = MOTAccumulator(args.iou)
+    elapsed = 0.0
+    start = time.perf_counter()
+    for index in processed:
+        elapsed += time.perf_counter() - start
+        centers = state['centers']
+        confirmed = centers.frames_visible >= args.frames_confirm
+        pred = [(int(i), *(float(v) for v in box)) for i, box in zip(centers.ids[confirmed], centers.boxes[confirmed])]
+        accumulator.update(gt_boxes.get(index, []), pred)
+        start = time.perf_counter()
+    result = accumulator.summary()
+    result['fps'] = accumulator.frames / elapsed if elapsed else 0.0
+    return result
+
+def evaluate_algae(frames, gt_mask, args):
+    min_lim, max_lim = algea_final.load_limits_from_json(args.limits)
+    if not min_lim or not max_lim:
+        min_lim, max_lim = algea_final.DEFAULT_MIN_LIM, algea_final.DEFAULT_MAX_LIM
+    lut = load_compiled_limits(args.limits, min_lim, max_lim)
+    equalize = equalize_from_args(args)
+    equalizer = CachedEqualizer(**equalize) if equalize is not None else None
+    incremental = algea_final.IncrementalAlgae(lut, args.morph, args.incremental, args.motion,
+                                             fallback=args.motion_fallback) if args.incremental else None
+
+    accumulator = MaskAccumulator()
+    elapsed = 0.0
+    for i, frame in enumerate(frames):
+        start = time.perf_counter()
+        mask = algea_final.algae_frame(frame, lut, WIDTH, HEIGHT, args.morph, render=False,
+                                       equalizer=equalizer, incremental=incremental)
+        elapsed += time.perf_counter() - start
+        accumulator.update(gt_mask(i), mask)
+    result = accumulator.summary()
+    result['fps'] = len(frames) / elapsed if elapsed else 0.0
+    return result
+
+def compare(results, baseline, tolerance):
+    # Métricas que desceram mais do que a tolerância (valor absoluto) face à referência
+    regressions = []
+    for section, names in COMPARED.items():
+        for name in names:
+            before = baseline.get(section, {}).get(name)
+            after = results.get(section, {}).get(name)
+            if before is None or after is None:
+                continue
+            if after < before - tolerance:
+                regressions.append((f"{section}/{name}", before, after))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Exatidão dos pipelines contra anotações de referência")
+    parser.add_argument('--video', help="vídeo real (por defeito um vídeo sintético com a verdade conhecida)")
+    parser.add_argument('--gt-fish', help="caixas e IDs de referência dos peixes (CSV no formato MOTChallenge)")
+    parser.add_argument('--gt-algae', help="polígonos de referência das algas (JSON)")
+    parser.add_argument('--frames', type=int, default=150, help="número máximo de frames")
+    parser.add_argument('--seed', type=int, default=0, help="semente do vídeo sintético")
+    parser.add_argument('--export-gt', help="gravar a verdade do vídeo sintético nesta pasta (fish.csv e algae.json)")
+    parser.add_argument('--detect', nargs='+', choices=('algae', 'fish'), default=['algae', 'fish'], help="detetores a avaliar")
+    parser.add_argument('--fish', choices=sorted(FISH_SCRIPTS), default='with_tracking', help="pipeline dos peixes")
+    parser.add_argument('--frames-confirm', type=int, default=3, help="frames seguidos para um contorno contar como deteção")
+    parser.add_argument('--iou', type=float, default=0.3, help="IoU mínimo entre caixas para contar como a mesma deteção")
+    parser.add_argument('--roi', action='store_true', help="filtragem dos peixes só à volta das zonas com movimento")
+    parser.add_argument('--workers', type=int, help="máscaras dos peixes por pares de frames em N processos")
+    parser.add_argument('--limits', default='limits.json', help="ficheiro JSON com os limites HSV das algas")
+    parser.add_argument('--incremental', type=int, default=0, help="modo incremental das algas (keyframe a cada N frames)")
+    parser.add_argument('--label', help="nome da configuração no relatório")
+    parser.add_argument('--output', default='evaluation.json', help="ficheiro JSON com os resultados")
+    parser.add_argument('--compare', help="JSON de uma avaliação anterior (ex. a configuração exata)")
+    parser.add_argument('--tolerance', type=float, default=0.02, help="descida tolerada de cada métrica no --compare")
+    add_morph_arguments(parser)
+    add_motion_arguments(parser)
+    add_equalize_arguments(parser)
+    args = parser.parse_args()
+    if args.workers is not None and args.roi:
+        parser.error("--workers não pode ser usado com --roi")
+    if args.video is not None and not (args.gt_fish or args.gt_algae):
+        parser.error("com --video é preciso indicar --gt-fish e/ou --gt-algae")
+
+    frames, gt_boxes, gt_mask = load_source(args)
+    if len(frames) < 2:
+        print("São precisos pelo menos 2 frames.")
+        exit(1)
+
+    config = {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'export_gt')}
+    results = {'label': args.label, 'config': config, 'source': args.video or 'synthetic', 'frames': len(frames)}
+    print(f"A avaliar {len(frames)} frames")
+    if 'fish' in args.detect and gt_boxes is not None:
+        results['fish'] = evaluate_fish(frames, gt_boxes, args)
+        f = results['fish']
+        print(f"Peixes: precisão {f['precision']:.3f}, recall {f['recall']:.3f}, MOTA {f['mota']:.3f}, "
+              f"IDF1 {f['idf1']:.3f}, {f['id_switches']} trocas de ID, {f['fps']:.1f} fps")
+    if 'algae' in args.detect and gt_mask is not None:
+        results['algae'] = evaluate_algae(frames, gt_mask, args)
+        a = results['algae']
+        print(f"Algas: IoU médio {a['mean_iou']:.3f} (mínimo {a['min_iou']:.3f}, total {a['total_iou']:.3f}), {a['fps']:.1f} fps")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"Resultados gravados em {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after in regressions:
+            print(f"REGRESSÃO {name}: {before:.3f} -> {after:.3f}")
+        if regressions:
+            exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+import cv2
+import numpy as np
+import argparse
+from utils.frame_processing import Preprocessor
+from utils.pipeline import bounded, add_sink_arguments, run_sink
+from utils.video_reader import VideoReader
+from utils.records import load_records, load_meta, frame_slices
+
+# Desenho diferido: sobrepõe ao vídeo os resultados guardados com --records,
+# só quando alguém os quer ver (o processamento em si não desenha nada)
+
+class Renderer:
+
+    def __init__(self, path):
+        self.meta = load_meta(path)
+        self.tables = load_records(path)
+        self.frames_confirm = self.meta.get('frames_confirm', 3)
+        self.slices = {name: frame_slices(table) for name, table in self.tables.items() if name != 'algae_points'}
+
+    def rows(self, name, index):
+        starts, ends = self.slices[name]
+        if index >= len(starts):
+            return self.tables[name][:0]
+        return self.tables[name][starts[index]:ends[index]]
+
+    def draw(self, frame, index):
+        # Mesmas cores que os scripts: algas a verde, contornos confirmados a vermelho, objetos seguidos com ID
+        points = self.tables['algae_points']
+        for region in self.rows('algae', index):
+            polygon = points[region['offset']:region['offset'] + region['n_points']]
+            polygon = np.stack((polygon['x'], polygon['y']), axis=1).astype(np.int32)
+            cv2.drawContours(frame, [polygon], 0, (0, 255, 0), 2)
+
+        for d in self.rows('detections', index):
+            if d['frames_visible'] >= self.frames_confirm and self.meta.get('pipeline') == 'without_tracking':
+                cv2.rectangle(frame, (int(d['x']), int(d['y'])), (int(d['x'] + d['w']), int(d['y'] + d['h'])), (0, 0, 255), 2)
+                cv2.circle(frame, (int(d['cx']), int(d['cy'])), 5, (0, 255, 0), -1)
+
+        for t in self.rows('tracks', index):
+            x, y = int(t['x']), int(t['y'])
+            cv2.circle(frame, (x, y), 5, (0, 0, 255), -1)
+            cv2.putText(frame, f"Tracking ID {t['id']}", (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        return frame
+
+    def render(self, frames, equalize=True):
+        width, height = self.meta.get('width', 1280), self.meta.get('height', 720)
+        preprocessor = Preprocessor(width, height, ring=1)
+        for index, frame in enumerate(frames):
+            if frame.shape[:2] != (height, width):
+                frame = cv2.resize(frame, (width, height))
+            if equalize:
+                # Os scripts desenhavam sobre o frame equalizado
+                frame = preprocessor.equalize(frame, None)
+            yield self.draw(frame, index)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Desenhar os resultados guardados com --records")
+    parser.add_argument('records', help="pasta com os resultados")
+    parser.add_argument('--video', help="vídeo original (por defeito o indicado nos resultados)")
+    parser.add_argument('--raw', action='store_true', help="desenhar sobre o frame original em vez do equalizado")
+    add_sink_arguments(parser, 1 / 30)
+    args = parser.parse_args()
+
+    renderer = Renderer(args.records)
+    cap = cv2.VideoCapture(args.video or renderer.meta['video'])
+    if (cap.isOpened()== False):
+        print("Erro ao abrir o vídeo.")
+        exit()
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    rendered = bounded(renderer.render(VideoReader(cap, buffer=args.buffer), equalize=not args.raw), args.buffer)
+    run_sink(rendered, args, fps)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+import cv2
+import numpy as np
+import argparse
+import itertools
+import json
+import time
+from utils.frame_processing import Preprocessor, clear_borders, add_equalize_arguments, equalize_from_args
+from utils.motion import MotionEstimator
+from utils.association import TrackTable
+from utils.blobs import Blobs
+from utils.hsv_lut import RANGES_PER_PLANE
+from utils.morphology import MODES, elliptical
+from utils.synthetic import SyntheticVideo
+from utils.video_reader import VideoReader
+import algea_final
+
+# Varrimento de parâmetros numa só leitura do vídeo: o pré-processamento, a conversão para HSV e a
+# compensação de movimento são feitos uma vez por frame e partilhados por todas as configurações.
+# Os intervalos HSV de todas as configurações passam por uma única LUT (um bit por intervalo) e os
+# limiares da diferença são aplicados todos de uma vez; só a morfologia e a associação correm por configuração.
+
+def limits_variants(s_mins=(35, 50, 65), v_mins=(50, 65, 80)):
+    # Variantes dos limites padrão com outros mínimos de saturação e valor
+    variants = []
+    for s_min, v_min in itertools.product(s_mins, v_mins):
+        min_lim = [[int(l[0]), s_min, v_min] for l in algea_final.DEFAULT_MIN_LIM]
+        max_lim = [[int(l[0]), int(l[1]), int(l[2])] for l in algea_final.DEFAULT_MAX_LIM]
+        variants.append({'min': min_lim, 'max': max_lim})
+    return variants
+
+DEFAULT_GRID = {
+    'algae': {'limits': limits_variants(), 'min_area': [300, 500, 800]},
+    'fish': {'threshold': [50, 70, 90], 'min_area': [150, 250, 400], 'max_dist': [50, 100], 'frames_confirm': [2, 3, 5]},
+}
+
+def expand_grid(grid):
+    # {'a': [1, 2], 'b': [3]} -> [{'a': 1, 'b': 3}, {'a': 2, 'b': 3}]
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+def load_limits(limits):
+    # Um conjunto de limites é um ficheiro no formato do limits.json ou {'min': [[h, s, v], ...], 'max': [...]}
+    if isinstance(limits, str):
+        min_lim, max_lim = algea_final.load_limits_from_json(limits)
+        if min_lim is None:
+            raise ValueError(f"Limites inválidos em {limits}")
+        return [tuple(int(v) for v in l) for l in min_lim], [tuple(int(v) for v in l) for l in max_lim]
+    return [tuple(l) for l in limits['min']], [tuple(l) for l in limits['max']]
+
+class AlgaeSweep:
+
+    def __init__(self, configs, morph_mode='exact'):
+        self.configs = configs
+        self.morph_mode = morph_mode
+
+        # Cada intervalo diferente (de todas as configurações) fica com um bit da LUT
+        limit_sets = []
+        boxes = {}
+        for config in configs:
+            min_lim, max_lim = load_limits(config['limits'])
+            limit_sets.append(tuple(zip(min_lim, max_lim)))
+            for box in limit_sets[-1]:
+                boxes.setdefault(box, len(boxes))
+        self.n_planes = max(1, -(-len(boxes) // RANGES_PER_PLANE))
+        self.lut = np.zeros((self.n_planes, 1, 256, 3), dtype=np.uint8)
+        values = np.arange(256)
+        for (lo, hi), k in boxes.items():
+            plane, bit = divmod(k, RANGES_PER_PLANE)
+            for c in range(3):
+                self.lut[plane, 0, (values >= lo[c]) & (values <= hi[c]), c] |= np.uint8(1 << bit)
+
+        # Configurações com os mesmos limites partilham a máscara (só o min_area muda)
+        self.sets = sorted(set(limit_sets), key=limit_sets.index)
+        self.set_of = [self.sets.index(s) for s in limit_sets]
+        # selects[p, s, b] = 255 se o byte b do plano p tem algum bit dos intervalos do conjunto s
+        self.selects = np.zeros((self.n_planes, len(self.sets), 256), dtype=np.uint8)
+        byte = np.arange(256)
+        for s, limit_set in enumerate(self.sets):
+            for box in limit_set:
+                plane, bit = divmod(boxes[box], RANGES_PER_PLANE)
+                self.selects[plane, s, (byte >> bit) & 1 == 1] = 255
+
+        self.coverage = np.zeros(len(configs))
+        self.blobs = np.zeros(len(configs))
+        self.blob_area = np.zeros(len(configs))
+        self.frames = 0
+
+    def update(self, frame_hsv):
+        # Máscaras de todos os conjuntos de limites: uma LUT por plano e uma indexação em lote
+        masks = None
+        for p in range(self.n_planes):
+            bits = cv2.LUT(frame_hsv, self.lut[p])
+            h, s, v = cv2.split(bits)
+            cv2.bitwise_and(h, s, dst=h)
+            cv2.bitwise_and(h, v, dst=h)
+            plane_masks = self.selects[p][:, h]
+            masks = plane_masks if masks is None else masks | plane_masks
+
+        for s, mask in enumerate(masks):
+            final_mask = algea_final.morphology(mask, self.morph_mode)
+            blobs = Blobs(final_mask)
+            coverage = cv2.countNonZero(final_mask) / final_mask.size
+            for i in np.flatnonzero(np.array(self.set_of) == s):
+                kept = blobs.areas >= self.configs[i]['min_area']
+                self.coverage[i] += coverage
+                self.blobs[i] += kept.sum()
+                self.blob_area[i] += blobs.areas[kept].sum()
+        self.frames += 1
+
+    def results(self):
+        n = max(1, self.frames)
+        return [dict(config, limits_set=self.set_of[i], coverage=self.coverage[i] / n, blobs_per_frame=self.blobs[i] / n,
+                     mean_blob_area=self.blob_area[i] / max(1, self.blobs[i]))
+                for i, config in enumerate(self.configs)]
+
+class FishSweep:
+
+    def __init__(self, configs, morph_mode='exact'):
+        self.configs = configs
+        self.morph_mode = morph_mode
+        self.thresholds = np.array(sorted({c['threshold'] for c in configs}), dtype=np.uint8)
+
+        # Estado da associação de cada configuração
+        self.centers = [TrackTable() for _ in configs]
+        self.next_id = [0] * len(configs)
+        self.lifetimes = [{} for _ in configs]  # id -> frames seguidos em que foi visto
+        self.coverage = np.zeros(len(configs))
+        self.blobs = np.zeros(len(configs))
+        self.frames = 0
+
+    def update(self, frame_transformed, frame_bw):
+        diff = cv2.absdiff(frame_transformed, frame_bw)
+        # Todos os limiares de uma vez: (T, h, w)
+        masks = (diff[None] > self.thresholds[:, None, None]).view(np.uint8) * np.uint8(255)
+
+        for t, threshold in enumerate(self.thresholds):
+            clean = elliptical(masks[t], cv2.MORPH_OPEN, (7, 7))
+            clean = clear_borders(elliptical(clean, cv2.MORPH_CLOSE, (100, 100), self.morph_mode))
+            blobs = Blobs(clean)
+            coverage = cv2.countNonZero(clean) / clean.size
+
+            for i, config in enumerate(self.configs):
+                if config['threshold'] != threshold:
+                    continue
+                kept = blobs.areas >= config['min_area']
+                centers = self.centers[i]
+                self.next_id[i], _ = centers.update(blobs.centroids[kept].astype(np.int32), config['max_dist'], self.next_id[i])
+                lifetimes = self.lifetimes[i]
+                for contour_id, visible in zip(centers.ids.tolist(), centers.frames_visible.tolist()):
+                    lifetimes[contour_id] = visible
+                self.coverage[i] += coverage
+                self.blobs[i] += kept.sum()
+        self.frames += 1
+
+    def results(self):
+        n = max(1, self.frames)
+        results = []
+        for i, config in enumerate(self.configs):
+            lifetimes = np.array(list(self.lifetimes[i].values()))
+            confirmed = lifetimes[lifetimes >= config['frames_confirm']] if len(lifetimes) else lifetimes
+            results.append(dict(config, coverage=self.coverage[i] / n, blobs_per_frame=self.blobs[i] / n,
+                                ids=len(lifetimes), tracks=len(confirmed),
+                                mean_track_frames=float(confirmed.mean()) if len(confirmed) else 0.0,
+                                max_track_frames=int(confirmed.max()) if len(confirmed) else 0))
+        return results
+
+def run_sweep(frames, algae=None, fish=None, width=1280, height=720, equalize=None):
+    # Uma passagem pelos frames; algae e fish são AlgaeSweep/FishSweep (ou None)
+    preprocessor = Preprocessor(width, height, ring=2, equalize=equalize)
+    estimator = MotionEstimator()
+    prev_bw = None
+    for frame in frames:
+        frame_bw, frame_eq = preprocessor.prep(frame, 1)
+        if algae is not None:
+            # O algea_final equaliza os canais da mesma forma que o prep_frame
+            algae.update(cv2.cvtColor(frame_eq, cv2.COLOR_BGR2HSV))
+        if fish is not None and prev_bw is not None:
+            frame_transformed, _ = estimator.compensate(prev_bw, frame_bw)
+            fish.update(frame_transformed, frame_bw)
+        prev_bw = frame_bw
+
+def print_top(title, results, key, params, n):
+    print(title)
+    for r in sorted(results, key=lambda r: r[key], reverse=True)[:n]:
+        print(f"  {key}={r[key]:<8.4g} " + ', '.join(f"{p}={r[p]}" for p in params))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Varrimento de parâmetros de deteção numa só leitura do vídeo")
+    parser.add_argument('--video', help="vídeo a usar (por defeito um vídeo sintético)")
+    parser.add_argument('--frames', type=int, default=0, help="número máximo de frames (0 = todos)")
+    parser.add_argument('--grid', help="JSON com as listas de valores de cada parâmetro ('algae' e/ou 'fish')")
+    parser.add_argument('--morph', choices=MODES, default='exact', help="implementação da morfologia com kernels grandes")
+    parser.add_argument('--output', default='sweep.json', help="ficheiro JSON com os resultados")
+    parser.add_argument('--top', type=int, default=5, help="número de configurações a mostrar por detetor")
+    add_equalize_arguments(parser)
+    args = parser.parse_args()
+
+    grid = DEFAULT_GRID
+    if args.grid:
+        with open(args.grid) as f:
+            grid = json.load(f)
+    algae = AlgaeSweep(expand_grid(grid['algae']), args.morph) if grid.get('algae') else None
+    fish = FishSweep(expand_grid(grid['fish']), args.morph) if grid.get('fish') else None
+
+    if args.video:
+        cap = cv2.VideoCapture(args.video)
+        if (cap.isOpened()== False):
+            print("Erro ao abrir o vídeo.")
+            exit()
+        frames = VideoReader(cap, (1280, 720))
+    else:
+        frames = SyntheticVideo(args.frames or 150)
+    if args.frames:
+        frames = itertools.islice(frames, args.frames)
+
+    n_configs = (len(algae.configs) if algae else 0) + (len(fish.configs) if fish else 0)
+    print(f"A avaliar {n_configs} configurações")
+    start = time.perf_counter()
+    run_sweep(frames, algae, fish, equalize=equalize_from_args(args))
+    elapsed = time.perf_counter() - start
+
+    results = {'elapsed_s': elapsed, 'algae': algae.results() if algae else [], 'fish': fish.results() if fish else []}
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4, default=lambda v: v.tolist() if hasattr(v, 'tolist') else str(v))
+
+    if algae:
+        print_top("Algas (maior cobertura):", results['algae'], 'coverage', ['limits_set', 'min_area'], args.top)
+    if fish:
+        print_top("Peixes (mais tracks confirmados):", results['fish'], 'tracks', list(grid['fish']), args.top)
+    print(f"{n_configs} configurações em {elapsed:.1f} s; resultados gravados em {args.output}")
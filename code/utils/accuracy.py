@@ -0,0 +1,156 @@
+import csv
+import json
+import cv2
+import numpy as np
+from utils.association import assign
+
+# Métricas de exatidão contra anotações de referência: caixas e IDs dos peixes no formato CSV do
+# MOTChallenge (frame,id,x,y,w,h,... com frames a começar em 1) e polígonos das algas em JSON
+# ({"width", "height", "frames": {"<frame>": [[[x, y], ...], ...]}} com frames a começar em 0).
+
+def load_mot(path):
+    # Devolve {frame (a partir de 0): [(id, x, y, w, h), ...]}; linhas com confiança 0 são ignoradas
+    boxes = {}
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith('#'):
+                continue
+            frame, track_id, x, y, w, h = (float(v) for v in row[:6])
+            if len(row) > 6 and float(row[6]) == 0:
+                continue
+            boxes.setdefault(int(frame) - 1, []).append((int(track_id), x, y, w, h))
+    return boxes
+
+def write_mot(path, boxes):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for frame in sorted(boxes):
+            for track_id, x, y, w, h in boxes[frame]:
+                writer.writerow([frame + 1, track_id, x, y, w, h, 1, -1, -1, -1])
+
+def load_algae_polygons(path):
+    with open(path) as f:
+        data = json.load(f)
+    frames = {int(k): [np.array(p, dtype=np.int32).reshape(-1, 2) for p in v] for k, v in data['frames'].items()}
+    return frames, (data['height'], data['width'])
+
+def write_algae_polygons(path, masks, shape):
+    # masks: {frame: máscara}; os buracos ficam como polígonos interiores (preenchimento par-ímpar)
+    frames = {}
+    for frame, mask in masks.items():
+        contours, _ = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        frames[str(frame)] = [c.reshape(-1, 2).tolist() for c in contours]
+    with open(path, 'w') as f:
+        json.dump({'height': shape[0], 'width': shape[1], 'frames': frames}, f)
+
+def polygons_mask(polygons, shape):
+    mask = np.zeros(shape, dtype=np.uint8)
+    if polygons:
+        cv2.fillPoly(mask, polygons, 255)
+    return mask
+
+def box_iou(a, b):
+    # IoU entre todas as caixas (x, y, w, h) de a (N,4) e b (M,4)
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    x0 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y0 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x1 = np.minimum(a[:, None, 0] + a[:, None, 2], b[None, :, 0] + b[None, :, 2])
+    y1 = np.minimum(a[:, None, 1] + a[:, None, 3], b[None, :, 1] + b[None, :, 3])
+    inter = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+class MOTAccumulator:
+    # Emparelhamento por frame com IoU >= iou_threshold (com o assign da associação: húngaro com SciPy,
+    # guloso sem ele) e contagem de TP/FP/FN, trocas de ID, MOTA e IDF1
+
+    def __init__(self, iou_threshold=0.5):
+        self.iou_threshold = iou_threshold
+        self.tp = self.fp = self.fn = self.id_switches = 0
+        self.iou_sum = 0.0
+        self.last_match = {}  # id de referência -> último id previsto emparelhado
+        self.pairs = {}       # (id de referência, id previsto) -> frames emparelhados
+        self.gt_count = {}
+        self.pred_count = {}
+        self.frames = 0
+
+    def update(self, gt, pred):
+        # gt e pred: listas de (id, x, y, w, h) do mesmo frame
+        self.frames += 1
+        gt_ids = [int(g[0]) for g in gt]
+        pred_ids = [int(p[0]) for p in pred]
+        for i in gt_ids:
+            self.gt_count[i] = self.gt_count.get(i, 0) + 1
+        for i in pred_ids:
+            self.pred_count[i] = self.pred_count.get(i, 0) + 1
+
+        iou = box_iou([g[1:] for g in gt], [p[1:] for p in pred])
+        rows, cols = assign(1 - iou, 1 - self.iou_threshold)
+        for r, c in zip(rows, cols):
+            g, p = gt_ids[r], pred_ids[c]
+            if g in self.last_match and self.last_match[g] != p:
+                self.id_switches += 1
+            self.last_match[g] = p
+            self.pairs[(g, p)] = self.pairs.get((g, p), 0) + 1
+            self.iou_sum += iou[r, c]
+        self.tp += len(rows)
+        self.fp += len(pred) - len(rows)
+        self.fn += len(gt) - len(rows)
+
+    def idf1(self):
+        # Emparelhamento global das identidades que maximiza os frames em comum (IDTP)
+        gt_ids = sorted(self.gt_count)
+        pred_ids = sorted(self.pred_count)
+        n_gt, n_pred = sum(self.gt_count.values()), sum(self.pred_count.values())
+        if not gt_ids or not pred_ids:
+            return 0.0
+        common = np.zeros((len(gt_ids), len(pred_ids)))
+        gt_index = {i: k for k, i in enumerate(gt_ids)}
+        pred_index = {i: k for k, i in enumerate(pred_ids)}
+        for (g, p), n in self.pairs.items():
+            common[gt_index[g], pred_index[p]] = n
+        rows, cols = assign(-common, -1)
+        idtp = common[rows, cols].sum()
+        return float(2 * idtp / (n_gt + n_pred))
+
+    def summary(self):
+        n_gt = self.tp + self.fn
+        return {
+            'frames': self.frames,
+            'gt': n_gt,
+            'tp': self.tp,
+            'fp': self.fp,
+            'fn': self.fn,
+            'precision': self.tp / (self.tp + self.fp) if self.tp + self.fp else 0.0,
+            'recall': self.tp / n_gt if n_gt else 0.0,
+            'id_switches': self.id_switches,
+            'mota': 1 - (self.fn + self.fp + self.id_switches) / n_gt if n_gt else 0.0,
+            'motp_iou': float(self.iou_sum / self.tp) if self.tp else 0.0,
+            'idf1': self.idf1(),
+        }
+
+class MaskAccumulator:
+    # IoU das máscaras das algas: média por frame e total (todos os píxeis do vídeo)
+
+    def __init__(self):
+        self.intersection = 0
+        self.union = 0
+        self.ious = []
+
+    def update(self, gt_mask, pred_mask):
+        gt_mask = gt_mask > 0
+        pred_mask = pred_mask > 0
+        inter = int(np.count_nonzero(gt_mask & pred_mask))
+        union = int(np.count_nonzero(gt_mask | pred_mask))
+        self.intersection += inter
+        self.union += union
+        self.ious.append(inter / union if union else 1.0)
+
+    def summary(self):
+        return {
+            'frames': len(self.ious),
+            'mean_iou': float(np.mean(self.ious)) if self.ious else 0.0,
+            'min_iou': float(np.min(self.ious)) if self.ious else 0.0,
+            'total_iou': self.intersection / self.union if self.union else 1.0,
+        }
@@ -0,0 +1,82 @@
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # SciPy é opcional, sem ele usa-se a atribuição gulosa
+    linear_sum_assignment = None
+
+def pairwise_distances(a, b):
+    # Distâncias euclidianas entre todos os pontos de a (N,2) e b (M,2) numa só operação
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 2)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 2)
+    d = a[:, None, :] - b[None, :, :]
+    return np.sqrt((d ** 2).sum(axis=2))
+
+def assign(cost, max_dist):
+    # Atribuição global entre linhas e colunas, ignorando pares acima de max_dist.
+    # Devolve os índices (linhas, colunas) emparelhados; cada linha e coluna é usada no máximo uma vez.
+    if cost.size == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+    gate = cost <= max_dist
+    if linear_sum_assignment is not None:
+        # Pares fora do limite recebem um custo proibitivo e são descartados no fim
+        rows, cols = linear_sum_assignment(np.where(gate, cost, max_dist * 1e3 + 1e6))
+        keep = gate[rows, cols]
+        return rows[keep], cols[keep]
+
+    # Alternativa sem SciPy: emparelhar os pares mais próximos primeiro
+    rows, cols = np.nonzero(gate)
+    order = np.argsort(cost[rows, cols], kind='stable')
+    used_rows = np.zeros(cost.shape[0], dtype=bool)
+    used_cols = np.zeros(cost.shape[1], dtype=bool)
+    match_rows, match_cols = [], []
+    for r, c in zip(rows[order], cols[order]):
+        if not used_rows[r] and not used_cols[c]:
+            used_rows[r] = used_cols[c] = True
+            match_rows.append(r)
+            match_cols.append(c)
+    return np.array(match_rows, dtype=np.intp), np.array(match_cols, dtype=np.intp)
+
+class TrackTable:
+    # Contornos visíveis no último frame, guardados em arrays (um elemento por contorno)
+
+    def __init__(self):
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.centers = np.zeros((0, 2), dtype=np.int32)
+        self.frames_visible = np.zeros(0, dtype=np.int32)
+        # Área e caixa (x, y, w, h) de cada contorno, quando conhecidas
+        self.areas = np.zeros(0, dtype=np.float32)
+        self.boxes = np.zeros((0, 4), dtype=np.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, contour_id):
+        return bool((self.ids == contour_id).any())
+
+    def update(self, new_centers, max_dist, next_id, areas=None, boxes=None):
+        # Substituir a tabela pelos centros do frame atual, mantendo o ID dos que correspondem
+        # a um contorno anterior e dando um ID novo aos restantes.
+        # Devolve o próximo ID livre e, para cada centro novo, se correspondeu a um contorno anterior.
+        new_centers = np.asarray(new_centers, dtype=np.int32).reshape(-1, 2)
+        det, trk = assign(pairwise_distances(new_centers, self.centers), max_dist)
+
+        n = len(new_centers)
+        ids = np.empty(n, dtype=np.int64)
+        frames_visible = np.ones(n, dtype=np.int32)
+        matched = np.zeros(n, dtype=bool)
+
+        ids[det] = self.ids[trk]
+        frames_visible[det] = self.frames_visible[trk] + 1
+        matched[det] = True
+
+        n_new = n - len(det)
+        ids[~matched] = np.arange(next_id, next_id + n_new)
+
+        self.ids = ids
+        self.centers = new_centers
+        self.frames_visible = frames_visible
+        self.areas = np.zeros(n, dtype=np.float32) if areas is None else np.asarray(areas, dtype=np.float32).reshape(-1)
+        self.boxes = np.zeros((n, 4), dtype=np.int32) if boxes is None else np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        return next_id + n_new, matched
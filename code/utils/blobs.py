@@ -0,0 +1,82 @@
+import cv2
+import numpy as np
+
+def _components(mask):
+    # Etiquetas em CV_16U (metade da memória e cerca de 2x mais rápido); com mais de 65535
+    # componentes o OpenCV recusa esse tipo e as etiquetas passam a CV_32S
+    try:
+        return cv2.connectedComponentsWithStats(mask, connectivity=8, ltype=cv2.CV_16U)
+    except cv2.error:
+        return cv2.connectedComponentsWithStats(mask, connectivity=8, ltype=cv2.CV_32S)
+
+class Blobs:
+    # Blobs de uma máscara com área mínima, com a mesma semântica que findContours(RETR_EXTERNAL)
+    # seguido de contourArea e moments: a área e o centroide são os do contorno exterior e um blob
+    # dentro do buraco de outro não conta.
+    # As estatísticas do connectedComponentsWithStats servem de pré-filtro vetorizado: a área do contorno
+    # (um polígono pelos centros dos píxeis da borda) nunca passa (w - 1) * (h - 1) da caixa, por isso só
+    # os blobs que passam esse filtro têm o contorno traçado, dentro da sua caixa.
+    # Áreas, caixas (x, y, w, h) e centroides ficam em arrays, um elemento por blob.
+
+    def __init__(self, mask, min_area=0):
+        self._contours = []
+        # Só a região com píxeis é etiquetada
+        x0, y0, w0, h0 = cv2.boundingRect(mask)
+        if w0 == 0:
+            self.areas = np.zeros(0, dtype=np.float64)
+            self.boxes = np.zeros((0, 4), dtype=np.int32)
+            self.centroids = np.zeros((0, 2), dtype=np.float64)
+            return
+        _, label_image, stats, centroids = _components(mask[y0:y0 + h0, x0:x0 + w0])
+
+        # A etiqueta 0 é o fundo
+        w, h = stats[1:, cv2.CC_STAT_WIDTH], stats[1:, cv2.CC_STAT_HEIGHT]
+        candidates = np.flatnonzero((w - 1) * (h - 1) >= min_area) + 1
+
+        areas, centers, boxes, holes = [], [], [], []
+        for label in candidates:
+            x, y, bw, bh = stats[label, :4]
+            blob = (label_image[y:y + bh, x:x + bw] == label).view(np.uint8)
+            contours, hierarchy = cv2.findContours(blob, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE, offset=(int(x + x0), int(y + y0)))
+            # Um só componente: um contorno exterior e, se existirem, os buracos (com pai)
+            outer = int(np.flatnonzero(hierarchy[0, :, 3] == -1)[0])
+            contour = contours[outer]
+            M = cv2.moments(contour)
+            if M['m00'] < min_area:
+                continue
+            areas.append(M['m00'])
+            # Contornos sem área (ex. uma linha) ficam com o centroide dos píxeis
+            centers.append((M['m10'] / M['m00'], M['m01'] / M['m00']) if M['m00'] > 0 else centroids[label] + (x0, y0))
+            boxes.append((x + x0, y + y0, bw, bh))
+            holes.append(len(contours) > 1)
+            self._contours.append(contour)
+
+        boxes = np.array(boxes, dtype=np.int32).reshape(-1, 4)
+        keep = np.ones(len(boxes), dtype=bool)
+        # Blobs dentro do buraco de outro: o RETR_EXTERNAL não os devolve. Se passam a área mínima,
+        # o que os rodeia também passa, por isso basta procurá-los entre os blobs com buracos
+        for i in np.flatnonzero(holes):
+            x, y, bw, bh = boxes[i]
+            inside = ((boxes[:, 0] > x) & (boxes[:, 1] > y) &
+                      (boxes[:, 0] + boxes[:, 2] < x + bw) & (boxes[:, 1] + boxes[:, 3] < y + bh))
+            for j in np.flatnonzero(inside & keep):
+                point = tuple(float(v) for v in self._contours[j][0, 0])
+                if cv2.pointPolygonTest(self._contours[i], point, False) > 0:
+                    keep[j] = False
+
+        self.areas = np.array(areas, dtype=np.float64)[keep]
+        self.boxes = boxes[keep]
+        self.centroids = np.array(centers, dtype=np.float64).reshape(-1, 2)[keep]
+        self._contours = [c for c, k in zip(self._contours, keep) if k]
+
+    def __len__(self):
+        return len(self.areas)
+
+    def contours(self, indices=None):
+        # Contornos exteriores dos blobs escolhidos (por defeito todos os que passaram o filtro de área)
+        if indices is None:
+            return list(self._contours)
+        return [self._contours[i] for i in indices]
+
+    def contour(self, i):
+        return self._contours[i]
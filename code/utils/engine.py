@@ -0,0 +1,58 @@
+import cv2
+from utils.frame_processing import Preprocessor
+from utils.metrics import metrics
+
+# Motor de pipeline com uma só descodificação: cada frame é pré-processado uma vez e os resultados
+# intermédios (preto e branco, BGR equalizado, HSV) são partilhados por vários detetores.
+# Cada detetor é um estágio com process(shared, prev, canvas) (ver AlgaeStage em algea_final.py e
+# FishStage em with_tracking.py/without_tracking.py); os estágios desenham todos no mesmo canvas.
+# Os estágios podem partilhar um RecordWriter (atributo records): o fim de cada frame é marcado aqui.
+
+class SharedFrame:
+    # Resultados intermédios de um frame; o HSV só é calculado se algum estágio o pedir
+
+    def __init__(self, index, bw, eq):
+        self.index = index
+        self.bw = bw
+        self.eq = eq
+        self._hsv = None
+
+    @property
+    def hsv(self):
+        if self._hsv is None:
+            with metrics.stage('hsv'):
+                self._hsv = cv2.cvtColor(self.eq, cv2.COLOR_BGR2HSV)
+        return self._hsv
+
+def run_stages(frames, stages, preprocessor=None, render=True, warmup=0):
+    # Devolve o frame equalizado com as anotações de todos os estágios (ou o índice com render=False).
+    # Os primeiros `warmup` frames só servem de frame anterior (retoma a meio de um vídeo nos peixes)
+    # e não passam pelos estágios nem são devolvidos.
+    if preprocessor is None:
+        # O frame atual e o anterior ficam nos buffers do anel
+        preprocessor = Preprocessor(ring=2)
+    writers = []
+    for stage in stages:
+        if stage.records is not None and all(stage.records is not w for w in writers):
+            writers.append(stage.records)
+
+    prev = None
+    for index, frame in enumerate(frames):
+        with metrics.stage('prep_frame'):
+            bw, eq = preprocessor.prep(frame, 1)
+        shared = SharedFrame(index, bw, eq)
+        if index < warmup:
+            for writer in writers:
+                writer.end_frame()
+            prev = shared
+            continue
+
+        canvas = eq.copy() if render else None
+        for stage in stages:
+            stage.process(shared, prev, canvas)
+        for writer in writers:
+            writer.end_frame()
+        prev = shared
+
+        metrics.frame()
+        yield canvas if render else index
@@ -0,0 +1,284 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import cv2
+import numpy as np
+from utils.frame_processing import Preprocessor
+from utils.motion import MotionEstimator
+
+# Cache em disco dos frames pré-processados (resultado do prep_frame: preto e branco e BGR equalizado)
+# e das transformações afins estimadas pelos pipelines dos peixes. Cada entrada é uma pasta com
+# ficheiros binários lidos com np.memmap, identificada por um hash do vídeo e dos parâmetros.
+# Numa segunda execução sobre o mesmo vídeo a descodificação e o pré-processamento não correm.
+
+CACHE_VERSION = 1
+
+def video_fingerprint(path, block=1 << 20):
+    # Hash do tamanho e do primeiro e último MiB do ficheiro (ler o vídeo todo seria tão lento como descodificá-lo)
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(block))
+        if size > block:
+            f.seek(max(block, size - block))
+            digest.update(f.read(block))
+    return digest.hexdigest()
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+class CacheEntry:
+    # Entrada completa: bw.u8 (N,h,w), eq.u8 (N,h,w,3) e transforms_<pipeline>.f8 (N,2,3),
+    # em que a linha i leva o frame i-1 ao frame i (NaN quando não foi estimada)
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        n, h, w = self.meta['frames'], self.meta['height'], self.meta['width']
+        self.bw = np.memmap(os.path.join(path, 'bw.u8'), dtype=np.uint8, mode='r', shape=(n, h, w)) if n else np.zeros((0, h, w), np.uint8)
+        self.eq = np.memmap(os.path.join(path, 'eq.u8'), dtype=np.uint8, mode='r', shape=(n, h, w, 3)) if n else np.zeros((0, h, w, 3), np.uint8)
+
+    def __len__(self):
+        return self.meta['frames']
+
+    def touch(self):
+        self.meta['last_used'] = time.time()
+        _write_meta(self.path, self.meta)
+
+    def transforms(self, pipeline):
+        path = os.path.join(self.path, f"transforms_{pipeline}.f8")
+        if not self.meta.get('transforms', {}).get(pipeline) or not os.path.exists(path):
+            return None
+        return np.fromfile(path, dtype=np.float64).reshape(-1, 2, 3)
+
+    def save_transforms(self, pipeline, transforms):
+        _write_array(os.path.join(self.path, f"transforms_{pipeline}.f8"), transforms)
+        self.meta.setdefault('transforms', {})[pipeline] = True
+        _write_meta(self.path, self.meta)
+
+def _write_meta(path, meta):
+    tmp = os.path.join(path, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f, indent=4)
+    os.replace(tmp, os.path.join(path, 'meta.json'))
+
+def _write_array(path, array):
+    tmp = f"{path}.tmp"
+    np.ascontiguousarray(array).tofile(tmp)
+    os.replace(tmp, path)
+
+class CachedFrames:
+    # Substitui o VideoReader e o Preprocessor: devolve os índices dos frames e prep(índice)
+    # devolve os frames guardados (copiados para buffers reutilizados, como o Preprocessor)
+
+    def __init__(self, entry, ring=2):
+        self.entry = entry
+        self.ring = ring
+        self.slot = 0
+        self.index = -1  # Último frame pedido ao prep
+        h, w = entry.bw.shape[1:]
+        self.bw_buf = [np.empty((h, w), dtype=np.uint8) for _ in range(ring)]
+        self.eq_buf = [np.empty((h, w, 3), dtype=np.uint8) for _ in range(ring)]
+
+    def __iter__(self):
+        return iter(range(len(self.entry)))
+
+    def prep(self, index, save_copy=0):
+        self.index = index
+        i = self.slot
+        self.slot = (self.slot + 1) % self.ring
+        bw = self.bw_buf[i]
+        np.copyto(bw, self.entry.bw[index])
+        if not save_copy:
+            return bw
+        eq = self.eq_buf[i]
+        np.copyto(eq, self.entry.eq[index])
+        return bw, eq
+
+class RecordingPreprocessor:
+    # Preprocessor que também guarda cada frame numa entrada nova da cache
+
+    def __init__(self, cache, key, meta, width=1280, height=720, ring=2, equalize=None):
+        self.cache = cache
+        self.key = key
+        self.meta = meta
+        self.inner = Preprocessor(width, height, ring, equalize)
+        self.index = -1
+        # A entrada é escrita numa pasta temporária e só passa a existir quando estiver completa
+        self.tmp_path = os.path.join(cache.root, f"{key}.tmp-{os.getpid()}")
+        os.makedirs(self.tmp_path, exist_ok=True)
+        self.bw_file = open(os.path.join(self.tmp_path, 'bw.u8'), 'wb')
+        self.eq_file = open(os.path.join(self.tmp_path, 'eq.u8'), 'wb')
+
+    def prep(self, frame, save_copy=0):
+        bw, eq = self.inner.prep(frame, 1)
+        bw.tofile(self.bw_file)
+        eq.tofile(self.eq_file)
+        self.index += 1
+        if save_copy:
+            return bw, eq
+        return bw
+
+    def finish(self, complete):
+        # Com complete=False (vídeo não lido até ao fim) a entrada é descartada
+        self.bw_file.close()
+        self.eq_file.close()
+        if not complete:
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+            return None
+        self.meta.update(frames=self.index + 1, created=time.time(), last_used=time.time(), transforms={})
+        _write_meta(self.tmp_path, self.meta)
+        path = self.cache.entry_path(self.key)
+        if os.path.exists(path):
+            # Outro processo completou a mesma entrada entretanto
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+        else:
+            os.replace(self.tmp_path, path)
+        self.cache.evict(keep=self.key)
+        return CacheEntry(path)
+
+class CachedEstimator:
+    # Usa as transformações guardadas; os frames sem transformação (NaN) passam pelo estimador real.
+    # frames é o CachedFrames/RecordingPreprocessor que indica o índice do frame atual.
+
+    def __init__(self, inner, frames, transforms=None):
+        self.inner = inner
+        self.frames = frames
+        self.transforms = transforms
+        self.recorded = {}
+
+    @property
+    def name(self):
+        return self.inner.name
+
+    @property
+    def fallback(self):
+        return self.inner.fallback
+
+    @property
+    def last_transform(self):
+        return self.inner.last_transform
+
+    def skip(self):
+        self.inner.skip()
+
+    def compensate(self, prev_frame_bw, curr_frame_bw, prev_img=None, curr_img=None):
+        index = self.frames.index
+        if self.transforms is not None and index < len(self.transforms) and np.isfinite(self.transforms[index]).all():
+            transform_matrix = self.transforms[index]
+            # O estimador real perde a continuidade dos pontos
+            self.inner.skip()
+            self.inner.last_transform = transform_matrix
+            h, w = curr_frame_bw.shape[:2]
+            return cv2.warpAffine(prev_frame_bw, transform_matrix, (w, h)), None
+        frame_transformed, mask = self.inner.compensate(prev_frame_bw, curr_frame_bw, prev_img, curr_img)
+        self.recorded[index] = self.inner.last_transform
+        return frame_transformed, mask
+
+    def save(self, entry, pipeline, complete):
+        # Guardar as transformações estimadas nesta execução (só se o vídeo foi processado até ao fim)
+        if not complete or not self.recorded or self.transforms is not None:
+            return
+        transforms = np.full((len(entry), 2, 3), np.nan)
+        for index, matrix in self.recorded.items():
+            transforms[index] = matrix
+        entry.save_transforms(pipeline, transforms)
+
+class FrameCache:
+
+    def __init__(self, root, max_bytes=20 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, video_path, params):
+        params = dict(params, version=CACHE_VERSION, video=video_fingerprint(video_path))
+        return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:20]
+
+    def entry_path(self, key):
+        return os.path.join(self.root, key)
+
+    def entries(self):
+        # Entradas completas (as pastas temporárias ficam de fora)
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path) and '.tmp-' not in name and os.path.exists(os.path.join(path, 'meta.json')):
+                yield name, path
+
+    def evict(self, keep=None):
+        # Apagar as entradas usadas há mais tempo até o total caber em max_bytes
+        entries = []
+        for key, path in self.entries():
+            try:
+                with open(os.path.join(path, 'meta.json')) as f:
+                    last_used = json.load(f).get('last_used', 0)
+            except (OSError, ValueError):
+                last_used = 0
+            entries.append((last_used, key, path, _dir_size(path)))
+        total = sum(e[3] for e in entries)
+        for _, key, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def open(self, video_path, width=1280, height=720, equalize=None):
+        # Devolve (frames, preprocessor, entrada ou gravador): com a entrada em cache os frames são índices
+        # e o vídeo não é lido; sem ela o preprocessor grava os frames à medida que são processados
+        params = {'width': width, 'height': height, 'median': 11}
+        if equalize is not None:
+            # Equalização com LUTs em cache (CachedEqualizer): outra entrada
+            params['equalize'] = equalize
+        key = self.key(video_path, params)
+        path = self.entry_path(key)
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            entry = CacheEntry(path)
+            entry.touch()
+            frames = CachedFrames(entry)
+            return frames, frames, entry
+        meta = dict(params, video=os.path.abspath(video_path))
+        recorder = RecordingPreprocessor(self, key, meta, width, height, equalize=equalize)
+        return None, recorder, recorder
+
+class CacheSession:
+    # Liga a cache a uma execução de um pipeline dos peixes: source, preprocessor e estimator
+    # são passados ao process_fish e finish() é chamado no fim (frames é o VideoReader).
+    # As transformações são guardadas por pipeline e por estimador do movimento.
+
+    def __init__(self, cache, video_path, frames, pipeline, estimator=None, equalize=None, width=1280, height=720):
+        cached, self.preprocessor, self.handle = cache.open(video_path, width, height, equalize)
+        self.hit = cached is not None
+        self.frames = frames
+        self.source = cached if self.hit else frames
+        estimator = estimator or MotionEstimator()
+        self.pipeline = f"{pipeline}_{estimator.name}"
+        transforms = self.handle.transforms(self.pipeline) if self.hit else None
+        self.estimator = CachedEstimator(estimator, self.preprocessor, transforms)
+
+    def finish(self):
+        if self.hit:
+            # O vídeo não chegou a ser lido
+            self.frames.close()
+            complete = self.preprocessor.index == len(self.handle) - 1
+            entry = self.handle
+        else:
+            complete = self.frames.finished
+            entry = self.handle.finish(complete)
+        if entry is not None:
+            self.estimator.save(entry, self.pipeline, complete)
+        return entry
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cache', help="pasta da cache de frames pré-processados (desligada por defeito)")
+    parser.add_argument('--cache-size', type=float, default=20, help="tamanho máximo da cache (GB)")
+    return parser
+
+def cache_from_args(args):
+    if args.cache:
+        return FrameCache(args.cache, int(args.cache_size * 1024 ** 3))
+    return None
@@ -1,5 +1,6 @@
 import cv2
 import numpy as np
+from utils.morphology import elliptical
 
 def histo(frame, name):
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
@@ -36,6 +37,9 @@ def motion_compensation(prev_frame, curr_frame):
     # Detecção de pontos de característica usando Shi-Tomasi
     prev_points = cv2.goodFeaturesToTrack(prev_frame, maxCorners=1000, qualityLevel=0.01, minDistance=30)
     # print(prev_points)
+    if prev_points is None:
+        # Sem pontos (ex. frame uniforme): assumir que a câmara não se moveu
+        return prev_frame.copy(), None
     # Cálculo do fluxo óptico usando Lucas-Kanade
     curr_points, status, _ = cv2.calcOpticalFlowPyrLK(prev_frame, curr_frame, prev_points, None)
 
@@ -43,26 +47,42 @@ def motion_compensation(prev_frame, curr_frame):
     prev_points = prev_points[status == 1]
     curr_points = curr_points[status == 1]
 
-    # Estimação da transformação
-    transform_matrix, mask = cv2.estimateAffinePartial2D(prev_points, curr_points)
+    # Estimação da transformação (identidade se não houver pontos suficientes)
+    transform_matrix, mask = None, None
+    if len(prev_points) >= 3:
+        transform_matrix, mask = cv2.estimateAffinePartial2D(prev_points, curr_points)
+    if transform_matrix is None:
+        transform_matrix = np.eye(2, 3)
     frame1_transformed = cv2.warpAffine(prev_frame, transform_matrix, (curr_frame.shape[1], curr_frame.shape[0]))
 
     return frame1_transformed, mask
 
+# Parâmetros do Lucas-Kanade (os mesmos por defeito do OpenCV)
+LK_WIN_SIZE = (21, 21)
+LK_MAX_LEVEL = 3
+
 def motion_compensation_v2(prev_frame_bw, curr_frame_bw, prev_frame, curr_frame):
 
     # Detecção de pontos de característica usando Shi-Tomasi
     prev_points = cv2.goodFeaturesToTrack(prev_frame_bw, maxCorners=1000, qualityLevel=0.01, minDistance=30)
+    if prev_points is None:
+        # Sem pontos (ex. frame uniforme): assumir que a câmara não se moveu
+        return prev_frame_bw.copy(), None
 
     # Cálculo do fluxo óptico usando Lucas-Kanade
-    curr_points, status, _ = cv2.calcOpticalFlowPyrLK(prev_frame, curr_frame, prev_points, None)
+    curr_points, status, _ = cv2.calcOpticalFlowPyrLK(prev_frame, curr_frame, prev_points, None,
+                                                      winSize=LK_WIN_SIZE, maxLevel=LK_MAX_LEVEL)
 
     # Seleção de pontos válidos
     prev_points = prev_points[status == 1]
     curr_points = curr_points[status == 1]
 
-    # Estimação da transformação
-    transform_matrix, mask = cv2.estimateAffinePartial2D(prev_points, curr_points)
+    # Estimação da transformação (identidade se não houver pontos suficientes)
+    transform_matrix, mask = None, None
+    if len(prev_points) >= 3:
+        transform_matrix, mask = cv2.estimateAffinePartial2D(prev_points, curr_points)
+    if transform_matrix is None:
+        transform_matrix = np.eye(2, 3)
     frame1_transformed = cv2.warpAffine(prev_frame_bw, transform_matrix, (curr_frame.shape[1], curr_frame.shape[0]))
 
     return frame1_transformed, mask
@@ -71,7 +91,7 @@ def motion_compensation_v2(prev_frame_bw, curr_frame_bw, prev_frame, curr_frame)
 def euclidean_distance(p1, p2):
     return np.sqrt((p1[0] - p2[0]) ** 2 + (p1[1] - p2[1]) ** 2)
 
-def filtering(frame_transformed, frame):
+def filtering(frame_transformed, frame, morph_mode='exact'):
      # Diferença entre o frame compensado e o frame atual
     diff_frame = cv2.absdiff(frame_transformed, frame)
    
@@ -79,19 +99,18 @@ def filtering(frame_transformed, frame):
     _, thresh_diff = cv2.threshold(diff_frame, 70, 255, cv2.THRESH_BINARY)
 
     # Remoção de ruídos com operações morfológicas e juntar "brancos" proximos
-    kernel1 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
-    kernel2 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (100, 100))
-
-    clean_diff = cv2.morphologyEx(thresh_diff, cv2.MORPH_OPEN, kernel1)
-    clean_diff = cv2.morphologyEx(clean_diff, cv2.MORPH_CLOSE, kernel2)
+    # (o fecho 100x100 pode usar um motor rápido aproximado, ver utils/morphology.py)
+    clean_diff = elliptical(thresh_diff, cv2.MORPH_OPEN, (7, 7))
+    clean_diff = elliptical(clean_diff, cv2.MORPH_CLOSE, (100, 100), morph_mode)
 
-    h, w = clean_diff.shape
+    return clear_borders(clean_diff)
 
-    # Definir a espessura das bordas a serem preenchidas
-    border_thickness = 15  
+def clear_borders(mask, border_thickness=15):
+    # Apagar as bordas da máscara (border_thickness é a espessura das bordas a serem preenchidas)
+    h, w = mask.shape
 
     # Preencher as bordas com retângulos
-    mask_no_borders = cv2.rectangle(clean_diff, (0, 0), (w - 1, border_thickness - 1), 0, -1)  # Borda superior
+    mask_no_borders = cv2.rectangle(mask, (0, 0), (w - 1, border_thickness - 1), 0, -1)  # Borda superior
     mask_no_borders = cv2.rectangle(mask_no_borders, (0, h - border_thickness), (w - 1, h - 1), 0, -1)  # Borda inferior
     mask_no_borders = cv2.rectangle(mask_no_borders, (0, 0), (border_thickness - 1, h - 1), 0, -1)  # Borda esquerda
     mask_no_borders = cv2.rectangle(mask_no_borders, (w - border_thickness, 0), (w - 1, h - 1), 0, -1)  # Borda direita
@@ -116,3 +135,152 @@ def prep_frame(frame, save_copy = 0):
     if save_copy:
         return frame, copy
     return frame
+
+def equalize_lut(hist):
+    # Tabela de equalização igual à que o cv2.equalizeHist calcula a partir do histograma
+    hist = np.asarray(hist, dtype=np.float32).ravel()
+    lut = np.zeros(256, dtype=np.uint8)
+    nonzero = np.flatnonzero(hist)
+    if len(nonzero) == 0:
+        return lut
+    first = nonzero[0]
+    total = hist.sum()
+    if hist[first] == total:
+        lut[:] = first
+        return lut
+    scale = np.float32(255.0 / (total - hist[first]))
+    cdf = np.cumsum(hist[first + 1:], dtype=np.float32)
+    lut[first + 1:] = np.clip(np.rint(cdf * scale), 0, 255)
+    return lut
+
+class CachedEqualizer:
+    # Equalização por canal com as LUTs reaproveitadas entre frames. O histograma é calculado numa versão
+    # reduzida do frame (1 em cada `step` píxeis por eixo) e as LUTs só são recalculadas a cada `refresh`
+    # frames ou quando o histograma se afasta mais de `drift` (distância L1 normalizada, 0 a 1) do usado
+    # na última atualização. Entre atualizações o frame passa só por um cv2.LUT, o que também evita a
+    # cintilação que a equalização frame a frame introduz na diferença entre frames.
+    # Com refresh=1 e step=1 o resultado é igual ao do cv2.equalizeHist em cada canal.
+
+    def __init__(self, refresh=1, drift=0.05, step=1):
+        self.refresh = max(1, refresh)
+        self.drift = drift
+        self.step = max(1, step)
+        self.lut = None
+        self.small = None
+        self.hist = np.empty((256, 1), dtype=np.float32)
+        self.reference = None  # Histogramas normalizados da última atualização, (canais, 256)
+        self.age = 0
+        self.frames = 0
+        self.refreshes = 0
+
+    @property
+    def exact(self):
+        return self.refresh == 1 and self.step == 1
+
+    def reset(self):
+        self.reference = None
+
+    def histograms(self, frame):
+        if self.step > 1:
+            h, w = frame.shape[:2]
+            size = (max(1, w // self.step), max(1, h // self.step))
+            shape = (size[1], size[0]) + frame.shape[2:]
+            if self.small is None or self.small.shape != shape:
+                self.small = np.empty(shape, dtype=np.uint8)
+            frame = cv2.resize(frame, size, dst=self.small, interpolation=cv2.INTER_NEAREST)
+        channels = 1 if frame.ndim == 2 else frame.shape[2]
+        hists = np.empty((channels, 256), dtype=np.float32)
+        for c in range(channels):
+            cv2.calcHist([frame], [c], None, [256], [0, 256], hist=self.hist)
+            hists[c] = self.hist.ravel()
+        return hists
+
+    def update(self, frame):
+        # Devolve a LUT a aplicar ao frame, recalculada só quando necessário
+        self.frames += 1
+        channels = 1 if frame.ndim == 2 else frame.shape[2]
+        if self.lut is None or self.lut.shape[2] != channels:
+            self.lut = np.empty((1, 256, channels), dtype=np.uint8)
+            self.reference = None
+
+        if self.exact:
+            hists = self.histograms(frame)
+        else:
+            self.age += 1
+            if self.reference is not None and self.age < self.refresh and self.drift <= 0:
+                return self.lut
+            hists = self.histograms(frame)
+            normalized = hists / max(1.0, hists[0].sum())
+            if self.reference is not None and self.age < self.refresh:
+                if 0.5 * np.abs(normalized - self.reference).sum(axis=1).max() <= self.drift:
+                    return self.lut
+            self.reference = normalized
+            self.age = 0
+
+        for c in range(channels):
+            self.lut[0, :, c] = equalize_lut(hists[c])
+        self.refreshes += 1
+        return self.lut
+
+    def apply(self, frame, dst=None):
+        if self.exact and frame.ndim == 2:
+            return cv2.equalizeHist(frame, dst=dst)
+        lut = self.update(frame)
+        return cv2.LUT(frame, lut if frame.ndim == 3 else lut[..., 0], dst=dst)
+
+def add_equalize_arguments(parser):
+    parser.add_argument('--eq-refresh', type=int, default=1,
+                        help="recalcular as LUTs de equalização a cada N frames (1 = equalização exata em cada frame)")
+    parser.add_argument('--eq-drift', type=float, default=0.05,
+                        help="recalcular antes disso quando o histograma muda mais do que esta fração")
+    parser.add_argument('--eq-step', type=int, default=4, help="histograma calculado em 1 de cada N píxeis por eixo (com --eq-refresh > 1)")
+    return parser
+
+def equalize_from_args(args):
+    # Parâmetros do CachedEqualizer, ou None para a equalização exata
+    if args.eq_refresh <= 1:
+        return None
+    return {'refresh': args.eq_refresh, 'drift': args.eq_drift, 'step': args.eq_step}
+
+class Preprocessor:
+    # Versão de prep_frame sem alocações por frame: todos os passos escrevem em buffers
+    # reutilizados. A equalização por canal é feita com uma LUT de 3 canais, sem split/merge.
+    # Os frames devolvidos pertencem a um anel de `ring` buffers e são reescritos `ring` frames depois.
+    # equalize (opcional) são os parâmetros de um CachedEqualizer; por defeito a equalização é exata.
+
+    def __init__(self, width=1280, height=720, ring=2, equalize=None):
+        self.width = width
+        self.height = height
+        self.ring = ring
+        self.index = 0
+
+        self.resized = np.empty((height, width, 3), dtype=np.uint8)
+        self.gray = np.empty((height, width), dtype=np.uint8)
+        self.gray_eq = np.empty((height, width), dtype=np.uint8)
+        self.equalizer = CachedEqualizer(**(equalize or {}))
+        self.gray_equalizer = CachedEqualizer(**(equalize or {}))
+        self.eq = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(ring)]
+        self.bw = [np.empty((height, width), dtype=np.uint8) for _ in range(ring)]
+
+    def equalize(self, frame, dst):
+        # Equalizar os três canais de uma vez através de uma LUT por canal
+        return self.equalizer.apply(frame, dst)
+
+    def prep(self, frame, save_copy=0):
+        # Mesmo resultado que prep_frame(frame, save_copy) (com a equalização exata)
+        i = self.index
+        self.index = (self.index + 1) % self.ring
+        eq, bw = self.eq[i], self.bw[i]
+
+        if frame.shape[:2] == (self.height, self.width):
+            src = frame
+        else:
+            src = cv2.resize(frame, (self.width, self.height), dst=self.resized)
+
+        self.equalize(src, eq)
+        cv2.cvtColor(eq, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        self.gray_equalizer.apply(self.gray, self.gray_eq)
+        cv2.medianBlur(self.gray_eq, 11, dst=bw)
+        if save_copy:
+            return bw, eq
+        return bw
@@ -0,0 +1,120 @@
+import json
+import os
+import cv2
+import numpy as np
+from utils.frame_cache import video_fingerprint
+from utils.frame_processing import CachedEqualizer
+
+# Histograma HSV 3D de todo o vídeo, para afinar os limites das algas no color.py.
+# É calculado uma vez sobre frames amostrados ao longo do vídeo (equalizados como no color.py) e
+# guardado ao lado do vídeo; a cobertura de um conjunto de intervalos em todo o vídeo é depois uma
+# soma sobre os bins selecionados, sem voltar a ler frames.
+
+# Largura dos bins em cada canal (H vai de 0 a 179, S e V de 0 a 255)
+BIN_WIDTH = (4, 4, 4)
+RANGES = (180, 256, 256)
+HIST_VERSION = 1
+
+def _bins(channel, lo, hi):
+    # Bins que contêm valores do intervalo [lo, hi]: aproximado à largura dos bins
+    w = BIN_WIDTH[channel]
+    return int(lo) // w, int(hi) // w
+
+class HSVHistogram:
+
+    def __init__(self, hist, meta=None):
+        self.hist = hist
+        self.total = float(hist.sum())
+        self.meta = meta or {}
+
+    @classmethod
+    def build(cls, video_path, samples=120, size=(640, 480)):
+        # Amostrar `samples` frames espaçados uniformemente pelo vídeo
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise IOError(f"Erro ao abrir o vídeo {video_path}")
+        n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        indices = np.unique(np.linspace(0, max(0, n_frames - 1), samples).astype(int)) if n_frames > 0 else range(samples)
+        bins = [r // w for r, w in zip(RANGES, BIN_WIDTH)]
+        hist = np.zeros(bins, dtype=np.float32)
+        equalizer = CachedEqualizer()
+        used = 0
+        for index in indices:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            ret, frame = cap.read()
+            if not ret:
+                continue
+            frame = equalizer.apply(cv2.resize(frame, size))
+            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+            hist += cv2.calcHist([hsv], [0, 1, 2], None, bins, [0, RANGES[0], 0, RANGES[1], 0, RANGES[2]])
+            used += 1
+        cap.release()
+        return cls(hist, {'frames': used, 'size': list(size), 'video_frames': n_frames})
+
+    @staticmethod
+    def cache_path(video_path):
+        return os.path.splitext(video_path)[0] + '.hsv_hist.npz'
+
+    @classmethod
+    def load_or_build(cls, video_path, samples=120, size=(640, 480)):
+        # Reutilizar o histograma guardado se foi calculado para o mesmo vídeo e parâmetros
+        params = {'video': video_fingerprint(video_path), 'samples': samples, 'size': list(size),
+                  'bins': list(BIN_WIDTH), 'version': HIST_VERSION}
+        key = json.dumps(params, sort_keys=True)
+        path = cls.cache_path(video_path)
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    if str(data['key']) == key:
+                        return cls(data['hist'], json.loads(str(data['meta'])))
+            except (OSError, KeyError, ValueError):
+                pass
+        histogram = cls.build(video_path, samples, size)
+        np.savez_compressed(path, hist=histogram.hist, key=key, meta=json.dumps(histogram.meta))
+        return histogram
+
+    def selection(self, limits_list):
+        # Bins selecionados pela união dos intervalos (dicionários {"H": {"min", "max"}, ...} do color.py)
+        selected = np.zeros(self.hist.shape, dtype=bool)
+        for limits in limits_list:
+            (h0, h1), (s0, s1), (v0, v1) = (_bins(c, limits[k]['min'], limits[k]['max']) for c, k in enumerate('HSV'))
+            if h1 >= h0 and s1 >= s0 and v1 >= v0:
+                selected[h0:h1 + 1, s0:s1 + 1, v0:v1 + 1] = True
+        return selected
+
+    def coverage(self, limits_list):
+        # Fração dos píxeis de todo o vídeo selecionada pelos intervalos
+        if self.total == 0:
+            return 0.0
+        return float(self.hist[self.selection(limits_list)].sum()) / self.total
+
+    def suggest(self, seeds, grow=0.2, low=10, high=90):
+        # Intervalo sugerido a partir de valores HSV (Nx3) de píxeis escolhidos: começa nos percentis
+        # low-high dos pontos e alarga cada canal enquanto o histograma do vídeo, dentro do intervalo
+        # dos outros canais, tiver pelo menos `grow` vezes o pico dentro do intervalo
+        seeds = np.asarray(seeds, dtype=np.int32).reshape(-1, 3)
+        lo = [_bins(c, v, v)[0] for c, v in enumerate(np.percentile(seeds, low, axis=0))]
+        hi = [_bins(c, v, v)[0] for c, v in enumerate(np.percentile(seeds, high, axis=0))]
+
+        changed = True
+        while changed:
+            changed = False
+            for c in range(3):
+                # Marginal no canal c dentro do intervalo dos outros dois canais
+                box = tuple(slice(lo[k], hi[k] + 1) for k in range(3) if k != c)
+                marginal = np.moveaxis(self.hist, c, 0)[(slice(None),) + box].sum(axis=(1, 2))
+                peak = marginal[lo[c]:hi[c] + 1].max()
+                if peak <= 0:
+                    continue
+                if lo[c] > 0 and marginal[lo[c] - 1] >= grow * peak:
+                    lo[c] -= 1
+                    changed = True
+                if hi[c] < len(marginal) - 1 and marginal[hi[c] + 1] >= grow * peak:
+                    hi[c] += 1
+                    changed = True
+
+        limits = {}
+        for c, k in enumerate('HSV'):
+            w = BIN_WIDTH[c]
+            limits[k] = {'min': int(lo[c] * w), 'max': int(min(RANGES[c] - 1, (hi[c] + 1) * w - 1))}
+        return limits
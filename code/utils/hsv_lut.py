@@ -0,0 +1,87 @@
+import cv2
+import numpy as np
+import hashlib
+import os
+
+# Cada plano da LUT guarda até 8 intervalos (um bit por intervalo)
+RANGES_PER_PLANE = 8
+
+def merge_ranges(min_lim, max_lim):
+    # Juntar intervalos equivalentes: caixas que só diferem num canal e cujos intervalos
+    # nesse canal se tocam ou sobrepõem podem ser substituídas por uma única caixa
+    boxes = [(tuple(int(v) for v in l_min), tuple(int(v) for v in l_max)) for l_min, l_max in zip(min_lim, max_lim)]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                (lo1, hi1), (lo2, hi2) = boxes[i], boxes[j]
+                diff = [c for c in range(3) if lo1[c] != lo2[c] or hi1[c] != hi2[c]]
+                if len(diff) > 1:
+                    continue
+                c = diff[0] if diff else 0
+                if lo2[c] > hi1[c] + 1 or lo1[c] > hi2[c] + 1:
+                    continue
+                lo = list(lo1)
+                hi = list(hi1)
+                lo[c] = min(lo1[c], lo2[c])
+                hi[c] = max(hi1[c], hi2[c])
+                boxes[i] = (tuple(lo), tuple(hi))
+                del boxes[j]
+                merged = True
+                break
+            if merged:
+                break
+    return boxes
+
+def compile_limits(min_lim, max_lim):
+    # Compilar os limites HSV numa LUT por canal com um bit por intervalo.
+    # Um pixel pertence à máscara se algum bit estiver ligado nos três canais ao mesmo tempo.
+    boxes = merge_ranges(min_lim, max_lim)
+    n_planes = max(1, -(-len(boxes) // RANGES_PER_PLANE))
+    lut = np.zeros((n_planes, 1, 256, 3), dtype=np.uint8)
+    values = np.arange(256)
+    for k, (lo, hi) in enumerate(boxes):
+        plane, bit = divmod(k, RANGES_PER_PLANE)
+        for c in range(3):
+            inside = (values >= lo[c]) & (values <= hi[c])
+            lut[plane, 0, inside, c] |= np.uint8(1 << bit)
+    return lut
+
+def segment(frame_hsv, lut):
+    # Máscara combinada de todos os intervalos com uma só passagem de LUT por plano
+    # (equivalente a fazer inRange + bitwise_or para cada intervalo)
+    combined_mask = None
+    for plane in lut:
+        bits = cv2.LUT(frame_hsv, plane)
+        h, s, v = cv2.split(bits)
+        cv2.bitwise_and(h, s, dst=h)
+        cv2.bitwise_and(h, v, dst=h)
+        if combined_mask is None:
+            combined_mask = h
+        else:
+            cv2.bitwise_or(combined_mask, h, dst=combined_mask)
+    return cv2.compare(combined_mask, 0, cv2.CMP_GT)
+
+def limits_key(min_lim, max_lim):
+    data = np.array([np.concatenate((l_min, l_max)) for l_min, l_max in zip(min_lim, max_lim)], dtype=np.int32)
+    return hashlib.sha1(data.tobytes()).hexdigest()
+
+def load_compiled_limits(json_file, min_lim, max_lim):
+    # Usar a LUT guardada ao lado do limits.json se foi compilada para os mesmos limites
+    cache_file = os.path.splitext(json_file)[0] + '.lut.npz'
+    key = limits_key(min_lim, max_lim)
+    if os.path.exists(cache_file):
+        try:
+            with np.load(cache_file) as data:
+                if str(data['key']) == key:
+                    return data['lut']
+        except (OSError, KeyError, ValueError):
+            pass
+
+    lut = compile_limits(min_lim, max_lim)
+    try:
+        np.savez(cache_file, key=key, lut=lut)
+    except OSError:
+        pass
+    return lut
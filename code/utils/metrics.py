@@ -0,0 +1,209 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Limites dos buckets dos histogramas de latência (segundos)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Contexto reutilizado quando as métricas estão desligadas (custo de uma chamada de função)
+_NULL = nullcontext()
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(BUCKETS) and value > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        # Aproximação pelo limite superior do bucket
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        total = 0
+        for i, c in enumerate(self.counts):
+            total += c
+            if total >= target:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return self.max
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+class Metrics:
+    # Instrumentação das etapas do pipeline: histogramas de latência, contadores e gauges,
+    # exportados periodicamente para JSON e para o formato de texto do Prometheus.
+    # Desligada por defeito; nesse caso stage() devolve um contexto vazio e o resto não faz nada.
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {'frames_processed': 0, 'frames_dropped': 0}
+        self.gauges = {}
+        self.started = time.time()
+        self.last_export = time.monotonic()
+
+    def configure(self, json_path=None, prometheus_path=None, interval=10.0, pipeline=''):
+        self.enabled = True
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.pipeline = pipeline
+        # Só o processo que configurou exporta (os processos filhos de um pool herdam o estado)
+        self.pid = os.getpid()
+        self.reset()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL
+        return _Timer(self, name)
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = Histogram()
+            hist.observe(seconds)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        self.gauges[name] = value
+
+    def frame(self, tracked=None):
+        # Marcar um frame como processado e exportar se já passou o intervalo
+        if not self.enabled:
+            return
+        self.count('frames_processed')
+        if tracked is not None:
+            self.gauge('tracked_objects', tracked)
+        if time.monotonic() - self.last_export >= self.interval:
+            self.export()
+
+    def memory_peak_bytes(self):
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    def snapshot(self):
+        with self.lock:
+            stages = {}
+            for name, h in self.histograms.items():
+                stages[name] = {
+                    'count': h.count,
+                    'sum_s': h.sum,
+                    'mean_ms': 1000 * h.sum / h.count if h.count else 0.0,
+                    'p50_ms': 1000 * h.quantile(0.5),
+                    'p90_ms': 1000 * h.quantile(0.9),
+                    'p99_ms': 1000 * h.quantile(0.99),
+                    'max_ms': 1000 * h.max,
+                    'buckets': {str(le): c for le, c in zip(BUCKETS + ('+Inf',), h.counts)},
+                }
+            counters = dict(self.counters)
+        gauges = dict(self.gauges)
+        peak = self.memory_peak_bytes()
+        if peak is not None:
+            gauges['memory_peak_bytes'] = peak
+        return {
+            'pipeline': self.pipeline,
+            'timestamp': time.time(),
+            'uptime_s': time.time() - self.started,
+            'stages': stages,
+            'counters': counters,
+            'gauges': gauges,
+        }
+
+    def prometheus(self, snapshot=None):
+        snap = snapshot or self.snapshot()
+        label = f'pipeline="{snap["pipeline"]}"'
+        lines = ['# HELP underwater_stage_seconds Latência de cada etapa do pipeline',
+                 '# TYPE underwater_stage_seconds histogram']
+        with self.lock:
+            hists = {name: (list(h.counts), h.sum, h.count) for name, h in self.histograms.items()}
+        for name, (counts, total, n) in hists.items():
+            cumulative = 0
+            for le, c in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += c
+                lines.append(f'underwater_stage_seconds_bucket{{{label},stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'underwater_stage_seconds_sum{{{label},stage="{name}"}} {total}')
+            lines.append(f'underwater_stage_seconds_count{{{label},stage="{name}"}} {n}')
+        for name, value in snap['counters'].items():
+            lines.append(f'# TYPE underwater_{name}_total counter')
+            lines.append(f'underwater_{name}_total{{{label}}} {value}')
+        for name, value in snap['gauges'].items():
+            lines.append(f'# TYPE underwater_{name} gauge')
+            lines.append(f'underwater_{name}{{{label}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self):
+        if not self.enabled or os.getpid() != self.pid:
+            return
+        self.last_export = time.monotonic()
+        snap = self.snapshot()
+        if self.json_path:
+            write_atomic(self.json_path, json.dumps(snap, indent=4))
+        if self.prometheus_path:
+            write_atomic(self.prometheus_path, self.prometheus(snap))
+
+def write_atomic(path, text):
+    # Escrever para um ficheiro temporário e substituir, para quem lê nunca ver um ficheiro a meio
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+# Instância usada por todos os módulos
+metrics = Metrics()
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics', help="prefixo dos ficheiros de métricas (<prefixo>.json e <prefixo>.prom)")
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help="intervalo de exportação das métricas (s)")
+    return parser
+
+def configure_from_args(args, pipeline):
+    if args.metrics:
+        metrics.configure(f"{args.metrics}.json", f"{args.metrics}.prom", args.metrics_interval, pipeline)
@@ -0,0 +1,132 @@
+import cv2
+import numpy as np
+from functools import lru_cache
+
+# exact: morfologia normal do OpenCV
+# downscale: kernels grandes aplicados numa máscara reduzida e depois ampliada
+# rect: a elipse é aproximada pela união de alguns retângulos (operações separáveis)
+MODES = ('exact', 'downscale', 'rect')
+
+# Abaixo deste tamanho o kernel já é barato e usa-se sempre o modo exato
+MIN_FAST_SIZE = 15
+
+# Comparação periódica com o resultado exato (0 = desligada)
+_check_every = 0
+_calls = {}
+_iou = {}
+
+@lru_cache(maxsize=None)
+def ellipse_kernel(ksize):
+    return cv2.getStructuringElement(cv2.MORPH_ELLIPSE, ksize)
+
+@lru_cache(maxsize=None)
+def ellipse_rects(ksize, n_rects=3):
+    # Retângulos inscritos na elipse cuja união a aproxima
+    a, b = (ksize[0] - 1) / 2, (ksize[1] - 1) / 2
+    rects = []
+    for i in range(1, n_rects + 1):
+        theta = np.pi / 2 * i / (n_rects + 1)
+        half_w = int(round(a * np.cos(theta)))
+        half_h = int(round(b * np.sin(theta)))
+        rects.append(cv2.getStructuringElement(cv2.MORPH_RECT, (2 * half_w + 1, 2 * half_h + 1)))
+    return tuple(rects)
+
+def _as_size(ksize):
+    return (ksize, ksize) if isinstance(ksize, int) else tuple(ksize)
+
+def _exact(mask, op, ksize):
+    return cv2.morphologyEx(mask, op, ellipse_kernel(ksize))
+
+def _downscale(mask, op, ksize, scale):
+    h, w = mask.shape[:2]
+    small = cv2.resize(mask, (max(1, w // scale), max(1, h // scale)), interpolation=cv2.INTER_AREA)
+    _, small = cv2.threshold(small, 127, 255, cv2.THRESH_BINARY)
+    small_ksize = (max(1, ksize[0] // scale), max(1, ksize[1] // scale))
+    small = cv2.morphologyEx(small, op, ellipse_kernel(small_ksize))
+    result = cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR)
+    _, result = cv2.threshold(result, 127, 255, cv2.THRESH_BINARY)
+
+    # O fecho nunca remove píxeis e a abertura nunca acrescenta, por isso recuperar o detalhe perdido na redução
+    if op == cv2.MORPH_CLOSE:
+        return cv2.bitwise_or(result, mask)
+    if op == cv2.MORPH_OPEN:
+        return cv2.bitwise_and(result, mask)
+    return result
+
+def _rect(mask, op, ksize, n_rects):
+    # Dilatar pela união dos retângulos = máximo das dilatações; erodir = mínimo das erosões
+    rects = ellipse_rects(ksize, n_rects)
+
+    def dilate(img):
+        out = cv2.dilate(img, rects[0])
+        for kernel in rects[1:]:
+            cv2.max(out, cv2.dilate(img, kernel), dst=out)
+        return out
+
+    def erode(img):
+        out = cv2.erode(img, rects[0])
+        for kernel in rects[1:]:
+            cv2.min(out, cv2.erode(img, kernel), dst=out)
+        return out
+
+    if op == cv2.MORPH_CLOSE:
+        return erode(dilate(mask))
+    if op == cv2.MORPH_OPEN:
+        return dilate(erode(mask))
+    return _exact(mask, op, ksize)
+
+def elliptical(mask, op, ksize, mode='exact', scale=4, n_rects=3):
+    # Operação morfológica com kernel elíptico usando o motor escolhido
+    ksize = _as_size(ksize)
+    if mode == 'exact' or max(ksize) < MIN_FAST_SIZE:
+        return _exact(mask, op, ksize)
+    if mode == 'downscale':
+        result = _downscale(mask, op, ksize, scale)
+    elif mode == 'rect':
+        result = _rect(mask, op, ksize, n_rects)
+    else:
+        raise ValueError(f"Modo de morfologia desconhecido: {mode}")
+
+    if _check_every:
+        key = (op, ksize, mode)
+        _calls[key] = _calls.get(key, 0) + 1
+        if (_calls[key] - 1) % _check_every == 0:
+            _iou.setdefault(key, []).append(mask_iou(result, _exact(mask, op, ksize)))
+    return result
+
+def mask_iou(a, b):
+    # Intersection over union entre duas máscaras binárias (1.0 se ambas estiverem vazias)
+    union = cv2.countNonZero(cv2.bitwise_or(a, b))
+    if union == 0:
+        return 1.0
+    return cv2.countNonZero(cv2.bitwise_and(a, b)) / union
+
+def set_iou_check(every):
+    # Comparar com o resultado exato a cada `every` chamadas de cada operação rápida
+    global _check_every
+    _check_every = every
+    _calls.clear()
+    _iou.clear()
+
+def iou_report():
+    # IoU médio e mínimo de cada operação rápida face à versão exata
+    names = {cv2.MORPH_CLOSE: 'close', cv2.MORPH_OPEN: 'open'}
+    report = {}
+    for (op, ksize, mode), values in _iou.items():
+        name = f"{names.get(op, op)} {ksize[0]}x{ksize[1]} {mode}"
+        report[name] = {'mean': float(np.mean(values)), 'min': float(np.min(values)), 'samples': len(values)}
+    return report
+
+def print_iou_report():
+    report = iou_report()
+    if not report:
+        return
+    print("IoU da morfologia rápida face à exata:")
+    for name, r in report.items():
+        print(f"  {name}: média {r['mean']:.4f}, mínimo {r['min']:.4f} ({r['samples']} amostras)")
+
+def add_morph_arguments(parser):
+    parser.add_argument('--morph', choices=MODES, default='exact', help="motor de morfologia para os kernels grandes")
+    parser.add_argument('--morph-check', type=int, default=0,
+                        help="comparar com a morfologia exata a cada N frames e mostrar o IoU no fim (0 = desligado)")
+    return parser
@@ -0,0 +1,251 @@
+import cv2
+import numpy as np
+import time
+from utils.frame_processing import LK_WIN_SIZE, LK_MAX_LEVEL
+from utils.metrics import metrics
+
+IDENTITY = np.array([[1, 0, 0], [0, 1, 0]], dtype=np.float64)
+
+# Transformação usada quando a estimação falha
+FALLBACKS = ('last', 'identity')
+
+class MotionBackend:
+    # Interface comum dos estimadores do movimento global da câmara. Cada backend implementa
+    # estimate_pair(); compensate() mede o custo por frame e aplica a transformação ao frame anterior.
+    # Quando a estimação falha usa-se a última transformação válida ou a identidade (fallback).
+    name = None
+
+    def __init__(self, fallback='last'):
+        if fallback not in FALLBACKS:
+            raise ValueError(f"fallback desconhecido: {fallback}")
+        self.fallback = fallback
+        self.last_transform = IDENTITY.copy()
+        self.compensated = 0
+        self.failures = 0
+        self.total_cost = 0.0
+        self.last_cost = 0.0
+
+    def reset(self):
+        self.last_transform = IDENTITY.copy()
+
+    def skip(self):
+        # Frame sem estimação (ex. modo tempo real)
+        pass
+
+    def _fail(self):
+        self.failures += 1
+        metrics.count('motion_fallbacks')
+        return IDENTITY.copy() if self.fallback == 'identity' else self.last_transform
+
+    def estimate_pair(self, prev_frame_bw, curr_frame_bw, prev_img=None, curr_img=None):
+        # Devolve a transformação afim 2x3 de prev para curr e, se existir, a máscara de inliers
+        raise NotImplementedError
+
+    def compensate(self, prev_frame_bw, curr_frame_bw, prev_img=None, curr_img=None):
+        # Equivalente a motion_compensation/motion_compensation_v2: devolve o frame anterior alinhado com o atual
+        start = time.perf_counter()
+        transform_matrix, mask = self.estimate_pair(prev_frame_bw, curr_frame_bw, prev_img, curr_img)
+        h, w = curr_frame_bw.shape[:2]
+        frame_transformed = cv2.warpAffine(prev_frame_bw, transform_matrix, (w, h))
+        self._count(time.perf_counter() - start)
+        return frame_transformed, mask
+
+    def transform(self, prev_frame_bw, curr_frame_bw, prev_img=None, curr_img=None):
+        # Só a estimação, sem alinhar o frame (ex. o alinhamento corre noutro processo, utils/pairwise.py)
+        start = time.perf_counter()
+        transform_matrix, mask = self.estimate_pair(prev_frame_bw, curr_frame_bw, prev_img, curr_img)
+        self._count(time.perf_counter() - start)
+        return transform_matrix, mask
+
+    def transforms(self, frames):
+        # Stream das transformações estimadas; frames é um iterável de (frame_bw, imagem para o LK)
+        prev = None
+        for frame_bw, img in frames:
+            if prev is not None:
+                transform_matrix, _ = self.transform(prev[0], frame_bw, prev[1], img)
+                yield transform_matrix
+            prev = (frame_bw, img)
+
+    def _count(self, cost):
+        self.last_cost = cost
+        self.total_cost += cost
+        self.compensated += 1
+        metrics.observe(f'motion[{self.name}]', cost)
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'frames': self.compensated,
+            'fallbacks': self.failures,
+            'mean_ms': 1000 * self.total_cost / max(1, self.compensated),
+            'last_ms': 1000 * self.last_cost,
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"Movimento da câmara ({s['backend']}): {s['mean_ms']:.1f} ms/frame, "
+              f"{s['fallbacks']} de {s['frames']} frames sem estimação válida")
+
+class MotionEstimator(MotionBackend):
+    # Estimador do movimento global da câmara (Shi-Tomasi + Lucas-Kanade + transformação afim parcial).
+    # Os pontos que sobrevivem num frame são os pontos de partida do frame seguinte;
+    # só se voltam a detetar cantos quando há poucos inliers ou estes cobrem pouco da imagem.
+    name = 'features'
+
+    def __init__(self, max_corners=1000, quality_level=0.01, min_distance=30,
+                 min_inliers=150, min_coverage=0.5, grid=(4, 4), fallback='last'):
+        super().__init__(fallback)
+        self.max_corners = max_corners
+        self.quality_level = quality_level
+        self.min_distance = min_distance
+        self.min_inliers = min_inliers
+        self.min_coverage = min_coverage
+        self.grid = grid
+
+        self.points = None  # Pontos no frame anterior, (N,1,2) float32
+        self.frames = 0
+        self.redetections = 0
+
+    def reset(self):
+        super().reset()
+        self.points = None
+
+    def skip(self):
+        # Frame sem estimação: os pontos guardados deixam de corresponder ao frame anterior
+        self.points = None
+
+    def coverage(self, points, shape):
+        # Fração das células da grelha com pelo menos um ponto
+        if len(points) == 0:
+            return 0.0
+        h, w = shape[:2]
+        rows, cols = self.grid
+        pts = points.reshape(-1, 2)
+        cx = np.clip((pts[:, 0] * cols / w).astype(int), 0, cols - 1)
+        cy = np.clip((pts[:, 1] * rows / h).astype(int), 0, rows - 1)
+        return len(np.unique(cy * cols + cx)) / (rows * cols)
+
+    def estimate(self, prev_frame_bw, prev_img=None, curr_img=None):
+        # Transformação afim 2x3 de prev para curr e máscara de inliers.
+        # prev_img/curr_img são as imagens usadas no Lucas-Kanade; por defeito os frames a preto e branco.
+        if prev_img is None:
+            prev_img = prev_frame_bw
+        if curr_img is None:
+            raise ValueError("curr_img é obrigatório")
+        self.frames += 1
+
+        # Detecção de pontos de característica usando Shi-Tomasi, apenas quando necessário
+        if self.points is None:
+            self.points = cv2.goodFeaturesToTrack(prev_frame_bw, maxCorners=self.max_corners,
+                                                  qualityLevel=self.quality_level, minDistance=self.min_distance)
+            self.redetections += 1
+            metrics.count('feature_redetections')
+        if self.points is None or len(self.points) == 0:
+            self.points = None
+            return self._fail(), None
+
+        # Cálculo do fluxo óptico usando Lucas-Kanade
+        curr_points, status, _ = cv2.calcOpticalFlowPyrLK(prev_img, curr_img, self.points, None,
+                                                          winSize=LK_WIN_SIZE, maxLevel=LK_MAX_LEVEL)
+        valid = status.ravel() == 1
+        prev_points = self.points[valid]
+        curr_points = curr_points[valid]
+
+        # Estimação da transformação
+        transform_matrix, mask = None, None
+        if len(prev_points) >= 3:
+            transform_matrix, mask = cv2.estimateAffinePartial2D(prev_points, curr_points)
+
+        if transform_matrix is None:
+            # Sem transformação válida: usar o fallback e voltar a detetar pontos no próximo frame
+            self.points = None
+            return self._fail(), None
+
+        # Os inliers (pontos do fundo) dentro da imagem seguem para o próximo frame;
+        # os outliers são normalmente objetos em movimento e são descartados
+        h, w = prev_frame_bw.shape[:2]
+        survivors = curr_points[mask.ravel() == 1].reshape(-1, 2)
+        inside = (survivors[:, 0] >= 0) & (survivors[:, 0] < w) & (survivors[:, 1] >= 0) & (survivors[:, 1] < h)
+        survivors = survivors[inside]
+
+        if len(survivors) < self.min_inliers or self.coverage(survivors, (h, w)) < self.min_coverage:
+            self.points = None
+        else:
+            self.points = survivors.reshape(-1, 1, 2).astype(np.float32)
+
+        self.last_transform = transform_matrix
+        return transform_matrix, mask
+
+    def estimate_pair(self, prev_frame_bw, curr_frame_bw, prev_img=None, curr_img=None):
+        return self.estimate(prev_frame_bw, prev_img, curr_frame_bw if curr_img is None else curr_img)
+
+class PhaseCorrelationEstimator(MotionBackend):
+    # Só translação: correlação de fase entre os frames reduzidos. Muito mais barato que os pontos
+    # de característica quando o movimento da câmara é sobretudo uma deriva (ROV a avançar).
+    name = 'phase'
+
+    def __init__(self, scale=4, min_response=0.05, fallback='last'):
+        super().__init__(fallback)
+        self.scale = scale
+        self.min_response = min_response
+        self.window = None
+
+    def estimate_pair(self, prev_frame_bw, curr_frame_bw, prev_img=None, curr_img=None):
+        h, w = prev_frame_bw.shape[:2]
+        size = (w // self.scale, h // self.scale)
+        prev_small = cv2.resize(prev_frame_bw, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+        curr_small = cv2.resize(curr_frame_bw, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+        if self.window is None or self.window.shape != prev_small.shape:
+            self.window = cv2.createHanningWindow(size, cv2.CV_32F)
+
+        (dx, dy), response = cv2.phaseCorrelate(prev_small, curr_small, self.window)
+        if not response >= self.min_response or not np.isfinite((dx, dy)).all():
+            return self._fail(), None
+        self.last_transform = np.array([[1, 0, dx * self.scale], [0, 1, dy * self.scale]], dtype=np.float64)
+        return self.last_transform, None
+
+class ECCEstimator(MotionBackend):
+    # Alinhamento por maximização da correlação (findTransformECC) num nível reduzido da pirâmide,
+    # a partir da última transformação. Não depende de cantos, por isso funciona em cenas com pouca textura.
+    name = 'ecc'
+
+    def __init__(self, level=2, motion=cv2.MOTION_EUCLIDEAN, iterations=30, eps=1e-3, fallback='last'):
+        super().__init__(fallback)
+        self.level = level
+        self.motion = motion
+        self.criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, iterations, eps)
+
+    def estimate_pair(self, prev_frame_bw, curr_frame_bw, prev_img=None, curr_img=None):
+        scale = 2 ** self.level
+        h, w = prev_frame_bw.shape[:2]
+        size = (w // scale, h // scale)
+        prev_small = cv2.resize(prev_frame_bw, size, interpolation=cv2.INTER_AREA)
+        curr_small = cv2.resize(curr_frame_bw, size, interpolation=cv2.INTER_AREA)
+
+        # O ECC devolve W tal que curr(x) = prev(W x), ou seja o inverso da transformação prev -> curr
+        warp = cv2.invertAffineTransform(self.last_transform).astype(np.float32)
+        warp[:, 2] /= scale
+        try:
+            _, warp = cv2.findTransformECC(curr_small, prev_small, warp, self.motion, self.criteria, None, 1)
+        except cv2.error:
+            # Não convergiu
+            return self._fail(), None
+        warp[:, 2] *= scale
+        self.last_transform = cv2.invertAffineTransform(warp).astype(np.float64)
+        return self.last_transform, None
+
+BACKENDS = {
+    'features': MotionEstimator,
+    'phase': PhaseCorrelationEstimator,
+    'ecc': ECCEstimator,
+}
+
+def make_estimator(backend='features', fallback='last'):
+    return BACKENDS[backend](fallback=fallback)
+
+def add_motion_arguments(parser):
+    parser.add_argument('--motion', choices=sorted(BACKENDS), default='features',
+                        help="estimador do movimento da câmara (phase = só translação, mais rápido)")
+    parser.add_argument('--motion-fallback', choices=FALLBACKS, default='last',
+                        help="transformação a usar quando a estimação falha")
+    return parser
@@ -0,0 +1,77 @@
+import cv2
+from collections import deque
+from itertools import chain
+from utils.frame_processing import Preprocessor, filtering
+from utils.metrics import metrics
+from utils.motion import MotionEstimator
+from utils.parallel import parallel_frames
+
+def pair_mask(prev_frame_bw, frame_bw, transform, morph_mode='exact'):
+    # Máscara de diferença de um par: alinhar o frame anterior com a transformação já estimada e filtrar
+    h, w = frame_bw.shape[:2]
+    return filtering(cv2.warpAffine(prev_frame_bw, transform, (w, h)), frame_bw, morph_mode)
+
+def _estimate(frames, estimator, preprocessor, color_lk, pending):
+    # Pré-processamento e estimação do movimento, por ordem e com o estimador com estado (como em process_fish).
+    # Devolve (frame a preto e branco, transformação do frame anterior para este); o frame equalizado
+    # e a transformação ficam em pending até a máscara do par chegar
+    prev = None
+    for frame in frames:
+        with metrics.stage('prep_frame'):
+            frame_bw, frame_eq = preprocessor.prep(frame, 1)
+        img = frame_eq if color_lk else frame_bw
+        transform = None
+        if prev is not None:
+            with metrics.stage('motion_compensation'):
+                transform, _ = estimator.transform(prev[0], frame_bw, prev[1], img)
+        # Cópia porque os buffers do Preprocessor são reescritos antes de a máscara chegar
+        pending.append((frame_eq.copy(), transform))
+        yield frame_bw, transform
+        prev = (frame_bw, img)
+
+def _serial_masks(estimated, morph_mode):
+    prev_frame_bw = None
+    for frame_bw, transform in estimated:
+        if prev_frame_bw is not None:
+            with metrics.stage('filtering'):
+                yield pair_mask(prev_frame_bw, frame_bw, transform, morph_mode)
+        prev_frame_bw = frame_bw
+
+def _pair_chunk(block, out, transforms, morph_mode):
+    # Corre nos processos do pool: block tem os n frames a preto e branco do chunk precedidos do anterior,
+    # transforms as n transformações de cada par e out recebe as n máscaras
+    for i, transform in enumerate(transforms):
+        out[i] = pair_mask(block[i], block[i + 1], transform, morph_mode)
+
+def pair_masks(frames, estimator=None, morph_mode='exact', color_lk=True, workers=1, chunk_size=4, preprocessor=None):
+    # Etapa por pares do pipeline dos peixes: pré-processamento, compensação de movimento e filtragem.
+    # Devolve (frame equalizado, máscara de diferença, transformação) para cada frame; o primeiro vem
+    # com máscara e transformação None.
+    # color_lk escolhe as imagens do Lucas-Kanade: frame equalizado (with_tracking) ou
+    # frame a preto e branco (without_tracking).
+    # A estimação do movimento tem estado (pontos seguidos de frame para frame, fallback 'last'), por isso
+    # corre aqui, por ordem; só o alinhamento e a filtragem de cada par, que não dependem dos outros pares,
+    # são distribuídos por `workers` processos, com a transformação do par. As máscaras são as mesmas
+    # que as de process_fish para qualquer número de processos.
+    if estimator is None:
+        estimator = MotionEstimator()
+    if preprocessor is None:
+        preprocessor = Preprocessor(ring=2)
+    pending = deque()
+    estimated = _estimate(frames, estimator, preprocessor, color_lk, pending)
+    first = next(estimated, None)
+    if first is None:
+        return
+    # O primeiro frame só serve de anterior ao segundo
+    frame_eq, _ = pending.popleft()
+    yield frame_eq, None, None
+
+    estimated = chain([first], estimated)
+    if workers == 1:
+        masks = _serial_masks(estimated, morph_mode)
+    else:
+        masks = parallel_frames(estimated, _pair_chunk, (preprocessor.height, preprocessor.width), workers, chunk_size,
+                                args=(morph_mode,), pairs=True, extras=True)
+    for mask in masks:
+        frame_eq, transform = pending.popleft()
+        yield frame_eq, mask, transform
@@ -0,0 +1,113 @@
+import cv2
+import numpy as np
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from multiprocessing import shared_memory
+
+# Estado de cada processo do pool (memória partilhada já mapeada)
+_worker = {}
+
+def _attach(in_name, out_name, in_shape, out_shape, n_slots, chunk_size, fn, args, pairs=False):
+    in_shm = shared_memory.SharedMemory(name=in_name)
+    out_shm = shared_memory.SharedMemory(name=out_name)
+    _worker['shm'] = (in_shm, out_shm)
+    _worker['in'] = np.ndarray((n_slots, chunk_size + pairs) + in_shape, dtype=np.uint8, buffer=in_shm.buf)
+    _worker['out'] = np.ndarray((n_slots, chunk_size) + out_shape, dtype=np.uint8, buffer=out_shm.buf)
+    _worker['fn'] = fn
+    _worker['args'] = args
+    _worker['pairs'] = pairs
+
+def _run_chunk(slot, n, extras=None):
+    # Processar os n frames do slot e escrever os resultados no slot de saída
+    fn, args = _worker['fn'], _worker['args']
+    if _worker['pairs']:
+        fn(_worker['in'][slot, :n + 1], _worker['out'][slot, :n], *(() if extras is None else (extras,)), *args)
+        return n
+    for i in range(n):
+        _worker['out'][slot, i] = fn(_worker['in'][slot, i], *(() if extras is None else (extras[i],)), *args)
+    return n
+
+def _collect(out_buf, item):
+    # Resultados de um chunk já entregue pelo pool; sem closure para que o finally possa largar out_buf
+    slot, n, future = item
+    future.result()
+    for i in range(n):
+        # Copiar porque o slot vai ser reutilizado
+        yield out_buf[slot, i].copy()
+
+def parallel_frames(frames, fn, out_shape, workers=None, chunk_size=4, args=(), pairs=False, extras=False):
+    # Aplica fn(frame, *args) a cada frame num pool de processos e devolve os resultados pela ordem original.
+    # Os píxeis circulam por memória partilhada (um anel de slots), por isso nenhum frame é serializado.
+    # fn tem de ser uma função de topo de módulo e não pode depender de frames anteriores.
+    # Com pairs=True cada resultado depende do par (frame anterior, frame): fn(bloco, saída, *args) recebe
+    # os n frames do chunk precedidos do último frame do chunk anterior e escreve os n resultados em saída.
+    # Nesse caso não há resultado para o primeiro frame.
+    # Com extras=True frames é um iterável de (frame, extra): os extras de cada chunk (objetos pequenos, ex. a
+    # transformação de cada par) seguem com o chunk e fn recebe-os antes de args (a lista do chunk, com pairs=True).
+    workers = workers or os.cpu_count()
+    frames = iter(frames)
+    first = next(frames, None)
+    if first is None:
+        return
+    in_shape = (first[0] if extras else first).shape
+    out_shape = tuple(out_shape)
+    if pairs:
+        first = first[0] if extras else first
+        # Posição (slot, índice) do último frame copiado para a memória partilhada
+        last = None
+    else:
+        frames = chain([first], frames)
+    # Nos pares cada slot tem mais um frame no início
+    extra = 1 if pairs else 0
+
+    # Dois slots por processo para que a leitura do próximo chunk se sobreponha ao processamento
+    n_slots = workers * 2
+    in_shm = shared_memory.SharedMemory(create=True, size=n_slots * (chunk_size + extra) * int(np.prod(in_shape)))
+    out_shm = shared_memory.SharedMemory(create=True, size=n_slots * chunk_size * int(np.prod(out_shape)))
+    in_buf = np.ndarray((n_slots, chunk_size + extra) + in_shape, dtype=np.uint8, buffer=in_shm.buf)
+    out_buf = np.ndarray((n_slots, chunk_size) + out_shape, dtype=np.uint8, buffer=out_shm.buf)
+
+    pending = deque()
+    try:
+        with ProcessPoolExecutor(workers, initializer=_attach,
+                                 initargs=(in_shm.name, out_shm.name, in_shape, out_shape,
+                                           n_slots, chunk_size, fn, args, pairs)) as pool:
+            chunk_id = 0
+            while True:
+                slot = chunk_id % n_slots
+                # O slot só fica livre depois de o chunk mais antigo ser entregue
+                if len(pending) == n_slots:
+                    yield from _collect(out_buf, pending.popleft())
+
+                # O frame anterior é copiado antes de ler o chunk, porque o gerador pode reutilizar o seu buffer;
+                # a cópia vem do slot anterior, que só é reutilizado depois de este chunk o ter lido
+                if pairs:
+                    in_buf[slot, 0] = first if last is None else in_buf[last]
+                n = 0
+                chunk_extras = [] if extras else None
+                for frame in islice(frames, chunk_size):
+                    if extras:
+                        frame, item_extra = frame
+                        chunk_extras.append(item_extra)
+                    if frame.shape != in_shape:
+                        frame = cv2.resize(frame, (in_shape[1], in_shape[0]))
+                    in_buf[slot, n + extra] = frame
+                    n += 1
+                if n == 0:
+                    break
+                last = (slot, n)
+
+                pending.append((slot, n, pool.submit(_run_chunk, slot, n, chunk_extras)))
+                chunk_id += 1
+
+            while pending:
+                yield from _collect(out_buf, pending.popleft())
+    finally:
+        # Libertar as vistas antes de fechar a memória partilhada
+        del in_buf, out_buf
+        in_shm.close()
+        in_shm.unlink()
+        out_shm.close()
+        out_shm.unlink()
@@ -0,0 +1,111 @@
+import cv2
+import queue
+import threading
+
+# Marcador de fim de stream entre estágios
+_END = object()
+
+def bounded(frames, maxsize=8):
+    # Corre o estágio anterior numa thread e liga-o ao seguinte por um buffer limitado,
+    # assim no máximo `maxsize` frames ficam em memória entre os dois estágios
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for frame in frames:
+                if not put((frame, None)):
+                    return
+        except Exception as e:  # Propagar o erro para o consumidor
+            put((_END, e))
+            return
+        put((_END, None))
+
+    worker = threading.Thread(target=produce, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                break
+            yield item
+    finally:
+        # Se o consumidor parar a meio (ex. 'q' na pré-visualização) libertar o produtor
+        stop.set()
+        worker.join()
+
+def writer_sink(frames, path, fps, fourcc='mp4v'):
+    # Escrever os frames diretamente num ficheiro de vídeo, à medida que chegam, à cadência do vídeo de entrada
+    writer = None
+    count = 0
+    for frame in frames:
+        if writer is None:
+            h, w = frame.shape[:2]
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, (w, h))
+        writer.write(frame)
+        count += 1
+    if writer is not None:
+        writer.release()
+    return count
+
+def preview_sink(frames, frame_interval=1 / 30, window='Processed'):
+    # Mostrar os frames em direto, sem esperar pelo fim do processamento
+    count = 0
+    for frame in frames:
+        cv2.imshow(window, frame)
+        count += 1
+        if cv2.waitKey(max(1, int(frame_interval * 1000))) & 0xFF == ord('q'):
+            break
+    cv2.destroyAllWindows()
+    return count
+
+def discard_sink(frames):
+    # Consumir os frames sem os guardar (útil para medir desempenho)
+    count = 0
+    for _ in frames:
+        count += 1
+    return count
+
+def memory_sink(frames, frame_interval=1 / 30, pause_first=False, window='Processed'):
+    # Comportamento original: guardar todos os frames e reproduzir no fim
+    processed_frames = list(frames)
+    input(f"\nProcessamento concluído: {len(processed_frames)} frames processados.\nPrecione enter para reproduzir o vídeo\n")
+
+    for i, frame in enumerate(processed_frames):
+        cv2.imshow(window, frame)
+        if pause_first and i == 1:
+            cv2.waitKey(0)
+        if cv2.waitKey(int(frame_interval * 1000)) & 0xFF == ord('q'):
+            break
+
+    cv2.destroyAllWindows()
+    return len(processed_frames)
+
+def add_sink_arguments(parser, frame_interval):
+    parser.add_argument('--sink', choices=['memory', 'preview', 'writer', 'discard'], default='memory',
+                        help="destino dos frames processados (memory guarda tudo e reproduz no fim)")
+    parser.add_argument('--output', default='output.mp4', help="ficheiro de saída para --sink writer")
+    parser.add_argument('--buffer', type=int, default=8, help="tamanho do buffer entre estágios")
+    parser.add_argument('--interval', type=float, default=frame_interval, help="intervalo entre frames na reprodução (s)")
+    return parser
+
+def run_sink(frames, args, fps, pause_first=False):
+    # Encaminhar o stream de frames para o destino escolhido; fps é a cadência do vídeo de entrada
+    if args.sink == 'writer':
+        return writer_sink(frames, args.output, fps)
+    if args.sink == 'preview':
+        return preview_sink(frames, args.interval)
+    if args.sink == 'discard':
+        return discard_sink(frames)
+    return memory_sink(frames, args.interval, pause_first)
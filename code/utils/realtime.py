@@ -0,0 +1,95 @@
+import time
+from utils.metrics import metrics
+
+# Ações possíveis para cada frame
+DETECT = 'detect'  # Compensação de movimento + filtragem + contornos + tracking
+TRACK = 'track'    # Só o Lucas-Kanade do tracking leva as posições para a frente
+DROP = 'drop'      # Frame descartado (chegou tarde demais)
+
+class RealtimeScheduler:
+    # Escalonador com orçamento de latência para fontes em direto. Mede o custo de cada tipo
+    # de frame e a latência (tempo desde a chegada do frame) e, quando o orçamento é excedido,
+    # passa a correr a deteção completa só de N em N frames; nos restantes o tracking mantém as
+    # posições. Frames que já chegam atrasados além do orçamento são descartados.
+
+    def __init__(self, budget=0.2, max_detect_every=15, alpha=0.2):
+        self.budget = budget
+        self.max_detect_every = max_detect_every
+        self.alpha = alpha
+
+        self.detect_every = 1
+        self.since_detection = 0
+        self.cost = {DETECT: 0.0, TRACK: 0.0}
+        self.arrival = None
+        self.started = None
+        self.action = None
+
+    def paced(self, frames, fps=None):
+        # Marca a hora de chegada de cada frame. Com fps (ficheiro de vídeo) simula uma fonte em direto:
+        # o frame i só fica disponível no instante i/fps; sem fps usa a hora a que o frame foi lido.
+        for i, frame in enumerate(frames):
+            now = time.perf_counter()
+            if fps:
+                if self.started is None:
+                    self.started = now
+                due = self.started + i / fps
+                if due > now:
+                    time.sleep(due - now)
+                self.arrival = due
+            else:
+                self.arrival = now
+            yield frame
+
+    def lag(self):
+        return time.perf_counter() - self.arrival if self.arrival is not None else 0.0
+
+    def plan(self):
+        # Escolher o que fazer com o frame que acabou de chegar
+        lag = self.lag()
+        metrics.gauge('lag_ms', 1000 * lag)
+        if lag > self.budget:
+            self.action = DROP
+            metrics.count('frames_dropped')
+            return DROP
+
+        self.since_detection += 1
+        due = self.since_detection >= self.detect_every
+        fits = lag + self.cost[DETECT] <= self.budget
+        # A deteção é forçada ao fim de max_detect_every frames para não perder os objetos novos
+        if (due and fits) or self.since_detection >= self.max_detect_every:
+            self.action = DETECT
+        else:
+            self.action = TRACK
+        return self.action
+
+    def gap(self):
+        # Número de frames desde a última deteção (inclui o atual)
+        return max(1, self.since_detection)
+
+    def done(self, elapsed):
+        # Atualizar o custo médio e adaptar o intervalo de deteção à latência observada
+        action = self.action
+        if self.cost[action]:
+            self.cost[action] += self.alpha * (elapsed - self.cost[action])
+        else:
+            self.cost[action] = elapsed
+        if action == DETECT:
+            self.since_detection = 0
+            metrics.count('frames_detected')
+        else:
+            metrics.count('frames_tracked_only')
+
+        lag = self.lag()
+        if lag > 0.75 * self.budget:
+            self.detect_every = min(self.max_detect_every, self.detect_every * 2)
+        elif lag < 0.25 * self.budget and self.detect_every > 1:
+            self.detect_every -= 1
+        metrics.gauge('detection_interval', self.detect_every)
+        metrics.gauge('lag_ms', 1000 * lag)
+
+    def stats(self):
+        return {
+            'detect_every': self.detect_every,
+            'detect_ms': 1000 * self.cost[DETECT],
+            'track_ms': 1000 * self.cost[TRACK],
+        }
@@ -0,0 +1,150 @@
+import json
+import os
+import numpy as np
+
+# Resultados estruturados dos pipelines, em vez de frames anotados.
+# Cada tabela é um ficheiro binário (<tabela>.bin) com registos de tamanho fixo, escrito por
+# acréscimo à medida que os frames são processados e lido com np.memmap sem copiar para memória.
+# O schema.json guarda o dtype de cada tabela e os parâmetros do pipeline.
+
+TABLES = {
+    # Contornos detetados no frame (um por linha)
+    'detections': np.dtype([('frame', '<i4'), ('id', '<i8'), ('cx', '<f4'), ('cy', '<f4'), ('area', '<f4'),
+                            ('x', '<i4'), ('y', '<i4'), ('w', '<i4'), ('h', '<i4'), ('frames_visible', '<i4')]),
+    # Posição dos objetos seguidos pelo optical flow
+    'tracks': np.dtype([('frame', '<i4'), ('id', '<i8'), ('x', '<f4'), ('y', '<f4')]),
+    # Transformação afim estimada do frame anterior para o atual
+    'transforms': np.dtype([('frame', '<i4'), ('matrix', '<f4', (2, 3))]),
+    # Resumo de cada região de algas; o polígono simplificado está em algae_points[offset:offset + n_points]
+    'algae': np.dtype([('frame', '<i4'), ('area', '<f4'), ('perimeter', '<f4'), ('cx', '<f4'), ('cy', '<f4'),
+                       ('x', '<i4'), ('y', '<i4'), ('w', '<i4'), ('h', '<i4'), ('offset', '<i8'), ('n_points', '<i4')]),
+    'algae_points': np.dtype([('x', '<i2'), ('y', '<i2')]),
+}
+
+SCHEMA_FILE = 'schema.json'
+
+def _table_path(path, name):
+    return os.path.join(path, f"{name}.bin")
+
+def _rows(path, name):
+    size = os.path.getsize(_table_path(path, name)) if os.path.exists(_table_path(path, name)) else 0
+    return size // TABLES[name].itemsize
+
+class RecordWriter:
+    # Escrita em streaming: as linhas ficam em memória e são acrescentadas aos ficheiros a cada
+    # flush_every frames (e no close). Com append=True continua uma escrita anterior.
+
+    def __init__(self, path, meta=None, start_frame=0, append=False, flush_every=100):
+        self.path = path
+        self.frame = start_frame  # Índice do frame a que pertencem as linhas adicionadas
+        self.flush_every = flush_every
+        os.makedirs(path, exist_ok=True)
+
+        if not append:
+            for name in TABLES:
+                if os.path.exists(_table_path(path, name)):
+                    os.remove(_table_path(path, name))
+        schema = {'tables': {name: dtype.descr for name, dtype in TABLES.items()}, 'meta': meta or {}}
+        with open(os.path.join(path, SCHEMA_FILE), 'w') as f:
+            json.dump(schema, f, indent=4)
+
+        self.rows = {name: [] for name in TABLES}
+        self.points_offset = _rows(path, 'algae_points')
+        self.pending = 0
+
+    def truncate(self, frame):
+        # Descartar as linhas a partir de `frame` (escritas depois do último checkpoint)
+        self.flush()
+        tables = load_records(self.path, mmap=False)
+        for name, table in tables.items():
+            if name == 'algae_points':
+                continue
+            keep = int(np.searchsorted(table['frame'], frame))
+            if keep < len(table):
+                with open(_table_path(self.path, name), 'r+b') as f:
+                    f.truncate(keep * TABLES[name].itemsize)
+        algae = tables['algae']
+        keep = int(np.searchsorted(algae['frame'], frame))
+        if keep < len(algae):
+            self.points_offset = int(algae['offset'][keep])
+            with open(_table_path(self.path, 'algae_points'), 'r+b') as f:
+                f.truncate(self.points_offset * TABLES['algae_points'].itemsize)
+
+    def add_detections(self, centers):
+        # centers é a TrackTable depois de associar os contornos do frame
+        for i in range(len(centers)):
+            x, y, w, h = centers.boxes[i]
+            self.rows['detections'].append((self.frame, centers.ids[i], centers.centers[i, 0], centers.centers[i, 1],
+                                            centers.areas[i], x, y, w, h, centers.frames_visible[i]))
+
+    def add_tracks(self, tracking):
+        for contour_id, (point, active) in tracking.items():
+            if active:
+                self.rows['tracks'].append((self.frame, contour_id, point[0], point[1]))
+
+    def add_transform(self, matrix):
+        self.rows['transforms'].append((self.frame, matrix))
+
+    def add_algae(self, regions):
+        # regions: lista de (área, perímetro, (cx, cy), (x, y, w, h), polígono Nx2) de algae_regions()
+        for area, perimeter, (cx, cy), (x, y, w, h), polygon in regions:
+            self.rows['algae'].append((self.frame, area, perimeter, cx, cy, x, y, w, h, self.points_offset, len(polygon)))
+            self.rows['algae_points'].extend(map(tuple, polygon))
+            self.points_offset += len(polygon)
+
+    def end_frame(self):
+        self.frame += 1
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        for name, rows in self.rows.items():
+            if rows:
+                with open(_table_path(self.path, name), 'ab') as f:
+                    np.array(rows, dtype=TABLES[name]).tofile(f)
+                rows.clear()
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def load_meta(path):
+    with open(os.path.join(path, SCHEMA_FILE)) as f:
+        return json.load(f)['meta']
+
+def load_records(path, mmap=True):
+    # Devolve {tabela: array estruturado}; com mmap=True os arrays são np.memmap só de leitura
+    tables = {}
+    for name, dtype in TABLES.items():
+        n = _rows(path, name)
+        if n == 0:
+            tables[name] = np.zeros(0, dtype=dtype)
+        elif mmap:
+            tables[name] = np.memmap(_table_path(path, name), dtype=dtype, mode='r', shape=(n,))
+        else:
+            tables[name] = np.fromfile(_table_path(path, name), dtype=dtype, count=n)
+    return tables
+
+def frame_slices(table, n_frames=None):
+    # Índices [início, fim) das linhas de cada frame (as tabelas estão ordenadas por frame)
+    if n_frames is None:
+        n_frames = int(table['frame'][-1]) + 1 if len(table) else 0
+    bounds = np.searchsorted(table['frame'], np.arange(n_frames + 1))
+    return bounds[:-1], bounds[1:]
+
+def add_records_arguments(parser):
+    parser.add_argument('--records', help="pasta onde guardar os resultados estruturados (ver render.py)")
+    parser.add_argument('--no-render', action='store_true', help="não desenhar nada, só guardar os resultados (o sink passa a discard)")
+    return parser
+
+def writer_from_args(args, meta):
+    if args.no_render:
+        args.sink = 'discard'
+    return RecordWriter(args.records, meta) if args.records else None
@@ -0,0 +1,81 @@
+import cv2
+import numpy as np
+from utils.frame_processing import filtering, clear_borders
+from utils.morphology import elliptical
+
+def merge_boxes(boxes, width, height):
+    # Cortar as caixas (x0, y0, x1, y1) à imagem e juntar as que se sobrepõem
+    boxes = [[max(0, int(x0)), max(0, int(y0)), min(width, int(x1)), min(height, int(y1))] for x0, y0, x1, y1 in boxes]
+    boxes = [b for b in boxes if b[2] > b[0] and b[3] > b[1]]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+def coarse_rois(frame_transformed, frame, points=(), scale=4, threshold=35, pad=40, border_thickness=15):
+    # Passagem grosseira: diferença numa resolução reduzida para encontrar as zonas que mudaram,
+    # mais uma caixa à volta de cada ponto já seguido. Devolve caixas em coordenadas do frame.
+    h, w = frame.shape[:2]
+    small_size = (w // scale, h // scale)
+    diff = cv2.absdiff(cv2.resize(frame_transformed, small_size, interpolation=cv2.INTER_AREA),
+                       cv2.resize(frame, small_size, interpolation=cv2.INTER_AREA))
+    # O limiar é mais baixo que o da filtragem porque a redução faz a média dos píxeis
+    _, mask = cv2.threshold(diff, threshold, 255, cv2.THRESH_BINARY)
+    clear_borders(mask, -(-border_thickness // scale))
+
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    stats = stats[1:]
+    x0 = stats[:, cv2.CC_STAT_LEFT] * scale - pad
+    y0 = stats[:, cv2.CC_STAT_TOP] * scale - pad
+    x1 = (stats[:, cv2.CC_STAT_LEFT] + stats[:, cv2.CC_STAT_WIDTH]) * scale + pad
+    y1 = (stats[:, cv2.CC_STAT_TOP] + stats[:, cv2.CC_STAT_HEIGHT]) * scale + pad
+    boxes = np.stack((x0, y0, x1, y1), axis=1).tolist()
+
+    for px, py in points:
+        boxes.append([px - pad, py - pad, px + pad, py + pad])
+    return merge_boxes(boxes, w, h)
+
+def filtering_roi(frame_transformed, frame, rois, morph_mode='exact', threshold=70, close_size=100, max_fraction=0.5):
+    # Mesmo resultado que filtering() mas só dentro das ROIs; fora delas a máscara fica a zero.
+    # Cada ROI é processada com uma margem igual ao kernel do fecho, para que o resultado
+    # dentro da ROI seja o mesmo que no frame inteiro.
+    h, w = frame.shape[:2]
+    area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in rois)
+    if area > max_fraction * w * h:
+        # Com muito movimento não compensa dividir o frame
+        return filtering(frame_transformed, frame, morph_mode)
+
+    result = np.zeros((h, w), dtype=np.uint8)
+    margin = close_size
+    for x0, y0, x1, y1 in rois:
+        cx0, cy0 = max(0, x0 - margin), max(0, y0 - margin)
+        cx1, cy1 = min(w, x1 + margin), min(h, y1 + margin)
+
+        diff = cv2.absdiff(frame_transformed[cy0:cy1, cx0:cx1], frame[cy0:cy1, cx0:cx1])
+        _, thresh = cv2.threshold(diff, threshold, 255, cv2.THRESH_BINARY)
+        clean = elliptical(thresh, cv2.MORPH_OPEN, (7, 7))
+        clean = elliptical(clean, cv2.MORPH_CLOSE, (close_size, close_size), morph_mode)
+
+        # Juntar ao resultado só a parte central (sem a margem)
+        result[y0:y1, x0:x1] |= clean[y0 - cy0:y1 - cy0, x0 - cx0:x1 - cx0]
+
+    return clear_borders(result)
+
+def tracked_points(centers=None, tracking=None):
+    # Pontos à volta dos quais se procura sempre: contornos do frame anterior e objetos seguidos
+    points = []
+    if centers is not None:
+        points.extend(centers.centers.tolist())
+    if tracking:
+        points.extend((float(t[0][0]), float(t[0][1])) for t in tracking.values())
+    return points
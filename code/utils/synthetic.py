@@ -0,0 +1,176 @@
+import cv2
+import numpy as np
+
+# Cores em BGR
+ALGAE_COLOR = (40, 170, 60)
+FISH_COLORS = [(0, 140, 255), (200, 200, 210), (40, 40, 40), (0, 200, 230)]
+
+class SyntheticVideo:
+    # Vídeo subaquático sintético com verdade conhecida: fundo com textura, manchas de algas
+    # verdes (estáticas), peixes em movimento, deriva da câmara e ruído.
+    # Pode ser usado como gerador de frames ou no lugar de um cv2.VideoCapture (read/release).
+
+    def __init__(self, n_frames=300, width=1280, height=720, n_fish=8, n_algae=6,
+                 drift=(40, 25), drift_period=(240, 180), noise=6, seed=0,
+                 fish_speed=(8, 16), fish_length=(25, 45), fish_width=(10, 18)):
+        self.n_frames = n_frames
+        self.width = width
+        self.height = height
+        self.noise = noise
+        self.drift = np.array(drift, dtype=np.float64)
+        self.drift_period = np.array(drift_period, dtype=np.float64)
+        self.rng = np.random.default_rng(seed)
+
+        # O "mundo" é maior que o frame para a câmara se poder deslocar
+        margin = np.ceil(2 * self.drift).astype(int) + 2
+        self.world_size = (width + margin[0], height + margin[1])
+        self.background, self.world_algae = self._make_world(n_algae)
+
+        # Estado dos peixes em coordenadas do mundo. A máscara de diferença só guarda o que o peixe
+        # percorre entre dois frames, por isso abaixo de ~8 px/frame fica menor que o min_area da filtragem
+        w, h = self.world_size
+        self.fish_pos = self.rng.uniform((100, 100), (w - 100, h - 100), size=(n_fish, 2))
+        speed = self.rng.uniform(*fish_speed, size=n_fish)
+        angle = self.rng.uniform(0, 2 * np.pi, size=n_fish)
+        self.fish_vel = np.stack((speed * np.cos(angle), speed * np.sin(angle)), axis=1)
+        self.fish_axes = np.stack((self.rng.uniform(*fish_length, n_fish), self.rng.uniform(*fish_width, n_fish)), axis=1)
+        self.fish_color = [FISH_COLORS[i % len(FISH_COLORS)] for i in range(n_fish)]
+
+        self.index = 0
+        self.offsets = []    # Deslocamento da câmara em cada frame
+        self.fish_boxes = []  # Por frame: lista de (id, x, y, w, h) dos peixes visíveis
+        self._noise = np.empty((height, width), dtype=np.float32)
+        self._noise_buf = np.empty((height, width, 3), dtype=np.float32)
+
+    def _make_world(self, n_algae):
+        w, h = self.world_size
+        rng = self.rng
+
+        # Gradiente azul-esverdeado (mais escuro em baixo)
+        y = np.linspace(0, 1, h, dtype=np.float32)[:, None]
+        background = np.empty((h, w, 3), dtype=np.uint8)
+        background[..., 0] = np.broadcast_to(150 - 60 * y, (h, w))
+        background[..., 1] = np.broadcast_to(110 - 40 * y, (h, w))
+        background[..., 2] = np.broadcast_to(40 - 20 * y, (h, w))
+
+        # Textura do fundo (pedras e areia) para haver cantos para a compensação de movimento
+        for _ in range(w * h // 2500):
+            center = (int(rng.integers(0, w)), int(rng.integers(0, h)))
+            tone = int(rng.integers(-45, 45))
+            color = tuple(int(np.clip(int(c) + tone, 0, 255)) for c in background[center[1], center[0]])
+            cv2.circle(background, center, int(rng.integers(2, 12)), color, -1)
+        texture = cv2.resize(rng.normal(0, 10, (h // 8, w // 8)).astype(np.float32), (w, h))
+        background = cv2.add(background, cv2.merge([texture] * 3), dtype=cv2.CV_8U)
+        background = cv2.GaussianBlur(background, (5, 5), 0)
+
+        # Manchas de algas: grupos de elipses verdes sobrepostas
+        algae = np.zeros((h, w), dtype=np.uint8)
+        for _ in range(n_algae):
+            cx, cy = rng.uniform(0.1, 0.9) * w, rng.uniform(0.3, 0.95) * h
+            for _ in range(int(rng.integers(4, 9))):
+                center = (int(cx + rng.normal(0, 40)), int(cy + rng.normal(0, 25)))
+                axes = (int(rng.integers(20, 60)), int(rng.integers(10, 35)))
+                cv2.ellipse(algae, center, axes, float(rng.uniform(0, 180)), 0, 360, 255, -1)
+        tint = np.array(ALGAE_COLOR, dtype=np.int16) + rng.integers(-15, 15, size=(h, w, 1), dtype=np.int16)
+        background[algae > 0] = np.clip(tint[algae > 0], 0, 255).astype(np.uint8)
+        return background, algae
+
+    def camera_offset(self, i):
+        # Deriva suave da câmara (translação com sub-píxel)
+        return self.drift * (1 + np.sin(2 * np.pi * i / self.drift_period))
+
+    def _warp(self, image, offset, interpolation=cv2.INTER_LINEAR):
+        m = np.array([[1, 0, -offset[0]], [0, 1, -offset[1]]], dtype=np.float64)
+        return cv2.warpAffine(image, m, (self.width, self.height), flags=interpolation)
+
+    def transform(self, i):
+        # Transformação verdadeira do frame i-1 para o frame i (o que a compensação de movimento deve estimar)
+        d = self.camera_offset(i) - self.camera_offset(i - 1)
+        return np.array([[1, 0, -d[0]], [0, 1, -d[1]]], dtype=np.float64)
+
+    def algae_mask(self, i):
+        # Máscara verdadeira das algas no frame i
+        return self._warp(self.world_algae, self.camera_offset(i), cv2.INTER_NEAREST)
+
+    def _move_fish(self):
+        w, h = self.world_size
+        self.fish_pos += self.fish_vel
+        for k in range(2):
+            limit = (w, h)[k]
+            out = (self.fish_pos[:, k] < 50) | (self.fish_pos[:, k] > limit - 50)
+            self.fish_vel[out, k] *= -1
+            self.fish_pos[:, k] = np.clip(self.fish_pos[:, k], 50, limit - 50)
+
+    def render(self, i):
+        offset = self.camera_offset(i)
+        frame = self._warp(self.background, offset)
+
+        boxes = []
+        for fish_id, (pos, vel, axes, color) in enumerate(zip(self.fish_pos, self.fish_vel, self.fish_axes, self.fish_color)):
+            x, y = pos - offset
+            angle = int(np.degrees(np.arctan2(vel[1], vel[0])))
+            body = cv2.ellipse2Poly((int(x), int(y)), (int(axes[0]), int(axes[1])), angle, 0, 360, 10)
+            direction = vel / (np.linalg.norm(vel) + 1e-9)
+            normal = np.array((-direction[1], direction[0]))
+            base = np.array((x, y)) - direction * axes[0]
+            tail = np.array([base, base - direction * axes[1] * 1.5 + normal * axes[1],
+                             base - direction * axes[1] * 1.5 - normal * axes[1]], dtype=np.int32)
+            cv2.fillPoly(frame, [body, tail], color)
+
+            bx, by, bw, bh = cv2.boundingRect(np.vstack((body, tail)))
+            # Guardar só a parte visível da caixa
+            x0, y0 = max(bx, 0), max(by, 0)
+            x1, y1 = min(bx + bw, self.width), min(by + bh, self.height)
+            if x1 > x0 and y1 > y0:
+                boxes.append((fish_id, x0, y0, x1 - x0, y1 - y0))
+
+        if self.noise:
+            # Ruído de luminância (o mesmo valor nos três canais) tirado do gerador do vídeo, e não do
+            # RNG global do cv2, para a seed fixar o clip todo
+            self.rng.standard_normal(dtype=np.float32, out=self._noise)
+            self._noise *= self.noise
+            cv2.merge([self._noise] * 3, self._noise_buf)
+            frame = cv2.add(frame, self._noise_buf, dtype=cv2.CV_8U)
+        return frame, boxes
+
+    def read(self, image=None):
+        # Interface compatível com cv2.VideoCapture
+        if self.index >= self.n_frames:
+            return False, None
+        frame, boxes = self.render(self.index)
+        self.offsets.append(self.camera_offset(self.index))
+        self.fish_boxes.append(boxes)
+        self._move_fish()
+        self.index += 1
+        return True, frame
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.n_frames)
+        if prop == cv2.CAP_PROP_FPS:
+            return 30.0
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        return 0.0
+
+    def __iter__(self):
+        while True:
+            ret, frame = self.read()
+            if not ret:
+                break
+            yield frame
+
+    def write(self, path, fps=30):
+        # Gravar o vídeo num ficheiro (ex. para testar os scripts sem o peixe.mp4)
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (self.width, self.height))
+        for frame in self:
+            writer.write(frame)
+        writer.release()
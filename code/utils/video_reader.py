@@ -0,0 +1,119 @@
+import cv2
+import queue
+import threading
+import time
+from utils.metrics import metrics
+
+# Marcador de fim de vídeo
+_END = object()
+
+class VideoReader:
+    # Descodifica o vídeo numa thread à parte para um buffer limitado, de forma a que a
+    # descodificação (FFmpeg) se sobreponha ao processamento. Opcionalmente redimensiona
+    # logo os frames para o tamanho de processamento (o cv2 liberta o GIL nessas operações).
+
+    def __init__(self, cap, size=None, buffer=8):
+        self.cap = cap
+        self.size = size
+        self.buffer = queue.Queue(maxsize=buffer)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.error = None
+        self.finished = False  # O vídeo foi lido até ao fim
+
+        # Métricas
+        self.frames = 0
+        self.decode_time = 0.0
+        self.producer_wait = 0.0  # Tempo com o buffer cheio (o processamento é o gargalo)
+        self.stalls = 0           # Vezes que o consumidor encontrou o buffer vazio
+        self.stall_time = 0.0     # Tempo total que o consumidor esperou pela descodificação
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        return self
+
+    def _put(self, item):
+        start = time.perf_counter()
+        while not self.stop_event.is_set():
+            try:
+                self.buffer.put(item, timeout=0.1)
+                self.producer_wait += time.perf_counter() - start
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        try:
+            while not self.stop_event.is_set():
+                start = time.perf_counter()
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                if self.size is not None and (frame.shape[1], frame.shape[0]) != tuple(self.size):
+                    frame = cv2.resize(frame, tuple(self.size))
+                elapsed = time.perf_counter() - start
+                self.decode_time += elapsed
+                metrics.observe('decode', elapsed)
+                self.frames += 1
+                if not self._put(frame):
+                    return
+        except Exception as e:  # Propagar o erro para o consumidor
+            self.error = e
+        self._put(_END)
+
+    def __iter__(self):
+        self.start()
+        try:
+            while True:
+                try:
+                    item = self.buffer.get_nowait()
+                except queue.Empty:
+                    self.stalls += 1
+                    start = time.perf_counter()
+                    item = self.buffer.get()
+                    elapsed = time.perf_counter() - start
+                    self.stall_time += elapsed
+                    metrics.observe('decode_stall', elapsed)
+                if item is _END:
+                    if self.error is not None:
+                        raise self.error
+                    self.finished = True
+                    break
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        # Parar a thread (mesmo a meio do vídeo) e libertar o VideoCapture
+        self.stop_event.set()
+        if self.thread is not None:
+            while self.thread.is_alive():
+                try:
+                    self.buffer.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.thread.join()
+        self.cap.release()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'decode_ms_per_frame': 1000 * self.decode_time / max(1, self.frames),
+            'producer_wait_s': self.producer_wait,
+            'stalls': self.stalls,
+            'stall_s': self.stall_time,
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"Descodificação: {s['frames']} frames, {s['decode_ms_per_frame']:.1f} ms/frame, "
+              f"{s['stalls']} esperas pelo descodificador ({s['stall_s']:.2f} s)")
@@ -1,75 +1,79 @@
 import cv2
 import numpy as np
 from utils.frame_processing import *
+from utils.association import TrackTable, pairwise_distances
+from utils.blobs import Blobs
+from utils.motion import MotionEstimator, add_motion_arguments, make_estimator
+from utils.morphology import add_morph_arguments, set_iou_check, print_iou_report
+from utils.metrics import metrics, add_metrics_arguments, configure_from_args
+from utils.records import add_records_arguments, writer_from_args
+from utils.realtime import RealtimeScheduler, DETECT, DROP
+from utils.roi import coarse_rois, filtering_roi, tracked_points
+from utils.pairwise import pair_masks
+from utils.frame_cache import CacheSession, add_cache_arguments, cache_from_args
+import os
+import time
+from utils.pipeline import bounded, add_sink_arguments, run_sink
+from utils.video_reader import VideoReader
+import argparse
 
 def find_contours(frame, filtered, centers, max_dist, next_id, frames_confirm, tracking):
 
-    # Encontrar contornos na máscara sem as áreas conectadas às bordas
-    contours, _ = cv2.findContours(filtered, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
     # Critérios para filtragem
     min_area = 250  # Tamanho mínimo do contorno
 
-    current_centers = {}
-
-    # Filtrar contornos
-    for contour in contours:
-        if cv2.contourArea(contour) >= min_area:
-
-            # Calcular o centroide
-            M = cv2.moments(contour)
-            if M['m00'] > 0:  # Evitar divisão por zero
-                cX = int(M['m10'] / M['m00'])
-                cY = int(M['m01'] / M['m00'])
-                center = (cX, cY)
-
-                # Verificar se o contorno já estava sendo rastreado
-                matched_id = None
-                for contour_id, data in centers.items():
-                    prev_center = data['center']
-                    if euclidean_distance(center, prev_center) <= max_dist:
-                        matched_id = contour_id
-                        break
-
-                if matched_id is not None:
-                    # Atualizar o contorno existente
-                    centers[matched_id]['center'] = center
-                    centers[matched_id]['frames_visible'] += 1
-                    current_centers[matched_id] = centers[matched_id]
-                else:
-                    # Criar um novo contorno
-                    current_centers[next_id] = {'center': center, 'frames_visible': 1}
-                    next_id += 1
-                    
-    centers = current_centers
-
-    # Mostrar os centros detectados
-    for contour_id in centers.keys():
-        if centers[contour_id]['frames_visible'] >= frames_confirm and contour_id not in tracking:
-            if not any(euclidean_distance(centers[contour_id]['center'], center[0]) <= max_dist for center in tracking.values()):
-                tracking[contour_id] = (centers[contour_id]['center'], False)
+    # Componentes ligadas da máscara numa só passagem: áreas, caixas e centroides em arrays
+    blobs = Blobs(filtered, min_area)
+    current_centers = blobs.centroids.astype(np.int32)
+
+    # Associar todos os centros aos contornos anteriores de uma só vez
+    next_id, _ = centers.update(current_centers, max_dist, next_id, blobs.areas, blobs.boxes)
+
+    # Passar ao tracking os contornos confirmados que ainda não estão a ser seguidos
+    confirmed = np.flatnonzero(centers.frames_visible >= frames_confirm)
+    confirmed = [i for i in confirmed if int(centers.ids[i]) not in tracking]
+    if confirmed:
+        tracked_points = np.array([t[0] for t in tracking.values()], dtype=np.float32).reshape(-1, 2)
+        near_tracked = (pairwise_distances(centers.centers[confirmed], tracked_points) <= max_dist).any(axis=1)
+        added = []
+        for i, near in zip(confirmed, near_tracked):
+            center = centers.centers[i]
+            # Também não pode estar perto de um contorno acabado de adicionar neste frame
+            if near or (added and (pairwise_distances(center, added) <= max_dist).any()):
+                continue
+            tracking[int(centers.ids[i])] = ((int(center[0]), int(center[1])), False)
+            added.append(center)
          
     return frame, centers, next_id, tracking
 
 def track(prev_frame, frame, original_frame, tracking: dict):
+    # prev_frame e frame são os frames equalizados
+    # (com original_frame=None as posições são atualizadas sem desenhar)
 
     ids_to_remove = []  # Lista para armazenar IDs que perderam o tracking
 
-    for contour_id, t in tracking.items():
-        if t[1] == True:
-            prev_point = np.array([[t[0]]], dtype=np.float32)
-            # Calcular o novo ponto com Optical Flow
-            new_point,status, _ = cv2.calcOpticalFlowPyrLK(prev_frame, frame, prev_point, None)
-        
-            if status[0] == 1:  # Se o tracking foi bem-sucedido
-                new_x, new_y = new_point[0][0]
+    # Calcular o novo ponto de todos os IDs ativos com uma única chamada ao Optical Flow
+    active = [contour_id for contour_id, t in tracking.items() if t[1] == True]
+    if active:
+        prev_points = np.array([[tracking[contour_id][0]] for contour_id in active], dtype=np.float32)
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(prev_frame, frame, prev_points, None,
+                                                         winSize=LK_WIN_SIZE, maxLevel=LK_MAX_LEVEL)
+
+        for contour_id, new_point, ok in zip(active, new_points[:, 0], status[:, 0]):
+            if ok == 1:  # Se o tracking foi bem-sucedido
+                new_x, new_y = new_point
                 tracking[contour_id] = ((new_x, new_y), True)
+                if original_frame is None:
+                    continue
                 cv2.circle(original_frame, (int(new_x), int(new_y)), 5, (0, 0, 255), -1)
                 cv2.putText(original_frame, f"Tracking ID {contour_id}", (int(new_x), int(new_y) - 10),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
             else:  # Caso o tracking seja perdido
                 ids_to_remove.append(contour_id)
-        else:
+
+    # Os IDs acabados de confirmar passam a ser seguidos a partir do próximo frame
+    for contour_id, t in tracking.items():
+        if t[1] == False:
             tracking[contour_id] = (t[0], True)
 
     # Remover os IDs que perderam o tracking
@@ -78,59 +82,260 @@ def track(prev_frame, frame, original_frame, tracking: dict):
         
     return original_frame, tracking
 
-if __name__ == '__main__':
-    # Carregar o vídeo
-    cap = cv2.VideoCapture('peixe.MP4')
+def process_fish(frames, max_dist=50, frames_confirm=3, estimator=None, morph_mode='exact', scheduler=None, roi=False, state=None, records=None, render=True,
+                 workers=None, chunk_size=4, preprocessor=None):
+    # Processar os frames um a um e devolver cada frame anotado.
+    # Com um RealtimeScheduler a deteção pode ser saltada (só o tracking corre) ou o frame descartado
+    # (nesse caso é devolvido outra vez o último frame anotado, para as saídas manterem o ritmo da fonte).
+    # Com roi=True a filtragem só corre à volta das zonas com movimento e dos objetos já seguidos.
+    # state (opcional) é um dicionário com 'centers', 'next_id' e 'tracking': serve de estado inicial
+    # e é atualizado antes de cada frame ser devolvido (usado pelos checkpoints do batch.py).
+    # Com records (um RecordWriter) os contornos, os objetos seguidos e a transformação de cada frame
+    # são guardados; com render=False nada é desenhado e é devolvido o índice do frame.
+    # Com workers a compensação de movimento e a filtragem correm por pares em paralelo (process_fish_pairs).
+    # preprocessor substitui o Preprocessor (ex. frames vindos da cache, utils/frame_cache.py).
+    if workers is not None:
+        yield from process_fish_pairs(frames, max_dist, frames_confirm, morph_mode, state, records, render, workers, chunk_size,
+                                      estimator, preprocessor)
+        return
 
-    # Inicialização de variáveis
-    ret, prev_frame = cap.read()
-    
-    prev_frame_bw, prev_frame = prep_frame(prev_frame, 1)
+    frames = iter(frames)
+    prev_frame = next(frames, None)
+    if prev_frame is None:
+        return
+    # Os buffers do pré-processamento são reutilizados (o frame atual e o anterior)
+    if preprocessor is None:
+        preprocessor = Preprocessor(ring=2)
+    prev_frame_bw, prev_frame = preprocessor.prep(prev_frame, 1)
+    # Último frame devolvido: é repetido nos frames descartados para as saídas manterem o ritmo da fonte
+    last_output = prev_frame.copy() if render else None
+    index = 0
+    if records is not None:
+        records.end_frame()
 
-    max_dist = 50  # Distância máxima para considerar o mesmo contorno
-    centers = {}
-    next_id = 0
-    frames_confirm = 3
-    tracking = {} # id, point
-    processed_frames = []
+    if state is None:
+        state = {}
+    centers = state.get('centers') or TrackTable()
+    next_id = state.get('next_id', 0)
+    tracking = state.get('tracking', {}) # id, point
 
-    print("Processando vídeo")
+    # Os pontos de característica são reaproveitados de frame para frame
+    if estimator is None:
+        estimator = MotionEstimator()
 
-    #Processar todos os frames e armazenar
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        frame_bw, original_frame = prep_frame(frame, 1)
-        frame = original_frame.copy()
+    for frame in frames:
+        index += 1
+        action = scheduler.plan() if scheduler is not None else DETECT
+        if action == DROP:
+            if records is not None:
+                records.end_frame()
+            yield last_output if render else index
+            continue
+        start = time.perf_counter()
 
-        frame_transformed, _ = motion_compensation_v2(prev_frame_bw, frame_bw, prev_frame, frame)
+        with metrics.stage('prep_frame'):
+            frame_bw, frame = preprocessor.prep(frame, 1)
+            # Cópia onde são desenhadas as anotações; segue para o resto do pipeline
+            original_frame = frame.copy() if render else None
 
-        filtered = filtering(frame_transformed, frame_bw)
-        
-        original_frame, centers, next_id, tracking = find_contours(original_frame, filtered, centers, max_dist, next_id, frames_confirm, tracking)
+        if action == DETECT:
+            # Entre deteções espaçadas os objetos deslocam-se mais, por isso a distância aumenta com o intervalo
+            gap = scheduler.gap() if scheduler is not None else 1
 
-        original_frame, tracking = track(prev_frame, frame, original_frame, tracking)
-        
-        processed_frames.append(original_frame)
+            with metrics.stage('motion_compensation'):
+                frame_transformed, _ = estimator.compensate(prev_frame_bw, frame_bw, prev_frame, frame)
+            if records is not None:
+                records.add_transform(estimator.last_transform)
 
+            with metrics.stage('filtering'):
+                if roi:
+                    rois = coarse_rois(frame_transformed, frame_bw, tracked_points(centers, tracking))
+                    filtered = filtering_roi(frame_transformed, frame_bw, rois, morph_mode)
+                else:
+                    filtered = filtering(frame_transformed, frame_bw, morph_mode)
+            
+            with metrics.stage('find_contours'):
+                original_frame, centers, next_id, tracking = find_contours(original_frame, filtered, centers, max_dist * gap, next_id, frames_confirm, tracking)
+            if records is not None:
+                records.add_detections(centers)
+        else:
+            estimator.skip()
+
+        with metrics.stage('track'):
+            original_frame, tracking = track(prev_frame, frame, original_frame, tracking)
+        if records is not None:
+            records.add_tracks(tracking)
+            records.end_frame()
+        
         prev_frame = frame
         prev_frame_bw = frame_bw
 
-        
-    cap.release()
-    input(f"\nProcessamento concluído: {len(processed_frames)} frames processados.\nPrecione enter tecla para reproduzir o vídeo\n")
-    
-    #Reproduzir os frames processados
-    frame_interval = 1 / 10
-
-    for i,frame in enumerate(processed_frames):
-        cv2.imshow('Processed', frame)
-        
-        # Aguardar o tempo necessário para manter 30 FPS
-        if cv2.waitKey(int(frame_interval * 1000)) & 0xFF == ord('q'):
-            break
+        if scheduler is not None:
+            scheduler.done(time.perf_counter() - start)
+        metrics.gauge('contours', len(centers))
+        metrics.frame(tracked=len(tracking))
+        state.update(centers=centers, next_id=next_id, tracking=tracking)
+        last_output = original_frame
+        yield original_frame if render else index
+
+class FishStage:
+    # Estágio dos peixes (com tracking) para o motor com uma só descodificação (utils/engine.py):
+    # as mesmas etapas que process_fish, sobre os frames a preto e branco e equalizado partilhados.
+    # state tem o mesmo formato que em process_fish.
+    name = 'fish'
+
+    def __init__(self, max_dist=50, frames_confirm=3, estimator=None, morph_mode='exact', state=None, records=None):
+        self.max_dist = max_dist
+        self.frames_confirm = frames_confirm
+        self.estimator = estimator if estimator is not None else MotionEstimator()
+        self.morph_mode = morph_mode
+        self.records = records
+        self.state = state if state is not None else {}
+        self.state['centers'] = self.state.get('centers') or TrackTable()
+        self.state.setdefault('next_id', 0)
+        self.state.setdefault('tracking', {})
+
+    def process(self, shared, prev, canvas):
+        records = self.records
+        if prev is None:
+            # Primeiro frame: só serve de anterior ao segundo
+            return
+        centers, next_id, tracking = self.state['centers'], self.state['next_id'], self.state['tracking']
+
+        with metrics.stage('motion_compensation'):
+            frame_transformed, _ = self.estimator.compensate(prev.bw, shared.bw, prev.eq, shared.eq)
+        if records is not None:
+            records.add_transform(self.estimator.last_transform)
+        with metrics.stage('filtering'):
+            filtered = filtering(frame_transformed, shared.bw, self.morph_mode)
+        with metrics.stage('find_contours'):
+            canvas, centers, next_id, tracking = find_contours(canvas, filtered, centers, self.max_dist, next_id, self.frames_confirm, tracking)
+        if records is not None:
+            records.add_detections(centers)
+        with metrics.stage('track'):
+            canvas, tracking = track(prev.eq, shared.eq, canvas, tracking)
+        if records is not None:
+            records.add_tracks(tracking)
+
+        metrics.gauge('contours', len(centers))
+        metrics.gauge('tracked_objects', len(tracking))
+        self.state.update(centers=centers, next_id=next_id, tracking=tracking)
+
+def process_fish_pairs(frames, max_dist=50, frames_confirm=3, morph_mode='exact', state=None, records=None, render=True,
+                       workers=1, chunk_size=4, estimator=None, preprocessor=None):
+    # Variante de process_fish em dois estágios: as máscaras de diferença de cada par de frames são
+    # calculadas por pair_masks (o alinhamento e a filtragem em `workers` processos) e aqui só correm, por ordem,
+    # as etapas com estado (associação dos contornos e tracking). O resultado é o mesmo que o de process_fish.
+    if state is None:
+        state = {}
+    centers = state.get('centers') or TrackTable()
+    next_id = state.get('next_id', 0)
+    tracking = state.get('tracking', {}) # id, point
+    prev_frame = None
+
+    for index, (frame, filtered, transform) in enumerate(pair_masks(frames, estimator, morph_mode, True, workers, chunk_size,
+                                                                    preprocessor)):
+        if filtered is None:
+            # Primeiro frame: só serve de anterior ao segundo
+            prev_frame = frame
+            if records is not None:
+                records.end_frame()
+            continue
+
+        if records is not None:
+            records.add_transform(transform)
+        original_frame = frame.copy() if render else None
+        with metrics.stage('find_contours'):
+            original_frame, centers, next_id, tracking = find_contours(original_frame, filtered, centers, max_dist, next_id, frames_confirm, tracking)
+        if records is not None:
+            records.add_detections(centers)
+
+        with metrics.stage('track'):
+            original_frame, tracking = track(prev_frame, frame, original_frame, tracking)
+        if records is not None:
+            records.add_tracks(tracking)
+            records.end_frame()
+        prev_frame = frame
 
-    cv2.destroyAllWindows()
+        metrics.gauge('contours', len(centers))
+        metrics.frame(tracked=len(tracking))
+        state.update(centers=centers, next_id=next_id, tracking=tracking)
+        yield original_frame if render else index
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Deteção de peixes com tracking")
+    add_sink_arguments(parser, 1 / 10)
+    add_morph_arguments(parser)
+    add_metrics_arguments(parser)
+    add_records_arguments(parser)
+    add_cache_arguments(parser)
+    add_motion_arguments(parser)
+    add_equalize_arguments(parser)
+    parser.add_argument('--roi', action='store_true', help="filtragem só à volta das zonas com movimento e dos peixes seguidos")
+    parser.add_argument('--workers', type=int, help="calcular as máscaras por pares de frames em N processos (0 = todos os cores)")
+    parser.add_argument('--chunk', type=int, default=4, help="frames enviados a cada processo de uma vez (com --workers)")
+    parser.add_argument('--realtime', action='store_true', help="modo em tempo real: respeitar o ritmo da fonte e o orçamento de latência")
+    parser.add_argument('--budget', type=float, default=200, help="latência máxima em modo tempo real (ms)")
+    parser.add_argument('--fps', type=float, default=0, help="ritmo da fonte em modo tempo real (0 = ler do vídeo)")
+    args = parser.parse_args()
+    if args.workers is not None and (args.roi or args.realtime):
+        parser.error("--workers não pode ser usado com --roi nem com --realtime")
+    if args.cache and (args.workers is not None or args.realtime):
+        parser.error("--cache não pode ser usado com --workers nem com --realtime")
+    if args.morph_check and args.workers not in (None, 1):
+        parser.error("--morph-check não pode ser usado com --workers em vários processos")
+    configure_from_args(args, 'with_tracking')
+
+    # Carregar o vídeo
+    cap = cv2.VideoCapture('peixe.MP4')
+
+    max_dist = 50  # Distância máxima para considerar o mesmo contorno
+    frames_confirm = 3
+
+    set_iou_check(args.morph_check)
+
+    print("Processando vídeo")
 
+    # Os frames passam pelo pipeline um a um, com buffers limitados entre estágios
+    # A descodificação corre numa thread à parte e já entrega os frames no tamanho de processamento
+    frames = VideoReader(cap, (1280, 720), args.buffer)
+    records = writer_from_args(args, {'pipeline': 'with_tracking', 'video': 'peixe.MP4', 'width': 1280, 'height': 720, 'frames_confirm': frames_confirm})
+    scheduler = None
+    source = frames
+    estimator = make_estimator(args.motion, args.motion_fallback)
+    equalize = equalize_from_args(args)
+    # Com a cache os frames já pré-processados (e as transformações) são lidos do disco em vez do vídeo
+    cache = cache_from_args(args)
+    session = CacheSession(cache, 'peixe.MP4', frames, 'with_tracking', estimator, equalize) if cache is not None else None
+    if session is not None:
+        source = session.source
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    if args.realtime:
+        # Os frames ficam disponíveis ao ritmo da fonte e são mostrados assim que ficam prontos
+        scheduler = RealtimeScheduler(args.budget / 1000)
+        source = scheduler.paced(frames, args.fps or fps)
+        args.interval = 0.001
+    processed = bounded(process_fish(source, max_dist, frames_confirm, morph_mode=args.morph, scheduler=scheduler, roi=args.roi,
+                                     records=records, render=not args.no_render,
+                                     workers=None if args.workers is None else args.workers or os.cpu_count(),
+                                     chunk_size=args.chunk,
+                                     estimator=session.estimator if session is not None else estimator,
+                                     preprocessor=session.preprocessor if session is not None else Preprocessor(equalize=equalize)), args.buffer)
+    run_sink(processed, args, fps)
+    if records is not None:
+        records.close()
+    if session is not None:
+        # Parar o pipeline antes de fechar a cache (o sink pode ter terminado a meio, ex. 'q' na pré-visualização)
+        processed.close()
+        session.finish()
+    if session is not None and session.hit:
+        print("Frames lidos da cache")
+    else:
+        frames.print_stats()
+    if scheduler is not None:
+        s = scheduler.stats()
+        print(f"Tempo real: deteção a cada {s['detect_every']} frames, {s['detect_ms']:.1f} ms por deteção, {s['track_ms']:.1f} ms só com tracking")
+    if estimator.compensated:
+        estimator.print_stats()
+    print_iou_report()
+    metrics.export()
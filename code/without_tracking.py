@@ -1,56 +1,193 @@
 import cv2
 import numpy as np
 from utils.frame_processing import *
+from utils.association import TrackTable
+from utils.blobs import Blobs
+from utils.motion import MotionEstimator, add_motion_arguments, make_estimator
+from utils.morphology import add_morph_arguments, set_iou_check, print_iou_report
+from utils.metrics import metrics, add_metrics_arguments, configure_from_args
+from utils.records import add_records_arguments, writer_from_args
+from utils.roi import coarse_rois, filtering_roi, tracked_points
+from utils.pairwise import pair_masks
+from utils.frame_cache import CacheSession, add_cache_arguments, cache_from_args
 import os
+import argparse
+from utils.pipeline import bounded, add_sink_arguments, run_sink
+from utils.video_reader import VideoReader
 os.environ['OPENCV_FFMPEG_READ_ATTEMPTS'] = '8192' 
 
 def find_contours(frame, filtered, centers, max_dist, next_id, frames_confirm):
-    # Encontrar contornos na máscara sem as áreas conectadas às bordas
-    contours, _ = cv2.findContours(filtered, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     # Critérios para filtragem
     min_area = 250  # Tamanho mínimo do contorno
 
-    current_centers = {}
-
-    # Filtrar contornos
-    for contour in contours:
-        if cv2.contourArea(contour) >= min_area:
-
-            # Calcular o centroide
-            M = cv2.moments(contour)
-            if M['m00'] > 0:  # Evitar divisão por zero
-                cX = int(M['m10'] / M['m00'])
-                cY = int(M['m01'] / M['m00'])
-                center = (cX, cY)
-
-                # Verificar se o contorno já estava sendo rastreado
-                matched_id = None
-                for contour_id, data in centers.items():
-                    prev_center = data['center']
-                    if euclidean_distance(center, prev_center) <= max_dist:
-                        matched_id = contour_id
-                        break
-
-                if matched_id is not None:
-                    # Atualizar o contorno existente
-                    centers[matched_id]['center'] = center
-                    centers[matched_id]['frames_visible'] += 1
-                    current_centers[matched_id] = centers[matched_id]
-
-                     # Pintar o contorno correspondente na imagem
-                    if centers[matched_id]['frames_visible'] >= frames_confirm:
-                        cv2.drawContours(frame, [contour], -1, (0, 0,255), thickness=cv2.FILLED)
-                        cv2.circle(frame, center, 5, (0, 255, 0), -1)  # Green centroid
-                else:
-                    # Criar um novo contorno
-                    current_centers[next_id] = {'center': center, 'frames_visible': 1}
-                    next_id += 1
-
-    centers = current_centers
+    # Componentes ligadas da máscara numa só passagem: áreas, caixas e centroides em arrays
+    blobs = Blobs(filtered, min_area)
+    current_centers = blobs.centroids.astype(np.int32)
+
+    # Associar todos os centros aos contornos anteriores de uma só vez
+    next_id, matched = centers.update(current_centers, max_dist, next_id, blobs.areas, blobs.boxes)
+    if frame is None:
+        return frame, centers, next_id
+
+    # Pintar os contornos que já foram vistos em frames suficientes (só estes são traçados)
+    drawn = np.flatnonzero(matched & (centers.frames_visible >= frames_confirm))
+    cv2.drawContours(frame, blobs.contours(drawn), -1, (0, 0,255), thickness=cv2.FILLED)
+    for i in drawn:
+        cv2.circle(frame, tuple(int(v) for v in centers.centers[i]), 5, (0, 255, 0), -1)  # Green centroid
 
     return frame, centers, next_id
 
+def process_fish(frames, max_dist=100, frames_confirm=3, estimator=None, morph_mode='exact', roi=False, state=None, records=None, render=True,
+                 workers=None, chunk_size=4, preprocessor=None):
+    # Processar os frames um a um e devolver cada frame anotado
+    # (com roi=True a filtragem só corre à volta das zonas com movimento e dos contornos anteriores).
+    # state (opcional) é um dicionário com 'centers' e 'next_id', atualizado a cada frame.
+    # Com records (um RecordWriter) os contornos e a transformação de cada frame são guardados;
+    # com render=False nada é desenhado e é devolvido o índice do frame.
+    # Com workers a compensação de movimento e a filtragem correm por pares em paralelo (process_fish_pairs).
+    # preprocessor substitui o Preprocessor (ex. frames vindos da cache, utils/frame_cache.py).
+    if workers is not None:
+        yield from process_fish_pairs(frames, max_dist, frames_confirm, morph_mode, state, records, render, workers, chunk_size,
+                                      estimator, preprocessor)
+        return
+
+    frames = iter(frames)
+    prev_frame = next(frames, None)
+    if prev_frame is None:
+        return
+    # Os buffers do pré-processamento são reutilizados (o frame atual e o anterior)
+    if preprocessor is None:
+        preprocessor = Preprocessor(ring=2)
+    prev_frame = preprocessor.prep(prev_frame)
+    index = 0
+    if records is not None:
+        records.end_frame()
+
+    if state is None:
+        state = {}
+    centers = state.get('centers') or TrackTable()
+    next_id = state.get('next_id', 0)
+
+    # Os pontos de característica são reaproveitados de frame para frame
+    if estimator is None:
+        estimator = MotionEstimator()
+
+    for frame in frames:
+        index += 1
+        with metrics.stage('prep_frame'):
+            frame, frame_eq = preprocessor.prep(frame, 1)
+            # Cópia onde são desenhadas as anotações; segue para o resto do pipeline
+            original_frame = frame_eq.copy() if render else None
+        with metrics.stage('motion_compensation'):
+            frame_transformed, _ = estimator.compensate(prev_frame, frame)
+        if records is not None:
+            records.add_transform(estimator.last_transform)
+        with metrics.stage('filtering'):
+            if roi:
+                rois = coarse_rois(frame_transformed, frame, tracked_points(centers))
+                filtered = filtering_roi(frame_transformed, frame, rois, morph_mode)
+            else:
+                filtered = filtering(frame_transformed, frame, morph_mode)
+        
+        with metrics.stage('find_contours'):
+            original_frame, centers, next_id = find_contours(original_frame, filtered, centers, max_dist, next_id, frames_confirm)
+        if records is not None:
+            records.add_detections(centers)
+            records.end_frame()
+
+        prev_frame = frame
+        metrics.frame(tracked=len(centers))
+        state.update(centers=centers, next_id=next_id)
+        yield original_frame if render else index
+
+class FishStage:
+    # Estágio dos peixes (sem tracking) para o motor com uma só descodificação (utils/engine.py):
+    # as mesmas etapas que process_fish, sobre o frame a preto e branco partilhado.
+    # state tem o mesmo formato que em process_fish.
+    name = 'fish'
+
+    def __init__(self, max_dist=100, frames_confirm=3, estimator=None, morph_mode='exact', state=None, records=None):
+        self.max_dist = max_dist
+        self.frames_confirm = frames_confirm
+        self.estimator = estimator if estimator is not None else MotionEstimator()
+        self.morph_mode = morph_mode
+        self.records = records
+        self.state = state if state is not None else {}
+        self.state['centers'] = self.state.get('centers') or TrackTable()
+        self.state.setdefault('next_id', 0)
+
+    def process(self, shared, prev, canvas):
+        records = self.records
+        if prev is None:
+            # Primeiro frame: só serve de anterior ao segundo
+            return
+        centers, next_id = self.state['centers'], self.state['next_id']
+
+        with metrics.stage('motion_compensation'):
+            frame_transformed, _ = self.estimator.compensate(prev.bw, shared.bw)
+        if records is not None:
+            records.add_transform(self.estimator.last_transform)
+        with metrics.stage('filtering'):
+            filtered = filtering(frame_transformed, shared.bw, self.morph_mode)
+        with metrics.stage('find_contours'):
+            canvas, centers, next_id = find_contours(canvas, filtered, centers, self.max_dist, next_id, self.frames_confirm)
+        if records is not None:
+            records.add_detections(centers)
+        metrics.gauge('tracked_objects', len(centers))
+        self.state.update(centers=centers, next_id=next_id)
+
+def process_fish_pairs(frames, max_dist=100, frames_confirm=3, morph_mode='exact', state=None, records=None, render=True,
+                       workers=1, chunk_size=4, estimator=None, preprocessor=None):
+    # Variante de process_fish em dois estágios: as máscaras de diferença de cada par de frames são
+    # calculadas por pair_masks (o alinhamento e a filtragem em `workers` processos) e aqui só corre, por ordem,
+    # a associação dos contornos. O resultado é o mesmo que o de process_fish.
+    if state is None:
+        state = {}
+    centers = state.get('centers') or TrackTable()
+    next_id = state.get('next_id', 0)
+
+    for index, (frame_eq, filtered, transform) in enumerate(pair_masks(frames, estimator, morph_mode, False, workers, chunk_size,
+                                                                       preprocessor)):
+        if filtered is None:
+            # Primeiro frame: só serve de anterior ao segundo
+            if records is not None:
+                records.end_frame()
+            continue
+
+        if records is not None:
+            records.add_transform(transform)
+        original_frame = frame_eq.copy() if render else None
+        with metrics.stage('find_contours'):
+            original_frame, centers, next_id = find_contours(original_frame, filtered, centers, max_dist, next_id, frames_confirm)
+        if records is not None:
+            records.add_detections(centers)
+            records.end_frame()
+
+        metrics.frame(tracked=len(centers))
+        state.update(centers=centers, next_id=next_id)
+        yield original_frame if render else index
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Deteção de peixes sem tracking")
+    add_sink_arguments(parser, 1 / 10)
+    add_morph_arguments(parser)
+    add_metrics_arguments(parser)
+    add_records_arguments(parser)
+    add_cache_arguments(parser)
+    add_motion_arguments(parser)
+    add_equalize_arguments(parser)
+    parser.add_argument('--roi', action='store_true', help="filtragem só à volta das zonas com movimento e dos contornos anteriores")
+    parser.add_argument('--workers', type=int, help="calcular as máscaras por pares de frames em N processos (0 = todos os cores)")
+    parser.add_argument('--chunk', type=int, default=4, help="frames enviados a cada processo de uma vez (com --workers)")
+    args = parser.parse_args()
+    if args.workers is not None and args.roi:
+        parser.error("--workers não pode ser usado com --roi")
+    if args.cache and args.workers is not None:
+        parser.error("--cache não pode ser usado com --workers")
+    if args.morph_check and args.workers not in (None, 1):
+        parser.error("--morph-check não pode ser usado com --workers em vários processos")
+    configure_from_args(args, 'without_tracking')
+
     # Carregar o vídeo
     cap = cv2.VideoCapture('peixe.MP4')
 
@@ -58,45 +195,41 @@ if __name__ == '__main__':
         print("Erro ao abrir o vídeo.")
         exit()
 
-    # Inicialização de variáveis
-    ret, prev_frame = cap.read()
-    prev_frame = prep_frame(prev_frame)
-
     max_dist = 100  # Distância máxima para considerar o mesmo contorno
-    centers = {}
-    next_id = 0
     frames_confirm = 3
-    processed_frames = []
 
-    print("Processando vídeo")
+    set_iou_check(args.morph_check)
 
-    #Processar todos os frames e armazenar
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frame, original_frame = prep_frame(frame, 1)
-        frame_hsv = cv2.cvtColor(original_frame, cv2.COLOR_BGR2HSV)
-        frame_transformed, _ = motion_compensation(prev_frame, frame)
-        filtered = filtering(frame_transformed, frame)
-        
-        original_frame, centers, next_id = find_contours(original_frame, filtered, centers, max_dist, next_id, frames_confirm)
-
-        prev_frame = frame
-        processed_frames.append(original_frame)
-
-    cap.release()
-    input(f"\nProcessamento concluído: {len(processed_frames)} frames processados.\nPrecione enter tecla para reproduzir o vídeo\n")
-    
-    #Reproduzir os frames processados
-
-    frame_interval = 1 / 10
-
-    for i,frame in enumerate(processed_frames):
-        cv2.imshow('Processed', frame)
-        
-        # Aguardar o tempo necessário para manter 30 FPS
-        if cv2.waitKey(int(frame_interval * 1000)) & 0xFF == ord('q'):
-            break
+    print("Processando vídeo")
 
-    cv2.destroyAllWindows()
\ No newline at end of file
+    # Os frames passam pelo pipeline um a um, com buffers limitados entre estágios
+    # A descodificação corre numa thread à parte e já entrega os frames no tamanho de processamento
+    frames = VideoReader(cap, (1280, 720), args.buffer)
+    records = writer_from_args(args, {'pipeline': 'without_tracking', 'video': 'peixe.MP4', 'width': 1280, 'height': 720, 'frames_confirm': frames_confirm})
+    estimator = make_estimator(args.motion, args.motion_fallback)
+    equalize = equalize_from_args(args)
+    # Com a cache os frames já pré-processados (e as transformações) são lidos do disco em vez do vídeo
+    cache = cache_from_args(args)
+    session = CacheSession(cache, 'peixe.MP4', frames, 'without_tracking', estimator, equalize) if cache is not None else None
+    source = frames if session is None else session.source
+    processed = bounded(process_fish(source, max_dist, frames_confirm, morph_mode=args.morph, roi=args.roi,
+                                     records=records, render=not args.no_render,
+                                     workers=None if args.workers is None else args.workers or os.cpu_count(),
+                                     chunk_size=args.chunk,
+                                     estimator=session.estimator if session is not None else estimator,
+                                     preprocessor=session.preprocessor if session is not None else Preprocessor(equalize=equalize)), args.buffer)
+    run_sink(processed, args, cap.get(cv2.CAP_PROP_FPS) or 30)
+    if records is not None:
+        records.close()
+    if session is not None:
+        # Parar o pipeline antes de fechar a cache (o sink pode ter terminado a meio, ex. 'q' na pré-visualização)
+        processed.close()
+        session.finish()
+    if session is not None and session.hit:
+        print("Frames lidos da cache")
+    else:
+        frames.print_stats()
+    if estimator.compensated:
+        estimator.print_stats()
+    print_iou_report()
+    metrics.export()
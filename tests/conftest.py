@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os scripts e o pacote utils importam-se a partir da pasta code/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
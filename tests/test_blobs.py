@@ -0,0 +1,22 @@
+import cv2
+import numpy as np
+from utils.blobs import Blobs
+
+def external(mask, min_area):
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    moments = [cv2.moments(c) for c in contours]
+    return sorted((M['m00'], M['m10'] / M['m00'], M['m01'] / M['m00']) for M in moments if M['m00'] >= min_area)
+
+def test_blobs_match_external_contours():
+    # Anel com uma ilha no buraco (não conta), blobs grandes e ruído abaixo da área mínima
+    rng = np.random.default_rng(0)
+    mask = ((rng.random((360, 640)) < 0.01) * 255).astype(np.uint8)
+    cv2.ellipse(mask, (200, 180), (120, 80), 0, 0, 360, 255, 6)
+    cv2.circle(mask, (200, 180), 25, 255, -1)
+    cv2.rectangle(mask, (420, 60), (560, 140), 255, -1)
+    cv2.ellipse(mask, (500, 280), (60, 30), 30, 0, 360, 255, -1)
+    for min_area in (1, 250):
+        blobs = Blobs(mask, min_area)
+        found = sorted(zip(blobs.areas, blobs.centroids[:, 0], blobs.centroids[:, 1]))
+        assert np.allclose(found, external(mask, min_area))
+    assert len(Blobs(mask, 250)) == 3
@@ -0,0 +1,23 @@
+import json
+import os
+import subprocess
+import sys
+import evaluate
+
+CODE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code')
+
+def test_synthetic_evaluation(tmp_path):
+    # O harness tem de medir alguma coisa no vídeo sintético, senão o --compare nunca deteta regressões
+    output = tmp_path / 'evaluation.json'
+    subprocess.run([sys.executable, 'evaluate.py', '--frames', '20', '--output', str(output)], cwd=CODE, check=True)
+    with open(output) as f:
+        results = json.load(f)
+    assert results['fish']['tp'] > 0
+    assert results['fish']['recall'] > 0.05
+    assert results['algae']['mean_iou'] > 0.6
+
+def test_compare_flags_drops():
+    baseline = {'fish': {'recall': 0.5, 'mota': 0.2}, 'algae': {'mean_iou': 0.8}}
+    results = {'fish': {'recall': 0.4, 'mota': 0.19}, 'algae': {'mean_iou': 0.81}}
+    regressions = evaluate.compare(results, baseline, 0.02)
+    assert [name for name, _, _ in regressions] == ['fish/recall']
@@ -0,0 +1,40 @@
+import numpy as np
+import with_tracking
+import without_tracking
+from utils.motion import MotionEstimator
+from utils.synthetic import SyntheticVideo
+
+FRAMES = list(SyntheticVideo(10, seed=1))
+
+def run(script, **kwargs):
+    state = {}
+    frames = list(script.process_fish(iter(FRAMES), state=state, **kwargs))
+    return frames, state
+
+def assert_same(a, b):
+    frames_a, state_a = a
+    frames_b, state_b = b
+    assert len(frames_a) == len(frames_b)
+    assert all(np.array_equal(x, y) for x, y in zip(frames_a, frames_b))
+    assert state_a['next_id'] > 0 and state_a['next_id'] == state_b['next_id']
+
+def test_pairs_match_sequential_with_tracking():
+    assert_same(run(with_tracking), run(with_tracking, workers=2, chunk_size=3))
+
+def test_pairs_match_sequential_without_tracking():
+    assert_same(run(without_tracking), run(without_tracking, workers=2, chunk_size=3))
+
+class FlakyEstimator(MotionEstimator):
+    # Falha a estimação de dois em dois pares, para o fallback 'last' ser usado
+    def estimate_pair(self, prev_frame_bw, curr_frame_bw, prev_img=None, curr_img=None):
+        if self.frames % 2:
+            self.frames += 1
+            self.points = None
+            return self._fail(), None
+        return super().estimate_pair(prev_frame_bw, curr_frame_bw, prev_img, curr_img)
+
+def test_fallback_does_not_depend_on_workers():
+    single = run(with_tracking, workers=1, estimator=FlakyEstimator())
+    estimator = FlakyEstimator()
+    assert_same(single, run(with_tracking, workers=2, chunk_size=3, estimator=estimator))
+    assert estimator.failures == 4
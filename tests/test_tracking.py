@@ -0,0 +1,36 @@
+import cv2
+import numpy as np
+import with_tracking
+
+def textured_background(seed=0):
+    # Fundo cinzento com textura, para haver cantos para a compensação de movimento e para o Lucas-Kanade
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 255, (720, 1280), dtype=np.uint8)
+    return cv2.cvtColor(cv2.GaussianBlur(noise, (0, 0), 3), cv2.COLOR_GRAY2BGR)
+
+def moving_fish(n=12, speed=20):
+    # Câmara parada e um peixe claro com riscas a nadar para a direita; as riscas dão textura
+    # ao Lucas-Kanade no centro do peixe, onde fica o ponto seguido
+    background = textured_background()
+    for i in range(n):
+        frame = background.copy()
+        x = 300 + speed * i
+        cv2.ellipse(frame, (x, 360), (45, 20), 0, 0, 360, (255, 255, 255), -1)
+        for dx in range(-40, 41, 10):
+            cv2.line(frame, (x + dx, 340), (x + dx + 5, 380), (200, 200, 200), 2)
+        yield frame
+
+def test_track_follows_points():
+    prev = textured_background()
+    curr = np.roll(prev, (3, 5), axis=(0, 1))
+    tracking = {7: ((640.0, 360.0), True)}
+    _, tracking = with_tracking.track(prev, curr, curr.copy(), tracking)
+    (x, y), active = tracking[7]
+    assert active
+    assert abs(x - 645) < 0.5 and abs(y - 363) < 0.5
+
+def test_process_fish_tracks_ids():
+    # Os IDs seguidos pelo optical flow são desenhados a vermelho puro, que o fundo cinzento não tem
+    frames = list(with_tracking.process_fish(moving_fish()))
+    assert len(frames) == 11
+    assert any(np.all(frame == (0, 0, 255), axis=2).any() for frame in frames)